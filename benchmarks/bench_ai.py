@@ -0,0 +1,88 @@
+"""Нагрузочный прогон пути "вопрос к ИИ" на локальной заглушке модели, без сети.
+
+Показывает собственные накладные расходы бота (сессии, кэш, планировщик,
+потоковые правки) поверх заданной задержки модели.
+
+Запуск из корня проекта:
+    TELEGRAM_TOKEN=test python -m benchmarks.bench_ai --users 500 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from database import db_handler
+from handlers import ai_handler
+from handlers.ai_cache import answer_cache
+from handlers.ai_client import StubClient
+from handlers.ai_scheduler import scheduler
+
+
+class FakeMessage:
+    def __init__(self, text: str = ''):
+        self.text = text
+        self.edits = 0
+
+    async def reply_text(self, text, **kwargs):
+        return FakeMessage(text)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        self.edits += 1
+
+    async def delete(self):
+        pass
+
+
+def make_update(user_id: int, text: str):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=FakeMessage(text))
+
+
+async def user_journey(user_id: int, questions: int, latencies: list):
+    context = SimpleNamespace(user_data={})
+    await ai_handler.start_ai_dialog(make_update(user_id, '/ask'), context)
+    for i in range(questions):
+        # Первый вопрос типовой и повторяется у всех, остальные уникальны
+        text = "Как проверить, что фото фейк?" if i == 0 else f"Вопрос {i} от пользователя {user_id}"
+        start = time.perf_counter()
+        await ai_handler.handle_question(make_update(user_id, text), context)
+        latencies.append(time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--questions', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--output-size', type=int, default=1500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, 'bench.db')
+        db_handler.init_db()
+        client = StubClient(latency=args.latency, output_size=args.output_size)
+        ai_handler.set_client(client)
+
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(user_journey(uid, args.questions, latencies) for uid in range(1, args.users + 1)))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"{len(latencies)} вопросов за {elapsed:.2f} c ({len(latencies) / elapsed:.0f} вопр./с), "
+              f"запросов к модели: {client.requests}")
+        print(f"задержка ответа: p50 {p(0.5):.0f} мс, p95 {p(0.95):.0f} мс, p99 {p(0.99):.0f} мс, "
+              f"среднее {statistics.mean(latencies) * 1000:.0f} мс")
+        print(f"кэш ответов: {answer_cache.stats()}")
+        stats = scheduler.stats()
+        print(f"планировщик: ожидание в очереди p95 {stats['wait_time']['p95']} c, "
+              f"запрос p95 {stats['latency']['p95']} c, повторов {stats['retries']}")
+        db_handler.close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
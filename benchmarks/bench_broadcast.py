@@ -0,0 +1,86 @@
+"""Прогон ежедневной рассылки на фейковом боте: скорость, блокировки, flood control, докачка.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_broadcast --users 3000 --rate 1000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+from database import db_handler
+from handlers import broadcast
+
+
+class FakeBot:
+    """Имитирует Bot API: сетевую задержку, блокировки и редкие RetryAfter."""
+
+    def __init__(self, latency: float, blocked_ratio: float, fail_after: int = None):
+        self.latency = latency
+        self.blocked_ratio = blocked_ratio
+        self.fail_after = fail_after
+        self.sent = []
+
+    async def send_message(self, chat_id, **kwargs):
+        await asyncio.sleep(self.latency)
+        if self.fail_after is not None and len(self.sent) >= self.fail_after:
+            raise asyncio.CancelledError("имитация падения процесса")
+        if random.random() < 0.001:
+            raise RetryAfter(1)
+        if chat_id % int(1 / self.blocked_ratio) == 0:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        if chat_id % 997 == 0:
+            # Ошибка, которую рассылка отдельно не разбирает: получатель считается failed
+            raise TelegramError("Internal Server Error: unexpected")
+        self.sent.append(chat_id)
+
+
+def build_message(lang):
+    return {'text': f"module for {lang}", 'parse_mode': 'HTML'}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--rate', type=float, default=broadcast.BROADCAST_RATE)
+    parser.add_argument('--concurrency', type=int, default=broadcast.BROADCAST_CONCURRENCY)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, 'bench.db')
+        db_handler.init_db()
+        conn = sqlite3.connect(db_handler.DB_PATH)
+        with conn:
+            conn.executemany("INSERT INTO users (user_id, language_code) VALUES (?, ?)",
+                             [(uid, random.choice(['ru', 'en'])) for uid in range(1, args.users + 1)])
+        conn.close()
+
+        # Первый запуск "падает" на середине, второй продолжает с контрольной точки
+        crashing_bot = FakeBot(args.latency, 0.02, fail_after=args.users // 2)
+        try:
+            await broadcast.run_broadcast(crashing_bot, 'bench', build_message,
+                                          concurrency=args.concurrency, rate=args.rate)
+        except asyncio.CancelledError:
+            print(f"первый запуск прерван после {len(crashing_bot.sent)} отправок")
+
+        bot = FakeBot(args.latency, 0.02)
+        result = await broadcast.run_broadcast(bot, 'bench', build_message,
+                                               concurrency=args.concurrency, rate=args.rate)
+        duplicates = len(set(crashing_bot.sent) & set(bot.sent))
+        print(f"итог: {result['sent']} отправлено, {result['blocked']} заблокировали, "
+              f"{result['failed']} ошибок, {result['throughput']:.0f} сообщ./с, "
+              f"повторных отправок после перезапуска: {duplicates}")
+        assert duplicates == 0, f"после перезапуска повторно отправлено {duplicates} сообщений"
+        assert result['status'] == 'done'
+        db_handler.close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
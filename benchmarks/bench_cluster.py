@@ -0,0 +1,150 @@
+"""Пропускная способность режима нескольких процессов (cluster.py) в сравнении с одним воркером.
+
+Диспетчер распределяет обновления виртуальных пользователей по воркерам, как в
+работе; воркеры — настоящие Application с фейковым Bot API (FakeTelegram из
+load_test) и заглушкой модели. Окончание обработки определяется по счетчикам
+bot_update_processor{stat="processed"} и {stat="dropped"} на /metrics каждого
+воркера: обновления пользователя идут подряд, без ожидания ответа, поэтому часть
+из них отбрасывается лимитом UPDATE_MAX_PENDING_PER_USER. Проверяется, что каждый
+воркер получил ровно обновления своих пользователей.
+
+Ускорение ограничено числом ядер: на одном ядре воркеры только делят его.
+
+Запуск из корня проекта:
+    TELEGRAM_TOKEN=123:test python -m benchmarks.bench_cluster --users 2000 --workers 1,4
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import secrets
+import tempfile
+import time
+
+os.environ.setdefault('TELEGRAM_TOKEN', '123:test')
+os.environ.setdefault('METRICS_PORT', '9310')
+os.environ.setdefault('SHARD_BASE_PORT', '8610')
+
+import httpx
+
+import cluster
+from config import METRICS_PORT
+from database import db_handler
+from handlers.utils import translations
+
+HANDLED_RE = re.compile(r'^bot_update_processor\{stat="(?:processed|dropped)"\} (\d+)$', re.MULTILINE)
+
+
+def _bench_worker(index: int, count: int, secret: str, db_path: str):
+    """Воркер с фейковым Bot API: подменяет транспорт в bot.build_application."""
+    logging.basicConfig(level=logging.WARNING)
+    db_handler.DB_PATH = db_path
+
+    import bot
+    from benchmarks.load_test import FakeTelegram
+    from handlers import ai_handler
+    from handlers.ai_client import StubClient
+
+    ai_handler.set_client(StubClient(latency=0.0))
+    build_application = bot.build_application
+    bot.build_application = lambda **kwargs: build_application(token='123:test', request=FakeTelegram(), **kwargs)
+    asyncio.run(cluster._run_worker(index, count, secret))
+
+
+def build_updates(users: int) -> list[dict]:
+    """Обновления вперемешку по пользователям: /start и переходы по главному меню."""
+    buttons = translations['ru']
+    script = ['/start', buttons['main_menu_module'], buttons['main_menu_quiz'], '/cancel',
+              buttons['main_menu_store'], buttons['main_menu_debunk'], '/cancel']
+    update_ids = itertools.count(1)
+    updates = []
+    for text in script:
+        for user_id in range(1, users + 1):
+            message = {
+                'message_id': next(update_ids),
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"},
+                'text': text,
+            }
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+            updates.append({'update_id': message['message_id'], 'message': message})
+    return updates
+
+
+async def handled_counts(client: httpx.AsyncClient, workers: int) -> list[int | None]:
+    counts = []
+    for index in range(workers):
+        try:
+            response = await client.get(f"http://127.0.0.1:{METRICS_PORT + 1 + index}/metrics")
+            values = HANDLED_RE.findall(response.text)
+            counts.append(sum(map(int, values)) if len(values) == 2 else None)
+        except httpx.HTTPError:
+            counts.append(None)
+    return counts
+
+
+async def run(workers: int, updates: list[dict]) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench_cluster.db')
+        db_handler.DB_PATH = db_path
+        db_handler.init_db()
+        secret = secrets.token_urlsafe(16)
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=_bench_worker, args=(index, workers, secret, db_path))
+                     for index in range(workers)]
+        for process in processes:
+            process.start()
+
+        dispatcher = cluster.Dispatcher(workers, secret)
+        links = [asyncio.create_task(link.run()) for link in dispatcher.links]
+        expected = [0] * workers
+        for data in updates:
+            expected[cluster.shard_for_update(data, workers)] += 1
+        try:
+            async with httpx.AsyncClient(timeout=5.0) as client:
+                # Ждем, пока все воркеры поднимутся
+                while None in await handled_counts(client, workers):
+                    await asyncio.sleep(0.2)
+                start = time.perf_counter()
+                for data in updates:
+                    await dispatcher.dispatch(data)
+                await dispatcher.drain()
+                while True:
+                    counts = await handled_counts(client, workers)
+                    if all(count is not None and count >= total for count, total in zip(counts, expected)):
+                        break
+                    await asyncio.sleep(0.05)
+                elapsed = time.perf_counter() - start
+        finally:
+            for task in links:
+                task.cancel()
+            await dispatcher.client.aclose()
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join(30)
+        assert counts == expected, f"воркеры обработали {counts}, ожидалось {expected}"
+        return {'elapsed': elapsed, 'per_worker': counts}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--workers', default=f"1,{os.cpu_count()}", help="варианты числа воркеров через запятую")
+    args = parser.parse_args()
+
+    updates = build_updates(args.users)
+    print(f"Ядер: {os.cpu_count()}, пользователей: {args.users}, обновлений: {len(updates)}")
+    for workers in sorted({int(value) for value in args.workers.split(',')}):
+        result = await run(workers, updates)
+        print(f"Воркеров {workers}: {result['elapsed']:.2f} c, {len(updates) / result['elapsed']:.0f} обновлений/с, "
+              f"по воркерам {result['per_worker']}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""Сравнение пропускной способности слоя БД: старый (connect на каждый вызов) и новый.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_db --users 5000
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+from database import db_handler
+
+
+# --- Старая реализация: новое соединение на каждый запрос, прямо в event loop ---
+
+def legacy_get_or_create_user(path, user_id):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+    user = cursor.fetchone()
+    if not user:
+        cursor.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, None))
+        conn.commit()
+        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        user = cursor.fetchone()
+    conn.close()
+    return {'user_id': user[0], 'username': user[1], 'language_code': user[2], 'xp': user[3]}
+
+
+def legacy_mark_module_as_seen(path, user_id, module_id):
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT OR REPLACE INTO seen_modules (user_id, module_id, seen_date) VALUES (?, ?, ?)",
+                 (user_id, module_id, datetime.now().date().isoformat()))
+    conn.commit()
+    conn.close()
+
+
+def legacy_get_seen_modules(path, user_id):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT DISTINCT module_id FROM seen_modules "
+                        "WHERE user_id = ? AND seen_date >= date('now', '-7 days')", (user_id,)).fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+
+def legacy_change_xp(path, user_id, amount):
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE users SET xp = xp + ? WHERE user_id = ?", (amount, user_id))
+    conn.commit()
+    conn.close()
+
+
+async def legacy_handler(path, user_id):
+    """Типичная последовательность запросов обработчика модуля и квиза."""
+    legacy_get_or_create_user(path, user_id)
+    legacy_mark_module_as_seen(path, user_id, user_id % 7 + 1)
+    legacy_get_or_create_user(path, user_id)
+    legacy_get_seen_modules(path, user_id)
+    legacy_change_xp(path, user_id, 10)
+
+
+async def new_handler(user_id):
+    await db_handler.get_or_create_user(user_id)
+    await db_handler.mark_module_as_seen(user_id, user_id % 7 + 1)
+    await db_handler.get_or_create_user(user_id)
+    await db_handler.get_seen_modules_for_quiz(user_id)
+    await db_handler.change_xp(user_id, 10)
+
+
+async def _loop_lag_probe(stop: asyncio.Event, samples: list):
+    """Замеряет, насколько event loop опаздывает с пробуждением (блокировки)."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        samples.append(time.perf_counter() - start - 0.005)
+
+
+async def run(label, make_coro, users, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    stop = asyncio.Event()
+    lag = []
+    probe = asyncio.create_task(_loop_lag_probe(stop, lag))
+
+    async def one(user_id):
+        async with semaphore:
+            await make_coro(user_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(uid) for uid in range(1, users + 1)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    max_lag = max(lag) * 1000 if lag else float('nan')
+    print(f"{label:>8}: {users} обработчиков за {elapsed:.2f} c, "
+          f"{users / elapsed:.0f} обработчиков/с, макс. задержка loop {max_lag:.1f} мс")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        db_handler.DB_PATH = legacy_path
+        db_handler.init_db()
+        # Старая база работала в режиме rollback journal
+        sqlite3.connect(legacy_path).execute("PRAGMA journal_mode=DELETE").close()
+        await run('legacy', lambda uid: legacy_handler(legacy_path, uid), args.users, args.concurrency)
+
+        db_handler.DB_PATH = os.path.join(tmp, 'new.db')
+        db_handler.init_db()
+        await run('new', new_handler, args.users, args.concurrency)
+        await db_handler.flush()
+        stats = db_handler.write_buffer.stats
+        print(f"буфер записи: {stats['buffered']} изменений -> {stats['flushed_rows']} строк "
+              f"в {stats['transactions']} транзакциях")
+        db_handler.close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""Рейтинг на большой базе: наивный подсчет места против индекса и снимка рангов.
+
+Заполняет временную БД пользователями со случайным XP и недельными суммами,
+затем сравнивает "мое место" через COUNT(*) без индекса, с индексом idx_users_xp
+и бинарным поиском по снимку RankSnapshot.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_leaderboard --users 1000000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import date
+
+from database import db_handler
+from database.write_buffer import week_start
+from handlers import leaderboard
+
+
+def fill(conn, users: int, weekly_share: float):
+    week = week_start(date.today())
+    batch = 50000
+    with conn:
+        for start in range(1, users + 1, batch):
+            rows = [(uid, None, 'ru', int(random.expovariate(1 / 300)))
+                    for uid in range(start, min(start + batch, users + 1))]
+            conn.executemany("INSERT INTO users (user_id, username, language_code, xp) VALUES (?, ?, ?, ?)", rows)
+            weekly = [(week, uid, xp) for uid, _, _, xp in rows if random.random() < weekly_share]
+            conn.executemany("INSERT INTO weekly_xp (week_start, user_id, xp) VALUES (?, ?, ?)", weekly)
+
+
+def timed(conn, sql, params, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - start) / repeat
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--weekly-share', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, 'leaderboard.db')
+        db_handler.init_db()
+        conn = db_handler._connect()
+        start = time.perf_counter()
+        fill(conn, args.users, args.weekly_share)
+        print(f"Заполнено {args.users} пользователей за {time.perf_counter() - start:.1f} c")
+
+        my_xp = 300
+        rank_sql = "SELECT COUNT(*) FROM users WHERE xp > ?"
+        top_sql = "SELECT user_id, username, xp FROM users ORDER BY xp DESC LIMIT 10"
+        with_index_rank = timed(conn, rank_sql, (my_xp,), args.repeat)
+        with_index_top = timed(conn, top_sql, (), args.repeat)
+        conn.execute("DROP INDEX idx_users_xp")
+        naive_rank = timed(conn, rank_sql, (my_xp,), args.repeat)
+        naive_top = timed(conn, top_sql, (), args.repeat)
+        conn.execute("CREATE INDEX idx_users_xp ON users (xp DESC)")
+        conn.close()
+
+        start = time.perf_counter()
+        snapshot = await leaderboard.refresh()
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(100000):
+            snapshot.rank(my_xp)
+        lookup = (time.perf_counter() - start) / 100000
+
+        print(f"Топ-10:      без индекса {naive_top * 1000:8.2f} мс, с индексом {with_index_top * 1000:8.3f} мс")
+        print(f"Мое место:   без индекса {naive_rank * 1000:8.2f} мс, с индексом {with_index_rank * 1000:8.2f} мс, "
+              f"по снимку {lookup * 1e6:.2f} мкс")
+        print(f"Снимок:      построен за {build:.2f} c, {snapshot.total} пользователей, "
+              f"{len(snapshot.weekly_xp)} за неделю, место с {my_xp} XP: {snapshot.rank(my_xp)}")
+        db_handler.close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""Стоимость проверки кнопок главного меню на одно обновление: regex-фильтры против индекса.
+
+Для каждого текстового обновления проверяются все фильтры кнопок и общий
+фильтр "любая кнопка меню" — так, как это делают обработчики в bot.py.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_menu --updates 20000
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+from telegram.ext import filters
+
+from handlers.menu import MENU_ACTIONS, MenuButton
+from handlers.utils import translations
+
+
+def legacy_filters():
+    """Прежние фильтры: OR из regex по каждому языку."""
+    by_action = {}
+    for action in MENU_ACTIONS:
+        regexes = [filters.Regex(f"^{lang_translations[action]}$") for lang_translations in translations.values()]
+        combined = regexes[0]
+        for regex in regexes[1:]:
+            combined = combined | regex
+        by_action[action] = filters.TEXT & combined
+    any_button = None
+    for action_filter in by_action.values():
+        any_button = action_filter if any_button is None else any_button | action_filter
+    return list(by_action.values()) + [any_button]
+
+
+def router_filters():
+    return [MenuButton(action) for action in MENU_ACTIONS] + [MenuButton()]
+
+
+def make_updates(count: int, menu_share: float):
+    buttons = [lang_translations[action] for lang_translations in translations.values() for action in MENU_ACTIONS]
+    chat = Chat(1, Chat.PRIVATE)
+    updates = []
+    for i in range(count):
+        if random.random() < menu_share:
+            text = random.choice(buttons)
+        else:
+            text = f"Как проверить новость про {random.randint(1, 10 ** 6)}?"
+        updates.append(Update(i, message=Message(i, datetime.now(), chat, text=text)))
+    return updates
+
+
+def measure(filter_list, updates) -> tuple[float, int]:
+    matches = 0
+    start = time.perf_counter()
+    for update in updates:
+        for menu_filter in filter_list:
+            if menu_filter.check_update(update):
+                matches += 1
+    return (time.perf_counter() - start) / len(updates), matches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--menu-share', type=float, default=0.5)
+    args = parser.parse_args()
+
+    random.seed(1)
+    updates = make_updates(args.updates, args.menu_share)
+    legacy, legacy_matches = measure(legacy_filters(), updates)
+    router, router_matches = measure(router_filters(), updates)
+    assert legacy_matches == router_matches, (legacy_matches, router_matches)
+    print(f"Языков: {len(translations)}, обновлений: {len(updates)}, совпадений: {router_matches}")
+    print(f"regex-фильтры: {legacy * 1e6:6.2f} мкс на обновление")
+    print(f"индекс меню:   {router * 1e6:6.2f} мкс на обновление")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""Время подготовки сообщения модуля и клавиатуры магазина: рендер на каждый вызов против кэша.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_render
+"""
+import timeit
+
+from handlers import modules, render_cache
+from handlers.content import get_repository
+
+
+def main():
+    number = 20000
+    module = modules.get_today_module('en')
+    repository = get_repository()
+    render_cache.warm_up(repository)
+
+    cases = [
+        ('модуль, рендер', lambda: render_cache.render_module_message(module, 'en')),
+        ('модуль, кэш', lambda: render_cache.module_message(module, 'en')),
+        ('магазин, рендер', lambda: render_cache.render_store_keyboard(repository.stickers, 'en')),
+        ('магазин, кэш', lambda: render_cache.store_keyboard(repository.stickers, 'en')),
+    ]
+    for label, func in cases:
+        seconds = timeit.timeit(func, number=number)
+        print(f"{label:>16}: {seconds / number * 1e6:8.2f} мкс на сообщение")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Индексы seen_modules / solved_debunks и очистка на таблице в несколько миллионов строк.
+
+Проверяет через EXPLAIN QUERY PLAN, что запросы квиза и разборов идут по
+покрывающим индексам, сравнивает время запроса без индекса и с ним, и
+измеряет ежедневную очистку (db_handler.compact).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_schema --users 300000 --modules 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from database import db_handler
+
+SEEN_SQL = ("SELECT module_id FROM seen_modules "
+            "WHERE user_id = ? AND seen_date >= date('now', '-7 days')")
+SOLVED_SQL = "SELECT case_id FROM solved_debunks WHERE user_id = ?"
+
+# Запрос -> индекс, который должен быть в плане
+EXPECTED_PLANS = {
+    SEEN_SQL: 'USING COVERING INDEX idx_seen_modules_user_date',
+    SOLVED_SQL: 'USING COVERING INDEX sqlite_autoindex_solved_debunks_1',
+}
+
+
+def query_plan(conn, sql, params) -> str:
+    return '; '.join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def fill(conn, users: int, modules: int, cases: int, days: int):
+    today = date.today()
+    batch = 20000
+    with conn:
+        for start in range(1, users + 1, batch):
+            ids = range(start, min(start + batch, users + 1))
+            conn.executemany("INSERT INTO users (user_id) VALUES (?)", [(uid,) for uid in ids])
+            conn.executemany("INSERT INTO seen_modules (user_id, module_id, seen_date) VALUES (?, ?, ?)", [
+                (uid, module_id, (today - timedelta(days=random.randrange(days))).isoformat())
+                for uid in ids for module_id in range(1, modules + 1)])
+            conn.executemany("INSERT INTO solved_debunks (user_id, case_id, solved_date) VALUES (?, ?, ?)", [
+                (uid, f"case_{case}", today.isoformat())
+                for uid in ids for case in random.sample(range(cases * 2), cases)])
+
+
+def timed(conn, sql, users: int, repeat: int) -> float:
+    ids = [random.randint(1, users) for _ in range(repeat)]
+    start = time.perf_counter()
+    for uid in ids:
+        conn.execute(sql, (uid,)).fetchall()
+    return (time.perf_counter() - start) / repeat
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=300000)
+    parser.add_argument('--modules', type=int, default=10)
+    parser.add_argument('--cases', type=int, default=3)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, 'schema.db')
+        db_handler.init_db()
+        conn = db_handler._connect()
+        start = time.perf_counter()
+        fill(conn, args.users, args.modules, args.cases, args.days)
+        conn.execute("ANALYZE")
+        rows = conn.execute("SELECT COUNT(*) FROM seen_modules").fetchone()[0]
+        print(f"seen_modules: {rows} строк, заполнено за {time.perf_counter() - start:.1f} c")
+
+        for sql, expected in EXPECTED_PLANS.items():
+            plan = query_plan(conn, sql, (1,))
+            status = 'OK' if expected in plan else 'НЕ ТОТ ПЛАН'
+            print(f"[{status}] {plan}")
+            assert expected in plan, f"ожидался {expected}"
+
+        indexed = timed(conn, SEEN_SQL, args.users, args.repeat)
+        solved = timed(conn, SOLVED_SQL, args.users, args.repeat)
+        conn.execute("DROP INDEX idx_seen_modules_user_date")
+        # Новое соединение: закэшированный EXPLAIN показал бы прежний план
+        conn.close()
+        conn = db_handler._connect()
+        print(f"без индекса: {query_plan(conn, SEEN_SQL, (1,))}")
+        pk_only = timed(conn, SEEN_SQL, args.users, args.repeat)
+        conn.execute("CREATE INDEX idx_seen_modules_user_date ON seen_modules (user_id, seen_date, module_id)")
+        conn.close()
+        print(f"квиз: только PK {pk_only * 1e6:.1f} мкс, покрывающий индекс {indexed * 1e6:.1f} мкс; "
+              f"разборы: {solved * 1e6:.1f} мкс на запрос")
+
+        start = time.perf_counter()
+        deleted = await db_handler.compact()
+        print(f"очистка: {deleted} за {time.perf_counter() - start:.1f} c")
+        db_handler.close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""Сравнение последовательной обработки обновлений и PerUserUpdateProcessor.
+
+Часть пользователей "медленные" (как долгий запрос к ИИ), остальные — быстрые
+команды. Проверяется, что обновления одного пользователя идут строго по порядку.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_updates --users 200 --slow-users 10 --slow 2.0
+"""
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from telegram.ext import SimpleUpdateProcessor
+
+from handlers.update_processor import PerUserUpdateProcessor
+
+
+async def run(processor, updates, fast: float, slow: float, slow_users: set):
+    order: dict[int, list[int]] = {}
+    fast_latency = []
+
+    async def handle(user_id: int, seq: int):
+        await asyncio.sleep(slow if user_id in slow_users else fast)
+        order.setdefault(user_id, []).append(seq)
+        if user_id not in slow_users:
+            # Все обновления пришли пачкой в момент start
+            fast_latency.append(time.monotonic() - start)
+
+    async with processor:
+        start = time.monotonic()
+        tasks = []
+        for seq, user_id in enumerate(updates):
+            update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+            coroutine = handle(user_id, seq)
+            if processor.max_concurrent_updates > 1:
+                tasks.append(asyncio.create_task(processor.process_update(update, coroutine)))
+            else:
+                await processor.process_update(update, coroutine)
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+
+    assert all(seqs == sorted(seqs) for seqs in order.values()), "нарушен порядок обновлений пользователя"
+    fast_latency.sort()
+    p95 = fast_latency[int(len(fast_latency) * 0.95)] if fast_latency else 0.0
+    return elapsed, p95
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--slow-users', type=int, default=10)
+    parser.add_argument('--fast', type=float, default=0.005)
+    parser.add_argument('--slow', type=float, default=2.0)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    random.seed(1)
+    updates = [random.randint(1, args.users) for _ in range(args.updates)]
+    slow_users = set(range(1, args.slow_users + 1))
+    slow_count = sum(user_id in slow_users for user_id in updates)
+    print(f"{args.updates} обновлений от {args.users} пользователей, медленных обновлений: {slow_count}")
+
+    if slow_count * args.slow <= 60:
+        elapsed, p95 = await run(SimpleUpdateProcessor(1), updates, args.fast, args.slow, slow_users)
+        print(f"последовательно:   {elapsed:6.2f} c, p95 ответа быстрым пользователям {p95:.3f} c")
+    else:
+        print("последовательно:   пропущено (дольше минуты)")
+
+    processor = PerUserUpdateProcessor(args.concurrency)
+    elapsed, p95 = await run(processor, updates, args.fast, args.slow, slow_users)
+    stats = processor.stats()
+    print(f"по пользователям:  {elapsed:6.2f} c, p95 ответа быстрым пользователям {p95:.3f} c")
+    print(f"ожидание в очереди: avg {stats['wait_time']['avg']:.3f} c, p95 <= {stats['wait_time']['p95']} c")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
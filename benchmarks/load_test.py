@@ -0,0 +1,253 @@
+"""Сквозной нагрузочный прогон: настоящий Application из bot.py, фейковый Bot API и заглушка модели.
+
+Каждый виртуальный пользователь проходит сценарий
+/start -> язык -> модуль -> квиз -> разбор фейка -> магазин -> вопрос ИИ,
+отправляя следующее обновление после ответа бота на предыдущее. Обновления
+проходят через тот же процессор обновлений, что и в работе (PerUserUpdateProcessor).
+Запросы к Telegram перехватывает FakeTelegram (BaseRequest): он отвечает как
+Bot API и запоминает сообщения, чтобы пользователи нажимали настоящие кнопки.
+
+Запуск из корня проекта:
+    TELEGRAM_TOKEN=123:test python -m benchmarks.load_test --users 2000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+from database import db_handler
+
+BOT_ID = 777000
+
+
+class FakeTelegram(BaseRequest):
+    """Транспорт Bot API в памяти: отвечает на вызовы методов без сети."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: dict[str, int] = {}
+        self.last_markup: dict[int, tuple[dict, dict]] = {}  # chat_id -> (сообщение, inline-клавиатура)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params: dict, **content) -> dict:
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'SuriMIL'},
+            **content,
+        }
+        markup = params.get('reply_markup')
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        if markup and 'inline_keyboard' in markup:
+            message['reply_markup'] = markup
+            self.last_markup[chat_id] = (message, markup)
+        return message
+
+    def _file(self, prefix: str) -> dict:
+        number = next(self._file_ids)
+        return {'file_id': f"{prefix}{number}", 'file_unique_id': f"u{prefix}{number}"}
+
+    def _result(self, method: str, params: dict):
+        if method == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'SuriMIL', 'username': 'surimil_bot'}
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(params, text=params.get('text', ''))
+        if method == 'sendSticker':
+            return self._message(params, sticker={**self._file('sticker'), 'type': 'regular', 'width': 512,
+                                                  'height': 512, 'is_animated': False, 'is_video': False})
+        if method == 'sendPhoto':
+            return self._message(params, caption=params.get('caption'),
+                                 photo=[{**self._file('photo'), 'width': 800, 'height': 600}])
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({'ok': True, 'result': self._result(api_method, params)}).encode()
+
+
+class Traffic:
+    """Строит обновления виртуальных пользователей и передает их приложению."""
+
+    def __init__(self, application, telegram: FakeTelegram):
+        self.application = application
+        self.telegram = telegram
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(10 ** 9)
+        self.latencies: list[float] = []
+
+    def _user(self, user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+    async def send(self, data: dict):
+        update = Update.de_json({'update_id': next(self._update_ids), **data}, self.application.bot)
+        started = time.perf_counter()
+        await self.application.update_processor.process_update(update, self.application.process_update(update))
+        self.latencies.append(time.perf_counter() - started)
+
+    async def text(self, user_id: int, text: str):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        await self.send({'message': message})
+
+    async def tap(self, user_id: int, choose) -> bool:
+        """Нажимает кнопку последней inline-клавиатуры; choose выбирает callback_data."""
+        message, markup = self.telegram.last_markup.get(user_id, (None, None))
+        if message is None:
+            return False
+        options = [button['callback_data'] for row in markup['inline_keyboard'] for button in row
+                   if 'callback_data' in button]
+        data = choose(options)
+        if data is None:
+            return False
+        del self.telegram.last_markup[user_id]
+        await self.send({'callback_query': {
+            'id': str(next(self._update_ids)),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'message': message,
+            'data': data,
+        }})
+        return True
+
+
+def _pick(prefix: str, exclude: str = None):
+    def choose(options):
+        matching = [option for option in options if option.startswith(prefix) and option != exclude]
+        return random.choice(matching) if matching else None
+    return choose
+
+
+async def journey(traffic: Traffic, user_id: int, lang: str, buttons: dict, think_time: float):
+    async def pause():
+        if think_time:
+            await asyncio.sleep(random.uniform(0, think_time * 2))
+
+    await traffic.text(user_id, '/start')
+    await pause()
+    await traffic.tap(user_id, _pick(f'set_lang_{lang}'))
+    await pause()
+    await traffic.text(user_id, buttons['main_menu_module'])
+    await pause()
+    await traffic.text(user_id, buttons['main_menu_quiz'])
+    while await traffic.tap(user_id, _pick('ans_')):
+        await pause()
+    await traffic.text(user_id, buttons['main_menu_debunk'])
+    while await traffic.tap(user_id, _pick('debunk_', exclude='debunk_cancel')):
+        await pause()
+    await traffic.text(user_id, buttons['main_menu_store'])
+    await pause()
+    await traffic.tap(user_id, _pick('buy_sticker_'))
+    await pause()
+    await traffic.text(user_id, buttons['main_menu_ask'])
+    await traffic.text(user_id, random.choice([
+        "Как проверить, что новость не фейк?",
+        "How do I check a photo with reverse image search?",
+        f"Правда ли новость номер {user_id % 50}?",
+    ]))
+    await traffic.text(user_id, '/cancel')
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--think-time', type=float, default=0.05, help="средняя пауза пользователя, с")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="задержка фейкового Bot API, с")
+    parser.add_argument('--ai-latency', type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_handler.DB_PATH = os.path.join(tmp, 'load_test.db')
+        os.environ.setdefault('TELEGRAM_TOKEN', '123:test')
+
+        import bot
+        from handlers import ai_handler, hot_reload
+        from handlers.ai_client import StubClient
+        from handlers.instrumentation import HANDLER_SECONDS
+        from handlers.utils import translations
+
+        # Логи каждого запуска задач и обновлений только мешают читать результат
+        logging.getLogger().setLevel(logging.WARNING)
+        db_handler.init_db()
+        hot_reload.init_content_version()
+        ai_handler.set_client(StubClient(latency=args.ai_latency))
+        telegram = FakeTelegram(args.api_latency)
+        application = bot.build_application(token='123:test', request=telegram)
+        traffic = Traffic(application, telegram)
+
+        langs = [lang for lang in ('ru', 'en') if lang in translations]
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        async with application:
+            await application.start()
+            db_calls_before = db_handler.DB_CALL_SECONDS.total_count()
+            start = time.perf_counter()
+            await asyncio.gather(*(
+                journey(traffic, user_id, lang, translations[lang], args.think_time)
+                for user_id, lang in zip(range(1, args.users + 1), itertools.cycle(langs))
+            ))
+            elapsed = time.perf_counter() - start
+            db_calls = db_handler.DB_CALL_SECONDS.total_count() - db_calls_before
+            await application.stop()
+        db_handler.close_db()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        latencies = traffic.latencies
+        processor = application.update_processor
+        print(f"Пользователей: {args.users}, обновлений: {len(latencies)} за {elapsed:.1f} c "
+              f"({len(latencies) / elapsed:.0f} обновлений/с)")
+        print(f"Задержка обработки: p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.1f} мс, p99 {percentile(latencies, 0.99) * 1000:.1f} мс")
+        print(f"Обращений к БД на обновление: {db_calls / max(len(latencies), 1):.2f}")
+        print(f"Вызовы Bot API: {dict(sorted(telegram.calls.items()))}")
+        print(f"Ожидание в очереди обновлений: {processor.stats()['wait_time']['avg'] * 1000:.1f} мс в среднем, "
+              f"отброшено сверх лимита пользователя: {processor.stats()['dropped']}")
+        slowest = sorted(HANDLER_SECONDS.children.items(), key=lambda item: item[1].sum, reverse=True)[:3]
+        print("Больше всего времени в обработчиках: " + ', '.join(
+            f"{name} {child.sum:.1f} c / {child.count}" for (name,), child in slowest))
+        print(f"Память (max RSS): {rss_before / 1024:.0f} -> {rss_after / 1024:.0f} МБ")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+"""Отправляет записанные обновления Telegram на локальный webhook.
+
+Файл — JSON Lines, по одному объекту Update на строку. Запуск из корня проекта:
+    python -m benchmarks.replay_updates updates.jsonl --url http://127.0.0.1:8443/telegram --secret <токен>
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    with open(args.path, 'r', encoding='utf-8') as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+
+    headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses = {}
+
+    async with httpx.AsyncClient(headers=headers) as client:
+        async def post(update):
+            async with semaphore:
+                response = await client.post(args.url, json=update)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in updates))
+        elapsed = time.perf_counter() - start
+
+    print(f"{len(updates)} обновлений за {elapsed:.2f} c ({len(updates) / elapsed:.0f}/с), коды ответов: {statuses}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
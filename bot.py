@@ -9,52 +9,99 @@ from telegram.ext import (
     ConversationHandler,
 )
 
-from config import TELEGRAM_TOKEN
+from config import (
+    TELEGRAM_TOKEN, CONTENT_RELOAD_INTERVAL, PERSISTENCE_UPDATE_INTERVAL, AI_BACKEND, GEMINI_API_KEY,
+    BOT_MODE, UPDATE_CONCURRENCY, UPDATE_MAX_PENDING, UPDATE_MAX_PENDING_PER_USER, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL,
+    WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS, METRICS_HOST, METRICS_PORT, LOG_FORMAT, LOG_LEVEL, WORKERS,
+)
+import logging_setup
+import metrics
+import sharding
 from database import db_handler
-from handlers import common, modules, store, quiz, ai_handler, debunk
+from database.persistence import SQLitePersistence
+from handlers import common, modules, store, quiz, ai_handler, ai_sessions, debunk, hot_reload, leaderboard, stats
+from handlers.instrumentation import instrument_application
+from handlers.menu import MenuButton
+from handlers.update_processor import PerUserUpdateProcessor
 from handlers.utils import get_text
 
 
-# Включаем логирование
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
+# Включаем логирование (LOG_FORMAT=json — структурированные логи)
+logging_setup.configure(LOG_FORMAT, LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
-# Определяем фильтры для кнопок главного меню на разных языках
-module_button_filter = filters.TEXT & (
-        filters.Regex(f"^{get_text('main_menu_module', 'ru')}$") |
-        filters.Regex(f"^{get_text('main_menu_module', 'en')}$")
-)
-store_button_filter = filters.TEXT & (
-        filters.Regex(f"^{get_text('main_menu_store', 'ru')}$") |
-        filters.Regex(f"^{get_text('main_menu_store', 'en')}$")
-)
-quiz_button_filter = filters.TEXT & (
-        filters.Regex(f"^{get_text('main_menu_quiz', 'ru')}$") |
-        filters.Regex(f"^{get_text('main_menu_quiz', 'en')}$")
-)
-ask_button_filter = filters.TEXT & (
-        filters.Regex(f"^{get_text('main_menu_ask', 'ru')}$") |
-        filters.Regex(f"^{get_text('main_menu_ask', 'en')}$")
-)
-debunk_button_filter = filters.TEXT & (
-        filters.Regex(f"^{get_text('main_menu_debunk', 'ru')}$") |
-        filters.Regex(f"^{get_text('main_menu_debunk', 'en')}$")
-)
-main_menu_buttons_filter = (
-    module_button_filter | store_button_filter | quiz_button_filter |
-    debunk_button_filter | ask_button_filter
-)
-
-
-def main() -> None:
-    """Основная функция запуска бота."""
-    # Инициализация БД при старте
-    db_handler.init_db()
-
-    # Создание Application
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+# Фильтры для кнопок главного меню: текст кнопки на любом языке из locales/
+# ищется в обратном индексе (handlers/menu.py), который обновляется при горячей перезагрузке
+module_button_filter = MenuButton('main_menu_module')
+store_button_filter = MenuButton('main_menu_store')
+quiz_button_filter = MenuButton('main_menu_quiz')
+ask_button_filter = MenuButton('main_menu_ask')
+debunk_button_filter = MenuButton('main_menu_debunk')
+main_menu_buttons_filter = MenuButton()
+
+
+async def on_startup(application: Application) -> None:
+    """Запускает HTTP-эндпоинт /metrics в event loop бота."""
+    if METRICS_PORT:
+        application.bot_data['metrics_server'] = await metrics.start_http_server(METRICS_HOST, METRICS_PORT)
+
+
+async def on_shutdown(application: Application) -> None:
+    """Останавливает /metrics и закрывает соединения с БД при остановке бота."""
+    server = application.bot_data.pop('metrics_server', None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    db_handler.close_db()
+
+
+def register_update_metrics(processor: PerUserUpdateProcessor):
+    metrics.REGISTRY.histogram(
+        'bot_update_wait_seconds', "Ожидание обновления в очереди пользователя", buckets=metrics.FAST_BUCKETS,
+    ).attach(processor.wait_time)
+    metrics.REGISTRY.histogram(
+        'bot_update_processing_seconds', "Полное время обработки обновления", buckets=metrics.FAST_BUCKETS,
+    ).attach(processor.processing_time)
+    metrics.REGISTRY.stats_gauge('bot_update_processor', "Состояние процессора обновлений", processor.stats)
+
+
+async def notify_busy(update) -> None:
+    """on_overflow для PerUserUpdateProcessor: просит пользователя дождаться ответа на прежние сообщения."""
+    user = update.effective_user
+    chat = update.effective_chat
+    if user is None or chat is None:
+        return
+    profile = await db_handler.get_or_create_user(user.id)
+    await update.get_bot().send_message(chat_id=chat.id, text=get_text('updates_busy', profile['language_code']))
+
+
+def build_application(token: str = TELEGRAM_TOKEN, request=None, shard: tuple[int, int] = None) -> Application:
+    """Создает Application со всеми обработчиками и периодическими задачами.
+
+    request — свой транспорт к Bot API (BaseRequest), например фейковый в нагрузочном тесте.
+    shard=(index, count) — воркер в режиме нескольких процессов (cluster.py): обновления
+    ему передает диспетчер, поэтому Updater не создается, а из БД загружаются только
+    пользователи своего шарда.
+    """
+    # Состояние диалогов хранится в БД и переживает перезапуск.
+    # Обновления разных пользователей обрабатываются параллельно, одного — по очереди
+    persistence = SQLitePersistence(update_interval=PERSISTENCE_UPDATE_INTERVAL, shard=shard)
+    processor = PerUserUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING, UPDATE_MAX_PENDING_PER_USER,
+                                       on_overflow=notify_busy)
+    register_update_metrics(processor)
+    builder = (
+        Application.builder()
+        .token(token)
+        .persistence(persistence)
+        .concurrent_updates(processor)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if shard is not None:
+        builder = builder.updater(None)
+    application = builder.build()
 
     # --- Обработчик диалога для квиза ---
     quiz_conv_handler = ConversationHandler(
@@ -63,6 +110,8 @@ def main() -> None:
             quiz.ANSWERING: [CallbackQueryHandler(quiz.handle_answer, pattern='^ans_')],
         },
         fallbacks=[CommandHandler('cancel', quiz.cancel_quiz)],
+        name='quiz',
+        persistent=True,
     )
 
     # ---ОБРАБОТЧИК ДИАЛОГА ДЛЯ ИИ ---
@@ -86,8 +135,9 @@ def main() -> None:
         },
         fallbacks=[CommandHandler('cancel', ai_handler.cancel_dialog)
 
-                   ]
-
+                   ],
+        name='ai_dialog',
+        persistent=True,
     )
 
     # --- ОБРАБОТЧИК ДЛЯ РАЗБОРА ФЕЙКОВ ---
@@ -104,6 +154,8 @@ def main() -> None:
             ],
         },
         fallbacks=[CommandHandler('cancel', debunk.cancel_debunk)],
+        name='debunk',
+        persistent=True,
     )
 
     # --- Регистрация всех обработчиков ---
@@ -119,6 +171,11 @@ def main() -> None:
     application.add_handler(CommandHandler("module", modules.send_module_command))
     application.add_handler(CommandHandler("store", store.store_command))
     application.add_handler(CommandHandler("quiz", quiz.quiz_command))
+    application.add_handler(CommandHandler("leaderboard", leaderboard.leaderboard_command))
+
+    # Служебные команды
+    application.add_handler(CommandHandler("content_version", hot_reload.content_version_command))
+    application.add_handler(CommandHandler("stats", stats.stats_command))
 
 
     # Добавляем обработчик квиза
@@ -129,15 +186,65 @@ def main() -> None:
     # Обработчик для кнопок магазина
     application.add_handler(CallbackQueryHandler(store.handle_purchase, pattern='^buy_sticker_'))
 
+    # Время, ошибки и переходы диалогов для всех обработчиков (метрики на /metrics)
+    instrument_application(application)
+
     # --- Настройка ежедневной рассылки ---
     job_queue = application.job_queue
-    # Время в UTC. 9:00 МСК = 6:00 UTC.Часовой пояс.
-    daily_time = datetime.time(hour=7, minute=0, tzinfo=datetime.timezone.utc)
-    job_queue.run_daily(modules.broadcast_module, time=daily_time)
+    job_queue.run_daily(modules.broadcast_module, time=modules.BROADCAST_TIME)
+    # Досылка после перезапуска: продолжает начатую, но не завершенную сегодняшнюю рассылку
+    job_queue.run_repeating(modules.resume_broadcast_job, interval=modules.BROADCAST_RESUME_INTERVAL, first=10)
+    # Периодический сброс буфера отложенной записи XP и прогресса
+    job_queue.run_repeating(db_handler.flush_job, interval=db_handler.WRITE_BUFFER_FLUSH_INTERVAL)
+    # Горячая перезагрузка контента и переводов при изменении файлов
+    job_queue.run_repeating(hot_reload.watch_job, interval=CONTENT_RELOAD_INTERVAL)
+    # Удаление простаивающих сессий диалога с ИИ
+    job_queue.run_repeating(ai_sessions.evict_job, interval=60)
+    # Свертка журнала XP в дневные сводки для /stats (при нескольких воркерах — в одном из них)
+    job_queue.run_repeating(sharding.singleton_job('rollup', stats.rollup_job, ttl=3 * stats.ROLLUP_INTERVAL),
+                            interval=stats.ROLLUP_INTERVAL)
+    # Ежедневная очистка устаревших строк в БД (ночью, 3:00 UTC)
+    job_queue.run_daily(sharding.singleton_job('compact', db_handler.compact_job, ttl=3 * 24 * 3600),
+                        time=datetime.time(hour=3, minute=0, tzinfo=datetime.timezone.utc))
+    # Пересчет снимка рейтинга для /leaderboard
+    job_queue.run_repeating(leaderboard.refresh_job, interval=leaderboard.RANK_REFRESH_INTERVAL, first=10)
+    return application
+
+
+def main() -> None:
+    """Основная функция запуска бота."""
+    if AI_BACKEND == 'gemini' and not GEMINI_API_KEY:
+        logger.warning("GEMINI_API_KEY не задан: запросы к ИИ будут завершаться ошибкой")
+
+    if WORKERS > 1:
+        # Диспетчер и процессы-воркеры, пользователи распределены по user_id
+        import cluster
+        cluster.run_cluster(WORKERS)
+        return
+
+    # Инициализация БД при старте
+    db_handler.init_db()
+    # Загружаем контент и заранее рендерим сообщения модулей и клавиатуры магазина
+    hot_reload.init_content_version()
+    application = build_application()
 
     # Запуск бота
-    logger.info("Бот запускается...")
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        # Встроенный HTTP-сервер PTB: проверяет заголовок X-Telegram-Bot-Api-Secret-Token
+        # и регистрирует адрес в Telegram. Несколько процессов — только через WORKERS (cluster.py):
+        # состояние пользователя живет в памяти процесса, балансировщик без привязки его разнесет
+        logger.info("Бот запускается в режиме webhook на %s:%s/%s...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        logger.info("Бот запускается...")
+        application.run_polling()
 
 
 if __name__ == "__main__":
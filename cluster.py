@@ -0,0 +1,306 @@
+"""Режим нескольких процессов: диспетчер и воркеры-шарды.
+
+Диспетчер — единственный процесс, который получает обновления от Telegram
+(getUpdates или webhook). По user_id он выбирает шард и пересылает
+обновления пачками воркеру по локальному HTTP. Воркер — обычный Application
+из bot.build_application без Updater: полученные обновления он кладет в
+update_queue. Обновления одного пользователя проходят через одну очередь
+диспетчера и одну очередь воркера, поэтому порядок сохраняется.
+
+Все процессы работают с одним файлом SQLite (WAL, busy_timeout). Общие
+периодические задачи координируются арендами в таблице leases (sharding.py).
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import secrets
+import signal
+from datetime import timedelta
+
+import httpx
+import tornado.httpserver
+import tornado.web
+from telegram import Bot, Update
+from telegram.error import RetryAfter, TelegramError
+
+import logging_setup
+import metrics
+import sharding
+from config import (
+    TELEGRAM_TOKEN, BOT_MODE, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_MAX_CONNECTIONS, SHARD_BASE_PORT, METRICS_HOST, METRICS_PORT, LOG_FORMAT, LOG_LEVEL,
+)
+from database import db_handler
+from handlers.update_processor import raw_update_key
+
+logger = logging.getLogger(__name__)
+
+SHARD_SECRET_HEADER = 'X-Shard-Secret'
+# Сколько обновлений одного шарда пересылается одним запросом
+FORWARD_BATCH_SIZE = 100
+# Сколько обновлений может ждать пересылки в очереди шарда, прежде чем прием притормозит
+FORWARD_QUEUE_SIZE = 10000
+FORWARD_RETRY_MAX_DELAY = 10.0
+POLL_TIMEOUT = 30  # секунды long polling getUpdates
+WORKER_RESTART_DELAY = 1.0
+WORKER_STOP_TIMEOUT = 30.0
+
+FORWARDED = metrics.REGISTRY.counter('bot_dispatcher_forwarded_total', "Обновления, переданные воркерам", ('shard',))
+FORWARD_ERRORS = metrics.REGISTRY.counter(
+    'bot_dispatcher_forward_errors_total', "Неудачные попытки передать обновления воркеру", ('shard',))
+
+
+def shard_for_update(data: dict, count: int) -> int:
+    """Шард обновления: по пользователю, иначе по чату; прочие обновления — в шард 0."""
+    key = raw_update_key(data)
+    return 0 if key is None else sharding.shard_of(key[1], count)
+
+
+def worker_url(index: int) -> str:
+    return f"http://127.0.0.1:{SHARD_BASE_PORT + index}/updates"
+
+
+class _ShardLink:
+    """Очередь обновлений одного шарда и задача, которая пересылает их воркеру по порядку."""
+
+    def __init__(self, index: int, secret: str, client: httpx.AsyncClient):
+        self.index = index
+        self.url = worker_url(index)
+        self.secret = secret
+        self.client = client
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(FORWARD_QUEUE_SIZE)
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < FORWARD_BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self._send(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _send(self, batch: list[dict]):
+        body = json.dumps(batch, ensure_ascii=False).encode('utf-8')
+        delay = 0.5
+        while True:
+            try:
+                response = await self.client.post(self.url, content=body, headers={
+                    SHARD_SECRET_HEADER: self.secret, 'Content-Type': 'application/json'})
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                # Воркер перезапускается или еще не поднялся: ждем его, не теряя обновления
+                FORWARD_ERRORS.inc(shard=str(self.index))
+                logger.warning("Воркер %s не принял обновления (%s), повтор через %.1f c", self.index, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, FORWARD_RETRY_MAX_DELAY)
+                continue
+            FORWARDED.inc(len(batch), shard=str(self.index))
+            return
+
+
+class Dispatcher:
+    """Получает обновления от Telegram и распределяет их по воркерам."""
+
+    def __init__(self, workers: int, secret: str):
+        self.client = httpx.AsyncClient(timeout=10.0, limits=httpx.Limits(max_keepalive_connections=workers))
+        self.links = [_ShardLink(index, secret, self.client) for index in range(workers)]
+        metrics.REGISTRY.gauge('bot_dispatcher_queue', "Обновления в очереди на пересылку",
+                               lambda: {(str(link.index),): link.queue.qsize() for link in self.links}, ('shard',))
+
+    async def dispatch(self, data: dict):
+        await self.links[shard_for_update(data, len(self.links))].queue.put(data)
+
+    async def drain(self):
+        """Ждет, пока все принятые обновления будут переданы воркерам."""
+        await asyncio.gather(*(link.queue.join() for link in self.links))
+
+    async def poll(self, bot: Bot):
+        """Long polling: следующий getUpdates подтверждает пачку только после передачи воркерам."""
+        await bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                updates = await bot.do_api_request(
+                    'getUpdates', api_kwargs={'offset': offset, 'timeout': POLL_TIMEOUT},
+                    read_timeout=POLL_TIMEOUT + 10,
+                )
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                await asyncio.sleep(retry_after.total_seconds() if isinstance(retry_after, timedelta) else retry_after)
+                continue
+            except TelegramError as e:
+                logger.warning("Ошибка getUpdates: %s", e)
+                await asyncio.sleep(1.0)
+                continue
+            for data in updates:
+                await self.dispatch(data)
+            if updates:
+                offset = updates[-1]['update_id'] + 1
+                await self.drain()
+
+    def webhook_app(self) -> tornado.web.Application:
+        return tornado.web.Application([(rf"/{WEBHOOK_PATH}", _TelegramWebhookHandler, {'dispatcher': self})])
+
+
+class _TelegramWebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, dispatcher: Dispatcher):
+        self.dispatcher = dispatcher
+
+    async def post(self):
+        if self.request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET_TOKEN:
+            raise tornado.web.HTTPError(403)
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        await self.dispatcher.dispatch(data)
+
+
+class _ShardUpdatesHandler(tornado.web.RequestHandler):
+    """Прием пачки обновлений от диспетчера в процессе воркера."""
+
+    def initialize(self, bot_application, secret: str):
+        self.bot_application = bot_application
+        self.secret = secret
+
+    async def post(self):
+        if self.request.headers.get(SHARD_SECRET_HEADER) != self.secret:
+            raise tornado.web.HTTPError(403)
+        for data in json.loads(self.request.body):
+            await self.bot_application.update_queue.put(Update.de_json(data, self.bot_application.bot))
+
+
+async def _run_worker(index: int, count: int, secret: str):
+    import bot
+    from handlers import hot_reload
+
+    sharding.set_shard(index, count)
+    hot_reload.init_content_version()
+    application = bot.build_application(shard=(index, count))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with application:
+        await application.start()
+        server = tornado.httpserver.HTTPServer(tornado.web.Application([
+            (r"/updates", _ShardUpdatesHandler, {'bot_application': application, 'secret': secret}),
+        ]))
+        server.listen(SHARD_BASE_PORT + index, '127.0.0.1')
+        metrics_server = None
+        if METRICS_PORT:
+            metrics_server = await metrics.start_http_server(METRICS_HOST, METRICS_PORT + 1 + index)
+        logger.info("Воркер %s из %s принимает обновления на %s", index, count, worker_url(index))
+        await stop.wait()
+        server.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        await application.stop()
+    db_handler.close_db()
+    logger.info("Воркер %s остановлен", index)
+
+
+def _worker_main(index: int, count: int, secret: str):
+    """Точка входа процесса-воркера (multiprocessing, spawn)."""
+    logging_setup.configure(LOG_FORMAT, LOG_LEVEL)
+    asyncio.run(_run_worker(index, count, secret))
+
+
+class _Supervisor:
+    """Запускает воркеры и перезапускает упавшие."""
+
+    def __init__(self, workers: int, secret: str):
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = workers
+        self.secret = secret
+        self.processes: list[multiprocessing.Process | None] = [None] * workers
+        self.restarts = 0
+        metrics.REGISTRY.gauge('bot_workers_alive', "Живые процессы-воркеры",
+                               lambda: sum(1 for process in self.processes if process and process.is_alive()))
+
+    def _start(self, index: int):
+        process = self.context.Process(target=_worker_main, args=(index, self.workers, self.secret),
+                                       name=f"worker-{index}", daemon=False)
+        process.start()
+        self.processes[index] = process
+
+    async def run(self):
+        for index in range(self.workers):
+            self._start(index)
+        while True:
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.error("Воркер %s завершился с кодом %s, перезапуск", index, process.exitcode)
+                    self.restarts += 1
+                    self._start(index)
+
+    async def stop(self):
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()  # SIGTERM: воркер сбрасывает буферы и закрывает БД
+        for process in self.processes:
+            if process is not None:
+                await asyncio.to_thread(process.join, WORKER_STOP_TIMEOUT)
+                if process.is_alive():
+                    logger.warning("Воркер %s не остановился за %.0f c, принудительно", process.name,
+                                   WORKER_STOP_TIMEOUT)
+                    process.kill()
+
+
+async def _run_cluster(workers: int):
+    secret = secrets.token_urlsafe(32)
+    supervisor = _Supervisor(workers, secret)
+    dispatcher = Dispatcher(workers, secret)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    tasks = [asyncio.create_task(supervisor.run())]
+    tasks += [asyncio.create_task(link.run()) for link in dispatcher.links]
+    metrics_server = await metrics.start_http_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    webhook_server = None
+    async with Bot(TELEGRAM_TOKEN) as telegram_bot:
+        if BOT_MODE == "webhook":
+            webhook_server = tornado.httpserver.HTTPServer(dispatcher.webhook_app())
+            webhook_server.listen(WEBHOOK_PORT, WEBHOOK_LISTEN)
+            await telegram_bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info("Диспетчер принимает webhook на %s:%s/%s, воркеров: %s",
+                        WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, workers)
+        else:
+            tasks.append(asyncio.create_task(dispatcher.poll(telegram_bot)))
+            logger.info("Диспетчер получает обновления через getUpdates, воркеров: %s", workers)
+        await stop.wait()
+
+    logger.info("Остановка: прием обновлений прекращен, передаем остаток воркерам")
+    if webhook_server is not None:
+        webhook_server.stop()
+    tasks[0].cancel()  # супервизор больше не перезапускает воркеры
+    for task in tasks[1 + len(dispatcher.links):]:
+        task.cancel()
+    try:
+        await asyncio.wait_for(dispatcher.drain(), timeout=WORKER_STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Не все обновления переданы воркерам до остановки")
+    for task in tasks:
+        task.cancel()
+    await dispatcher.client.aclose()
+    if metrics_server is not None:
+        metrics_server.close()
+    await supervisor.stop()
+
+
+def run_cluster(workers: int):
+    """Запускает диспетчер и workers процессов-воркеров; возвращает управление после остановки."""
+    # Миграции схемы — один раз до запуска воркеров
+    db_handler.init_db()
+    asyncio.run(_run_cluster(workers))
@@ -9,10 +9,64 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
     raise ValueError("Не найден TELEGRAM_TOKEN в .env файле!")
 
-# Ключ Gemini API
+# Бэкенд модели ИИ: gemini или stub (локальная заглушка для тестов и нагрузки без сети)
+AI_BACKEND = os.getenv("AI_BACKEND", "gemini")
+# Параметры заглушки: время генерации ответа (секунды) и его длина (символы)
+AI_STUB_LATENCY = float(os.getenv("AI_STUB_LATENCY", "0.5"))
+AI_STUB_OUTPUT_SIZE = int(os.getenv("AI_STUB_OUTPUT_SIZE", "500"))
+
+# Ключ Gemini API. Нужен только для бэкенда gemini и проверяется при первом запросе
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("Не найден GEMINI_API_KEY в .env файле!")
 
 # Путь к базе данных
-DB_PATH = os.path.join("database", "database.db")
\ No newline at end of file
+DB_PATH = os.path.join("database", "database.db")
+
+# ID администраторов через запятую (доступ к служебным командам)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+
+# Как часто проверять изменения файлов контента и переводов (секунды)
+CONTENT_RELOAD_INTERVAL = float(os.getenv("CONTENT_RELOAD_INTERVAL", "5"))
+
+# Как часто сохранять измененные user_data и состояния диалогов в БД (секунды)
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "10"))
+
+# Показывать ответ ИИ по мере генерации (постепенное редактирование сообщения)
+AI_STREAMING = os.getenv("AI_STREAMING", "1") not in ("0", "false", "no")
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Сколько обновлений разных пользователей обрабатывать одновременно
+# (обновления одного пользователя всегда идут по очереди)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1000"))
+# Сколько обновлений одного пользователя может ждать очереди; лишние отбрасываются с ответом «подожди»
+UPDATE_MAX_PENDING_PER_USER = int(os.getenv("UPDATE_MAX_PENDING_PER_USER", "5"))
+
+# Настройки встроенного HTTP-сервера для режима webhook
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+# Публичный HTTPS-адрес, который регистрируется в Telegram (адрес обратного прокси)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("Для режима webhook нужен WEBHOOK_URL в .env файле!")
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET_TOKEN:
+    raise ValueError("Для режима webhook нужен WEBHOOK_SECRET_TOKEN в .env файле!")
+
+# HTTP-эндпоинт /metrics в формате Prometheus (0 — отключен).
+# По умолчанию слушает только localhost: метрики не для публичного доступа
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9102"))
+
+# Формат логов: text (для человека) или json (одна запись — одна строка JSON)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Число процессов-воркеров: 1 — обычный режим в одном процессе, auto — по числу ядер.
+# При нескольких воркерах обновления получает диспетчер (polling или webhook по BOT_MODE)
+# и передает каждого пользователя всегда одному воркеру: user_id % WORKERS
+WORKERS = os.cpu_count() if os.getenv("WORKERS") == "auto" else int(os.getenv("WORKERS", "1"))
+# Воркер i принимает обновления от диспетчера на 127.0.0.1:SHARD_BASE_PORT + i
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8600"))
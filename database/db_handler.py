@@ -1,128 +1,720 @@
+import asyncio
+import functools
 import sqlite3
 import os
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+from datetime import date, datetime, timedelta
+
+from metrics import FAST_BUCKETS, REGISTRY
+from . import migrations
+from .user_cache import UserCache
+from .write_buffer import WriteBuffer
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'database', 'database.db')
 
-def init_db():
+# Все обращения к SQLite идут через один выделенный поток и одно долгоживущее
+# соединение: так event loop не блокируется на fsync, а запросы не конкурируют
+# за блокировку файла.
+_executor = None
+_local = threading.local()
+_connections = []
+
+# Отложенная запись XP и отметок прогресса: изменения копятся в буфере и
+# сбрасываются одной транзакцией по размеру, по таймеру и при остановке.
+WRITE_BUFFER_MAX_PENDING = 500
+WRITE_BUFFER_FLUSH_INTERVAL = 2.0  # секунды
+write_buffer = WriteBuffer()
+
+# Кэш профилей (язык, XP): типичное взаимодействие читает профиль несколько раз
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 600.0  # секунды
+user_cache = UserCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+REGISTRY.stats_gauge('bot_user_cache', "Кэш профилей пользователей", user_cache.stats)
+
+# Сроки хранения для ежедневной очистки (compact)
+SEEN_MODULES_RETENTION_DAYS = 30  # квизу нужны только последние 7 дней
+XP_EVENTS_RETENTION_DAYS = 90  # уже свернутые в xp_daily_stats события
+WEEKLY_XP_RETENTION_WEEKS = 8
+DAILY_USERS_RETENTION_DAYS = 7
+COMPACTION_BATCH_SIZE = 10000
+
+
+def _connect(path: str = None) -> sqlite3.Connection:
+    """Открывает соединение с базой в режиме WAL."""
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=False, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # В режиме WAL synchronous=NORMAL безопасен и убирает fsync на каждый коммит
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Возвращает соединение текущего потока, создавая его при первом обращении."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+        _connections.append(conn)
+    return conn
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+    return _executor
+
+
+# Время обращений к БД вместе с ожиданием очереди потока БД; count — число обращений
+DB_CALL_SECONDS = REGISTRY.histogram(
+    'bot_db_call_seconds', "Время обращения к БД, включая очередь потока БД", ('function',), FAST_BUCKETS)
+DB_ERRORS = REGISTRY.counter('bot_db_errors_total', "Ошибки обращений к БД", ('function', 'error'))
+
+
+def _in_db_thread(func):
+    """Превращает синхронную функцию работы с БД в корутину, выполняемую в потоке БД."""
+    timing = DB_CALL_SECONDS.labels(function=func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+        except Exception as e:
+            DB_ERRORS.inc(function=func.__name__, error=type(e).__name__)
+            raise
+        finally:
+            timing.observe(time.perf_counter() - started)
+
+    wrapper.sync = func
+    return wrapper
+
 
+def init_db():
+    """Создает базу при необходимости и применяет миграции схемы."""
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    print("Проверка структуры базы данных...")
-    # Users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            language_code TEXT DEFAULT 'ru',
-            xp INTEGER DEFAULT 0
-        )
-    """)
-    # Seen modules table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS seen_modules (
-            user_id INTEGER,
-            module_id INTEGER,
-            seen_date DATE,
-            PRIMARY KEY (user_id, module_id),
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    """)
-
-    # Solved debunks table
-    cursor.execute("""
-            CREATE TABLE IF NOT EXISTS solved_debunks (
-                user_id INTEGER,
-                case_id TEXT,
-                solved_date DATE,
-                PRIMARY KEY (user_id, case_id),
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
-    print("Структура базы данных в порядке.")
-    conn.commit()
+    conn = _connect()
+    logger.info("Проверка структуры базы данных...")
+    version = migrations.migrate(conn)
+    logger.info("Структура базы данных в порядке (версия %s).", version)
     conn.close()
 
-def get_or_create_user(user_id: int, username: str = None):
-    conn = sqlite3.connect(DB_PATH)
+
+def close_db():
+    """Сбрасывает буфер записи, закрывает соединения и останавливает поток БД."""
+    global _executor
+    _get_executor().submit(flush.sync).result()
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    while _connections:
+        _connections.pop().close()
+
+
+async def get_or_create_user(user_id: int, username: str = None):
+    """Возвращает профиль пользователя, при необходимости создавая его. Сначала смотрит в кэш."""
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    token = user_cache.begin_load(user_id)
+    try:
+        user = await _load_or_create_user(user_id, username)
+    except Exception:
+        user_cache.cancel_load(user_id, token)
+        raise
+    user_cache.put(user_id, user, token)
+    return user
+
+
+@_in_db_thread
+def _load_or_create_user(user_id: int, username: str = None):
+    conn = _get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+    cursor.execute("SELECT user_id, username, language_code, xp FROM users WHERE user_id = ?", (user_id,))
     user = cursor.fetchone()
     if not user:
-        cursor.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, username))
-        conn.commit()
-        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+        with conn:
+            cursor.execute("INSERT INTO users (user_id, username) VALUES (?, ?)", (user_id, username))
+        cursor.execute("SELECT user_id, username, language_code, xp FROM users WHERE user_id = ?", (user_id,))
         user = cursor.fetchone()
-    conn.close()
-    return {'user_id': user[0], 'username': user[1], 'language_code': user[2], 'xp': user[3]}
+    xp = user[3] + write_buffer.pending_xp(user_id)
+    return {'user_id': user[0], 'username': user[1], 'language_code': user[2], 'xp': xp}
+
+
+async def set_user_language(user_id: int, lang_code: str):
+    await _update_user_language(user_id, lang_code)
+    user_cache.update(user_id, language_code=lang_code)
+
+
+@_in_db_thread
+def _update_user_language(user_id: int, lang_code: str):
+    conn = _get_connection()
+    with conn:
+        conn.execute("UPDATE users SET language_code = ? WHERE user_id = ?", (lang_code, user_id))
 
-def set_user_language(user_id: int, lang_code: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET language_code = ? WHERE user_id = ?", (lang_code, user_id))
-    conn.commit()
-    conn.close()
 
+@_in_db_thread
 def get_user_xp(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT xp FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 0
+    conn = _get_connection()
+    result = conn.execute("SELECT xp FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    if not result:
+        return 0
+    return result[0] + write_buffer.pending_xp(user_id)
 
-def change_xp(user_id: int, amount: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET xp = xp + ? WHERE user_id = ?", (amount, user_id))
-    conn.commit()
-    conn.close()
 
-def mark_module_as_seen(user_id: int, module_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+@_in_db_thread
+def flush():
+    """Записывает буфер отложенной записи в БД одной транзакцией."""
+    return write_buffer.flush_to(_get_connection())
+
+
+async def flush_job(context):
+    """Периодическая задача job_queue: сбрасывает буфер по таймеру."""
+    await flush()
+
+
+async def _after_buffered_write(pending: int):
+    if pending >= WRITE_BUFFER_MAX_PENDING:
+        await flush()
+
+
+async def change_xp(user_id: int, amount: int, source: str = None):
+    """Начисляет XP (отложенно). source — откуда начисление, для журнала xp_events."""
+    user_cache.add_xp(user_id, amount)
+    await _after_buffered_write(write_buffer.add_xp(user_id, amount, source))
+
+
+async def mark_module_as_seen(user_id: int, module_id: int):
     today = datetime.now().date()
-    cursor.execute("INSERT OR REPLACE INTO seen_modules (user_id, module_id, seen_date) VALUES (?, ?, ?)",
-                   (user_id, module_id, today))
-    conn.commit()
-    conn.close()
+    await _after_buffered_write(write_buffer.add_seen(user_id, module_id, today))
+
 
+@_in_db_thread
 def get_seen_modules_for_quiz(user_id: int):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = _get_connection()
     # Логика для еженедельного квиза: берем модули за последние 7 дней
-    cursor.execute("""
-        SELECT DISTINCT module_id FROM seen_modules
+    # Покрывающий индекс idx_seen_modules_user_date; DISTINCT не нужен — (user_id, module_id) уникальны
+    modules = conn.execute("""
+        SELECT module_id FROM seen_modules
         WHERE user_id = ? AND seen_date >= date('now', '-7 days')
-    """, (user_id,))
-    modules = cursor.fetchall()
-    conn.close()
-    return [m[0] for m in modules]
+    """, (user_id,)).fetchall()
+    seen = [m[0] for m in modules]
+    # Модули из буфера отмечены сегодня, поэтому всегда попадают в окно квиза
+    return seen + sorted(write_buffer.pending_seen_modules(user_id) - set(seen))
+
+
+async def purchase(user_id: int, item_id: str, price: int, idempotency_key: str) -> dict:
+    """Списывает price XP и записывает покупку одной транзакцией.
+
+    Возвращает {'status': 'completed' | 'duplicate' | 'insufficient', 'xp': баланс}.
+    Повторный вызов с тем же idempotency_key ничего не списывает, пока покупку
+    не вернули через refund_purchase.
+    """
+    result = await _purchase(user_id, item_id, price, idempotency_key)
+    # Баланс в кэше мог измениться параллельно, поэтому профиль перечитаем из БД
+    user_cache.invalidate(user_id)
+    return result
+
+
+@_in_db_thread
+def _purchase(user_id: int, item_id: str, price: int, idempotency_key: str) -> dict:
+    conn = _get_connection()
+    # Отложенные начисления пользователя записываются в той же транзакции,
+    # чтобы условие xp >= price видело актуальный баланс
+    pending = write_buffer.take_xp(user_id)
+    try:
+        with conn:
+            if pending:
+                conn.execute("UPDATE users SET xp = xp + ? WHERE user_id = ?", (pending, user_id))
+            existing = conn.execute("SELECT 1 FROM purchases WHERE idempotency_key = ?",
+                                    (idempotency_key,)).fetchone()
+            if existing:
+                status = 'duplicate'
+            else:
+                updated = conn.execute("UPDATE users SET xp = xp - ? WHERE user_id = ? AND xp >= ?",
+                                       (price, user_id, price)).rowcount
+                if updated:
+                    now = datetime.now()
+                    conn.execute("""
+                        INSERT INTO purchases (idempotency_key, user_id, item_id, price, status, created_at)
+                        VALUES (?, ?, ?, ?, 'completed', ?)
+                    """, (idempotency_key, user_id, item_id, price, now))
+                    conn.execute("INSERT INTO xp_events (user_id, amount, source, created_at) VALUES (?, ?, 'store', ?)",
+                                 (user_id, -price, now))
+                    status = 'completed'
+                else:
+                    status = 'insufficient'
+            row = conn.execute("SELECT xp FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    except Exception:
+        write_buffer.restore_xp(user_id, pending)
+        raise
+    xp = (row[0] if row else 0) + write_buffer.pending_xp(user_id)
+    return {'status': status, 'xp': xp}
+
+
+async def refund_purchase(idempotency_key: str) -> bool:
+    """Возвращает XP за покупку (например, если стикер не удалось отправить). Повторный вызов ничего не делает.
+
+    Ключ возвращенной покупки освобождается (к нему дописывается purchase_id),
+    поэтому повторная покупка с тем же ключом снова списывает XP.
+    """
+    user_id = await _refund_purchase(idempotency_key)
+    if user_id is None:
+        return False
+    user_cache.invalidate(user_id)
+    return True
+
+
+@_in_db_thread
+def _refund_purchase(idempotency_key: str):
+    conn = _get_connection()
+    with conn:
+        row = conn.execute("SELECT user_id, price FROM purchases WHERE idempotency_key = ? AND status = 'completed'",
+                           (idempotency_key,)).fetchone()
+        if not row:
+            return None
+        conn.execute("""
+            UPDATE purchases SET status = 'refunded', idempotency_key = idempotency_key || ':refunded:' || purchase_id
+            WHERE idempotency_key = ?
+        """, (idempotency_key,))
+        conn.execute("UPDATE users SET xp = xp + ? WHERE user_id = ?", (row[1], row[0]))
+        conn.execute("INSERT INTO xp_events (user_id, amount, source, created_at) VALUES (?, ?, 'store_refund', ?)",
+                     (row[0], row[1], datetime.now()))
+    return row[0]
+
+
+@_in_db_thread
+def get_purchases(user_id: int, limit: int = 50) -> list[dict]:
+    """История покупок пользователя, от новых к старым."""
+    conn = _get_connection()
+    rows = conn.execute("""
+        SELECT purchase_id, item_id, price, status, created_at FROM purchases
+        WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+    """, (user_id, limit)).fetchall()
+    keys = ('purchase_id', 'item_id', 'price', 'status', 'created_at')
+    return [dict(zip(keys, row)) for row in rows]
+
+
+@_in_db_thread
+def get_top_users(limit: int) -> list[tuple[int, str, int]]:
+    """Лучшие пользователи по XP: (user_id, username, xp). Читает индекс idx_users_xp."""
+    conn = _get_connection()
+    return conn.execute("SELECT user_id, username, xp FROM users ORDER BY xp DESC LIMIT ?", (limit,)).fetchall()
+
+
+@_in_db_thread
+def get_xp_page(after: tuple[int, int] | None, limit: int) -> list[tuple[int, int]]:
+    """Порция (xp, user_id) по убыванию XP, следующая за ключом after.
+
+    Читает только индекс idx_users_xp (xp DESC, rowid): сначала остаток
+    пользователей с тем же XP, затем пользователей с меньшим XP.
+    """
+    conn = _get_connection()
+    if after is None:
+        return conn.execute("SELECT xp, user_id FROM users ORDER BY xp DESC, user_id LIMIT ?", (limit,)).fetchall()
+    xp, user_id = after
+    rows = conn.execute("""
+        SELECT xp, user_id FROM users WHERE xp = ? AND user_id > ? ORDER BY user_id LIMIT ?
+    """, (xp, user_id, limit)).fetchall()
+    if len(rows) < limit:
+        rows += conn.execute("""
+            SELECT xp, user_id FROM users WHERE xp < ? ORDER BY xp DESC, user_id LIMIT ?
+        """, (xp, limit - len(rows))).fetchall()
+    return rows
+
+
+@_in_db_thread
+def get_weekly_top(week: date, limit: int) -> list[tuple[int, str, int]]:
+    """Лучшие пользователи недели: (user_id, username, xp за неделю)."""
+    conn = _get_connection()
+    return conn.execute("""
+        SELECT w.user_id, u.username, w.xp FROM weekly_xp w
+        LEFT JOIN users u ON u.user_id = w.user_id
+        WHERE w.week_start = ? ORDER BY w.xp DESC LIMIT ?
+    """, (week, limit)).fetchall()
+
+
+@_in_db_thread
+def get_weekly_xp_page(week: date, after_user_id: int, limit: int) -> list[tuple[int, int]]:
+    """Порция недельных сумм XP (user_id, xp) по возрастанию user_id, после after_user_id."""
+    conn = _get_connection()
+    return conn.execute("""
+        SELECT user_id, xp FROM weekly_xp WHERE week_start = ? AND user_id > ? ORDER BY user_id LIMIT ?
+    """, (week, after_user_id, limit)).fetchall()
+
+
+@_in_db_thread
+def save_rank_snapshot(week: str, built_at: float, xp_values: bytes, weekly_users: bytes,
+                       weekly_values: bytes, top: str, weekly_top: str):
+    """Публикует снимок рейтинга для остальных процессов (одна строка таблицы)."""
+    conn = _get_connection()
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO rank_snapshot
+                (id, week, built_at, xp_values, weekly_users, weekly_values, top, weekly_top)
+            VALUES (1, ?, ?, ?, ?, ?, ?, ?)
+        """, (week, built_at, xp_values, weekly_users, weekly_values, top, weekly_top))
 
+
+@_in_db_thread
+def load_rank_snapshot(newer_than: float = 0.0) -> tuple | None:
+    """Опубликованный снимок рейтинга, если он построен позже newer_than, иначе None."""
+    conn = _get_connection()
+    return conn.execute("""
+        SELECT week, built_at, xp_values, weekly_users, weekly_values, top, weekly_top
+        FROM rank_snapshot WHERE id = 1 AND built_at > ?
+    """, (newer_than,)).fetchone()
+
+
+@_in_db_thread
+def _delete_batch(table: str, condition: str, params: tuple, batch_size: int) -> int:
+    conn = _get_connection()
+    with conn:
+        return conn.execute(f"""
+            DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {condition} LIMIT ?)
+        """, (*params, batch_size)).rowcount
+
+
+@_in_db_thread
+def _compact_small_tables(daily_users_cutoff: str) -> int:
+    conn = _get_connection()
+    with conn:
+        deleted = conn.execute("DELETE FROM xp_daily_users WHERE day < ?", (daily_users_cutoff,)).rowcount
+    # Обновляет статистику планировщика запросов, если она устарела
+    conn.execute("PRAGMA optimize")
+    return deleted
+
+
+@_in_db_thread
+def _rolled_up_event_id() -> int:
+    row = _get_connection().execute("SELECT last_event_id FROM rollup_state WHERE name = 'xp_events'").fetchone()
+    return row[0] if row else 0
+
+
+async def compact(today: date = None, batch_size: int = COMPACTION_BATCH_SIZE) -> dict:
+    """Удаляет устаревшие строки: старые отметки модулей, свернутые события XP, старые недельные суммы.
+
+    Удаление идет порциями по batch_size, каждая в своей транзакции, чтобы
+    между ними успевали выполняться обычные запросы. Возвращает число удаленных строк по таблицам.
+    """
+    today = today or date.today()
+    rolled_up = await _rolled_up_event_id()
+    jobs = [
+        ('seen_modules', "seen_date < ?",
+         ((today - timedelta(days=SEEN_MODULES_RETENTION_DAYS)).isoformat(),)),
+        ('xp_events', "created_at < ? AND event_id <= ?",
+         ((today - timedelta(days=XP_EVENTS_RETENTION_DAYS)).isoformat(), rolled_up)),
+        ('weekly_xp', "week_start < ?",
+         ((today - timedelta(weeks=WEEKLY_XP_RETENTION_WEEKS)).isoformat(),)),
+    ]
+    deleted = {}
+    for table, condition, params in jobs:
+        deleted[table] = 0
+        while True:
+            count = await _delete_batch(table, condition, params, batch_size)
+            deleted[table] += count
+            if count < batch_size:
+                break
+    deleted['xp_daily_users'] = await _compact_small_tables(
+        (today - timedelta(days=DAILY_USERS_RETENTION_DAYS)).isoformat())
+    return deleted
+
+
+async def compact_job(context):
+    """Ежедневная задача job_queue: очистка устаревших строк."""
+    deleted = await compact()
+    logger.info("Очистка БД: удалено %s", deleted)
+
+
+ROLLUP_BATCH_SIZE = 50000
+
+
+@_in_db_thread
+def rollup_xp_events(batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    """Сворачивает новые события xp_events в дневные сводки xp_daily_stats.
+
+    Обрабатывает журнал порциями по event_id; каждая порция и отметка о ней
+    пишутся одной транзакцией, поэтому событие учитывается ровно один раз.
+    Возвращает число обработанных событий.
+    """
+    conn = _get_connection()
+    processed = 0
+    while True:
+        row = conn.execute("SELECT last_event_id FROM rollup_state WHERE name = 'xp_events'").fetchone()
+        last_event_id = row[0] if row else 0
+        events = conn.execute("""
+            SELECT event_id, user_id, amount, COALESCE(source, ''), date(created_at) FROM xp_events
+            WHERE event_id > ? ORDER BY event_id LIMIT ?
+        """, (last_event_id, batch_size)).fetchall()
+        if not events:
+            return processed
+
+        totals: dict[tuple[str, str], list[int]] = {}
+        users: dict[tuple[str, str], set[int]] = {}
+        for _, user_id, amount, source, day in events:
+            key = (day, source)
+            total = totals.setdefault(key, [0, 0])
+            total[0] += 1
+            total[1] += amount
+            users.setdefault(key, set()).add(user_id)
+
+        with conn:
+            for (day, source), (count, xp) in totals.items():
+                new_users = conn.executemany(
+                    "INSERT OR IGNORE INTO xp_daily_users (day, source, user_id) VALUES (?, ?, ?)",
+                    [(day, source, user_id) for user_id in users[(day, source)]]).rowcount
+                conn.execute("""
+                    INSERT INTO xp_daily_stats (day, source, events, xp, users) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (day, source) DO UPDATE SET
+                        events = events + excluded.events, xp = xp + excluded.xp, users = users + excluded.users
+                """, (day, source, count, xp, new_users))
+            conn.execute("INSERT OR REPLACE INTO rollup_state (name, last_event_id) VALUES ('xp_events', ?)",
+                         (events[-1][0],))
+        processed += len(events)
+        if len(events) < batch_size:
+            return processed
+
+
+@_in_db_thread
+def get_daily_stats(since: date) -> list[tuple[str, str, int, int, int]]:
+    """Дневные сводки начиная с since: (день, источник, событий, XP, пользователей)."""
+    conn = _get_connection()
+    return conn.execute("""
+        SELECT day, source, events, xp, users FROM xp_daily_stats
+        WHERE day >= ? ORDER BY day DESC, source
+    """, (since.isoformat(),)).fetchall()
+
+
+@_in_db_thread
+def load_media_file_ids() -> list[tuple[str, str, str]]:
+    """Возвращает сохраненные file_id: (источник, хэш содержимого, file_id)."""
+    conn = _get_connection()
+    return conn.execute("SELECT source, content_hash, file_id FROM media_file_ids").fetchall()
+
+
+@_in_db_thread
+def save_media_file_id(source: str, content_hash: str, kind: str, file_id: str):
+    conn = _get_connection()
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO media_file_ids (source, content_hash, kind, file_id, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (source, content_hash, kind, file_id, datetime.now()))
+
+
+@_in_db_thread
+def delete_media_file_id(source: str, content_hash: str):
+    conn = _get_connection()
+    with conn:
+        conn.execute("DELETE FROM media_file_ids WHERE source = ? AND content_hash = ?", (source, content_hash))
+
+
+@_in_db_thread
 def get_all_users():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, language_code FROM users")
-    users = cursor.fetchall()
-    conn.close()
-    return users
+    conn = _get_connection()
+    return conn.execute("SELECT user_id, language_code FROM users").fetchall()
+
+
+@_in_db_thread
+def get_active_users_page(after_user_id: int, limit: int, shard: tuple[int, int] = None):
+    """Возвращает следующую страницу активных пользователей (постранично по user_id).
+
+    shard=(index, count) оставляет только пользователей этого шарда (user_id % count == index).
+    """
+    conn = _get_connection()
+    if shard is None:
+        return conn.execute("""
+            SELECT user_id, language_code FROM users
+            WHERE user_id > ? AND is_active = 1
+            ORDER BY user_id LIMIT ?
+        """, (after_user_id, limit)).fetchall()
+    index, count = shard
+    return conn.execute("""
+        SELECT user_id, language_code FROM users
+        WHERE user_id > ? AND is_active = 1 AND user_id % ? = ?
+        ORDER BY user_id LIMIT ?
+    """, (after_user_id, count, index, limit)).fetchall()
+
+
+@_in_db_thread
+def set_user_active(user_id: int, is_active: bool):
+    """Помечает пользователя активным или неактивным (например, заблокировал бота)."""
+    conn = _get_connection()
+    with conn:
+        conn.execute("UPDATE users SET is_active = ? WHERE user_id = ? AND is_active != ?",
+                     (int(is_active), user_id, int(is_active)))
 
-def mark_debunk_as_solved(user_id: int, case_id: str):
+
+@_in_db_thread
+def get_broadcast(broadcast_id: str):
+    """Возвращает сохраненный прогресс рассылки или None."""
+    conn = _get_connection()
+    row = conn.execute("""
+        SELECT broadcast_id, status, last_user_id, sent, failed, blocked, started_at, finished_at
+        FROM broadcasts WHERE broadcast_id = ?
+    """, (broadcast_id,)).fetchone()
+    if not row:
+        return None
+    keys = ('broadcast_id', 'status', 'last_user_id', 'sent', 'failed', 'blocked', 'started_at', 'finished_at')
+    return dict(zip(keys, row))
+
+
+def _write_broadcast(conn: sqlite3.Connection, progress: dict):
+    conn.execute("""
+        INSERT OR REPLACE INTO broadcasts
+            (broadcast_id, status, last_user_id, sent, failed, blocked, started_at, finished_at)
+        VALUES (:broadcast_id, :status, :last_user_id, :sent, :failed, :blocked, :started_at, :finished_at)
+    """, progress)
+
+
+@_in_db_thread
+def save_broadcast(progress: dict):
+    """Сохраняет прогресс рассылки (контрольную точку last_user_id).
+
+    Отметки получателей до контрольной точки больше не нужны и удаляются.
+    """
+    conn = _get_connection()
+    with conn:
+        _write_broadcast(conn, progress)
+        conn.execute("DELETE FROM broadcast_recipients WHERE broadcast_id = ? AND user_id <= ?",
+                     (progress['broadcast_id'], progress['last_user_id']))
+
+
+@_in_db_thread
+def save_broadcast_recipient(progress: dict, user_id: int):
+    """Отмечает, что пользователю уже отправляли, вместе со счетчиками прогресса — одной транзакцией."""
+    conn = _get_connection()
+    with conn:
+        _write_broadcast(conn, progress)
+        conn.execute("INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id) VALUES (?, ?)",
+                     (progress['broadcast_id'], user_id))
+
+
+@_in_db_thread
+def get_broadcast_recipients(broadcast_id: str, after_user_id: int, up_to_user_id: int) -> set[int]:
+    """Кому из диапазона (after_user_id, up_to_user_id] рассылка уже отправляла."""
+    conn = _get_connection()
+    rows = conn.execute("""
+        SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ? AND user_id > ? AND user_id <= ?
+    """, (broadcast_id, after_user_id, up_to_user_id)).fetchall()
+    return {row[0] for row in rows}
+
+
+async def mark_debunk_as_solved(user_id: int, case_id: str):
     """Отмечает кейс как решенный пользователем."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
     today = datetime.now().date()
-    cursor.execute("INSERT OR IGNORE INTO solved_debunks (user_id, case_id, solved_date) VALUES (?, ?, ?)",
-                   (user_id, case_id, today))
-    conn.commit()
-    conn.close()
+    await _after_buffered_write(write_buffer.add_solved(user_id, case_id, today))
 
+
+@_in_db_thread
 def get_solved_debunk_ids(user_id: int) -> list[str]:
     """Возвращает список ID кейсов, решенных пользователем."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT case_id FROM solved_debunks WHERE user_id = ?", (user_id,))
-    cases = cursor.fetchall()
-    conn.close()
-    return [c[0] for c in cases]
\ No newline at end of file
+    conn = _get_connection()
+    cases = conn.execute("SELECT case_id FROM solved_debunks WHERE user_id = ?", (user_id,)).fetchall()
+    solved = [c[0] for c in cases]
+    return solved + sorted(write_buffer.pending_solved(user_id) - set(solved))
+
+
+@_in_db_thread
+def load_persisted_user_data() -> list[tuple[int, str]]:
+    """Возвращает сохраненные user_data всех пользователей (JSON-строки)."""
+    conn = _get_connection()
+    return conn.execute("SELECT user_id, data FROM persisted_user_data").fetchall()
+
+
+@_in_db_thread
+def save_persisted_user_data(user_id: int, data: str | None):
+    """Сохраняет user_data пользователя; None удаляет запись."""
+    conn = _get_connection()
+    with conn:
+        if data is None:
+            conn.execute("DELETE FROM persisted_user_data WHERE user_id = ?", (user_id,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO persisted_user_data (user_id, data) VALUES (?, ?)",
+                         (user_id, data))
+
+
+@_in_db_thread
+def load_persisted_conversations(name: str) -> list[tuple[str, str]]:
+    conn = _get_connection()
+    return conn.execute("SELECT conversation_key, state FROM persisted_conversations WHERE name = ?",
+                        (name,)).fetchall()
+
+
+@_in_db_thread
+def save_persisted_conversation(name: str, key: str, state: str | None):
+    """Сохраняет состояние диалога; None (диалог завершен) удаляет запись."""
+    conn = _get_connection()
+    with conn:
+        if state is None:
+            conn.execute("DELETE FROM persisted_conversations WHERE name = ? AND conversation_key = ?",
+                         (name, key))
+        else:
+            conn.execute("""
+                INSERT OR REPLACE INTO persisted_conversations (name, conversation_key, state)
+                VALUES (?, ?, ?)
+            """, (name, key, state))
+
+
+@_in_db_thread
+def load_ai_answers(limit: int) -> list[tuple[str, str, str, float]]:
+    """Возвращает самые свежие сохраненные ответы ИИ, от старых к новым."""
+    conn = _get_connection()
+    rows = conn.execute("""
+        SELECT lang, question, answer, created_at FROM ai_answer_cache
+        ORDER BY created_at DESC LIMIT ?
+    """, (limit,)).fetchall()
+    rows.reverse()
+    return rows
+
+
+@_in_db_thread
+def save_ai_answer(lang: str, question: str, answer: str, created_at: float):
+    conn = _get_connection()
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO ai_answer_cache (lang, question, answer, created_at)
+            VALUES (?, ?, ?, ?)
+        """, (lang, question, answer, created_at))
+
+
+@_in_db_thread
+def delete_ai_answer(lang: str, question: str):
+    conn = _get_connection()
+    with conn:
+        conn.execute("DELETE FROM ai_answer_cache WHERE lang = ? AND question = ?", (lang, question))
+
+
+@_in_db_thread
+def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """Берет или продлевает аренду name на ttl секунд.
+
+    Возвращает False, если аренду держит другой владелец и она еще не истекла.
+    Условный upsert выполняется одной командой, поэтому два процесса не возьмут
+    одну аренду одновременно.
+    """
+    now = time.time()
+    conn = _get_connection()
+    with conn:
+        cursor = conn.execute("""
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE leases.owner = excluded.owner OR leases.expires_at <= ?
+        """, (name, owner, now + ttl, now))
+    return cursor.rowcount > 0
+
+
+@_in_db_thread
+def release_lease(name: str, owner: str):
+    """Отпускает аренду, если ее держит owner."""
+    conn = _get_connection()
+    with conn:
+        conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
@@ -0,0 +1,278 @@
+"""Миграции схемы БД.
+
+Версия схемы хранится в PRAGMA user_version. Каждая миграция выполняется в
+своей транзакции вместе с записью новой версии, поэтому прерванный запуск
+не оставляет базу в промежуточном состоянии. Новые изменения схемы
+добавляются только новой миграцией в конец MIGRATIONS.
+"""
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+def _baseline(cursor: sqlite3.Cursor):
+    """Исходная схема, которую создавал init_db до появления миграций. Все
+    миграции идемпотентны: базы, созданные до миграций (user_version = 0),
+    проходят их без изменений."""
+    # Users table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            language_code TEXT DEFAULT 'ru',
+            xp INTEGER DEFAULT 0
+        )
+    """)
+    # Seen modules table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS seen_modules (
+            user_id INTEGER,
+            module_id INTEGER,
+            seen_date DATE,
+            PRIMARY KEY (user_id, module_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # Solved debunks table
+    cursor.execute("""
+            CREATE TABLE IF NOT EXISTS solved_debunks (
+                user_id INTEGER,
+                case_id TEXT,
+                solved_date DATE,
+                PRIMARY KEY (user_id, case_id),
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        """)
+
+
+def _add_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+    columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _broadcasts(cursor: sqlite3.Cursor):
+    """Рассылки: активность пользователей и прогресс для продолжения после перезапуска."""
+    # Пользователи, заблокировавшие бота, исключаются из рассылок
+    _add_column(cursor, 'users', 'is_active', 'INTEGER DEFAULT 1')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id TEXT PRIMARY KEY,
+            status TEXT,
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+
+
+def _persistence(cursor: sqlite3.Cursor):
+    """Состояние диалогов и user_data (SQLitePersistence)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS persisted_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS persisted_conversations (
+            name TEXT,
+            conversation_key TEXT,
+            state TEXT NOT NULL,
+            PRIMARY KEY (name, conversation_key)
+        )
+    """)
+
+
+def _ai_answer_cache(cursor: sqlite3.Cursor):
+    """Кэш ответов ИИ на типовые вопросы."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ai_answer_cache (
+            lang TEXT,
+            question TEXT,
+            answer TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (lang, question)
+        )
+    """)
+
+
+def _purchases(cursor: sqlite3.Cursor):
+    """Покупки в магазине. idempotency_key не дает списать XP дважды за одно нажатие."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS purchases (
+            purchase_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            user_id INTEGER NOT NULL,
+            item_id TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'completed',
+            created_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases (user_id, created_at)")
+
+
+def _media_file_ids(cursor: sqlite3.Cursor):
+    """file_id уже загруженных в Telegram стикеров и фото."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS media_file_ids (
+            source TEXT,
+            content_hash TEXT,
+            kind TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (source, content_hash)
+        )
+    """)
+
+
+def _leaderboard(cursor: sqlite3.Cursor):
+    """Рейтинг: индекс по XP, журнал начислений XP и недельные суммы по пользователям."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_xp ON users (xp DESC)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS xp_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_xp_events_user ON xp_events (user_id, created_at)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS weekly_xp (
+            week_start DATE,
+            user_id INTEGER,
+            xp INTEGER NOT NULL,
+            PRIMARY KEY (week_start, user_id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_weekly_xp_rank ON weekly_xp (week_start, xp DESC)")
+
+
+def _xp_stats(cursor: sqlite3.Cursor):
+    """Источник начислений XP (quiz, debunk, store...) и дневные сводки для /stats."""
+    _add_column(cursor, 'xp_events', 'source', 'TEXT')
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS xp_daily_stats (
+            day DATE,
+            source TEXT,
+            events INTEGER NOT NULL DEFAULT 0,
+            xp INTEGER NOT NULL DEFAULT 0,
+            users INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, source)
+        )
+    """)
+    # Уникальные пользователи дня и источника, чтобы считать users инкрементально
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS xp_daily_users (
+            day DATE,
+            source TEXT,
+            user_id INTEGER,
+            PRIMARY KEY (day, source, user_id)
+        ) WITHOUT ROWID
+    """)
+    # До какого события журнал уже свернут в сводки
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            last_event_id INTEGER NOT NULL
+        )
+    """)
+
+
+def _query_indexes(cursor: sqlite3.Cursor):
+    """Индексы под запросы квиза и очистку устаревших строк."""
+    # Недельный квиз: WHERE user_id = ? AND seen_date >= ? — покрывающий индекс
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_seen_modules_user_date ON seen_modules (user_id, seen_date, module_id)
+    """)
+    # Очистка старых отметок по дате
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_seen_modules_date ON seen_modules (seen_date)")
+    # Очистка журнала XP по дате; индекс по пользователю ни один запрос не использует
+    cursor.execute("DROP INDEX IF EXISTS idx_xp_events_user")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_xp_events_created ON xp_events (created_at)")
+    # solved_debunks: запрос по user_id покрывает первичный ключ (user_id, case_id)
+
+
+def _leases(cursor: sqlite3.Cursor):
+    """Аренды для координации процессов-шардов: задачу выполняет тот, кто держит аренду."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+
+def _rank_snapshot(cursor: sqlite3.Cursor):
+    """Общий снимок рейтинга: в режиме нескольких процессов его строит один воркер."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rank_snapshot (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            week TEXT NOT NULL,
+            built_at REAL NOT NULL,
+            xp_values BLOB NOT NULL,
+            weekly_users BLOB NOT NULL,
+            weekly_values BLOB NOT NULL,
+            top TEXT NOT NULL,
+            weekly_top TEXT NOT NULL
+        )
+    """)
+
+
+def _broadcast_recipients(cursor: sqlite3.Cursor):
+    """Получатели текущей страницы рассылки: после перезапуска им не отправляется повторно."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id TEXT,
+            user_id INTEGER,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+    """)
+
+
+MIGRATIONS = [
+    (1, 'baseline', _baseline),
+    (2, 'broadcasts', _broadcasts),
+    (3, 'persistence', _persistence),
+    (4, 'ai answer cache', _ai_answer_cache),
+    (5, 'purchases', _purchases),
+    (6, 'media file ids', _media_file_ids),
+    (7, 'leaderboard', _leaderboard),
+    (8, 'xp stats', _xp_stats),
+    (9, 'query indexes', _query_indexes),
+    (10, 'leases', _leases),
+    (11, 'rank snapshot', _rank_snapshot),
+    (12, 'broadcast recipients', _broadcast_recipients),
+]
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Применяет недостающие миграции. Возвращает итоговую версию схемы."""
+    version = get_version(conn)
+    for target, name, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info("Миграция схемы %s: %s", target, name)
+        conn.execute("BEGIN")
+        try:
+            apply(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {int(target)}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        version = target
+    return version
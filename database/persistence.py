@@ -0,0 +1,121 @@
+import json
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import sharding
+from . import db_handler
+
+
+def _dump_user_data(data: dict) -> str | None:
+    """Сериализует user_data в JSON, пропуская значения, которые нельзя сохранить.
+
+    Несериализуемые значения не сохраняются и после перезапуска создаются заново.
+    """
+    serializable = {}
+    for key, value in data.items():
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        serializable[key] = value
+    return json.dumps(serializable, ensure_ascii=False, separators=(',', ':')) if serializable else None
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит user_data и состояния ConversationHandler в основной базе SQLite.
+
+    Пишутся только пользователи, которых PTB пометил измененными, и только если
+    сериализованные данные действительно поменялись. Данные чатов, бота и
+    callback_data не используются и не сохраняются.
+
+    shard=(index, count) загружает только пользователей своего шарда: остальных
+    обслуживают другие процессы.
+    """
+
+    def __init__(self, update_interval: float = 60, shard: tuple[int, int] = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._user_data_dumps: dict[int, str] = {}
+        self._conversations: dict[str, dict] = {}
+        self.shard = shard
+
+    async def get_user_data(self) -> dict[int, dict]:
+        user_data = {}
+        for user_id, data in await db_handler.load_persisted_user_data():
+            if self.shard is not None and not sharding.owns(user_id, self.shard):
+                continue
+            user_data[user_id] = json.loads(data)
+            self._user_data_dumps[user_id] = data
+        return user_data
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        dump = _dump_user_data(data)
+        if dump == self._user_data_dumps.get(user_id):
+            return
+        await db_handler.save_persisted_user_data(user_id, dump)
+        if dump is None:
+            self._user_data_dumps.pop(user_id, None)
+        else:
+            self._user_data_dumps[user_id] = dump
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if self._user_data_dumps.pop(user_id, None) is not None:
+            await db_handler.save_persisted_user_data(user_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> dict:
+        conversations = {}
+        for key, state in await db_handler.load_persisted_conversations(name):
+            key = tuple(json.loads(key))
+            # Ключ диалога — (chat_id, user_id), шард определяется пользователем
+            if self.shard is not None and not sharding.owns(key[-1], self.shard):
+                continue
+            conversations[key] = json.loads(state)
+        self._conversations[name] = dict(conversations)
+        return conversations
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        stored = self._conversations.setdefault(name, {})
+        if stored.get(key) == new_state:
+            return
+        state = None if new_state is None else json.dumps(new_state)
+        await db_handler.save_persisted_conversation(name, json.dumps(list(key)), state)
+        if new_state is None:
+            stored.pop(key, None)
+        else:
+            stored[key] = new_state
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        # Каждое изменение записывается сразу, буферизованных данных нет
+        pass
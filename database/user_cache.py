@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """Ограниченный LRU-кэш профилей пользователей с TTL.
+
+    Хранит словари профиля (язык, XP) по user_id. Используется только из
+    event loop, поэтому блокировки не нужны. Чтобы загрузка из БД, начавшаяся
+    до изменения профиля, не записала в кэш устаревшие данные, каждая загрузка
+    получает токен, который изменения профиля аннулируют.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        # user_id -> {токен загрузки: актуален ли он}
+        self._loading: dict[int, dict[object, bool]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id: int):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return dict(entry[1])
+
+    def begin_load(self, user_id: int) -> object:
+        token = object()
+        self._loading.setdefault(user_id, {})[token] = True
+        return token
+
+    def _finish_load(self, user_id: int, token: object) -> bool:
+        loads = self._loading.get(user_id)
+        if loads is None:
+            return False
+        valid = loads.pop(token, False)
+        if not loads:
+            del self._loading[user_id]
+        return valid
+
+    def _mark_changed(self, user_id: int):
+        loads = self._loading.get(user_id)
+        if loads:
+            for token in loads:
+                loads[token] = False
+
+    def put(self, user_id: int, profile: dict, token: object):
+        """Кладет профиль, если с начала загрузки он не менялся."""
+        if not self._finish_load(user_id, token):
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl, dict(profile))
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def cancel_load(self, user_id: int, token: object):
+        self._finish_load(user_id, token)
+
+    def update(self, user_id: int, **fields):
+        """Обновляет поля профиля на месте, если он закэширован."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry[1].update(fields)
+        self._mark_changed(user_id)
+
+    def add_xp(self, user_id: int, amount: int):
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry[1]['xp'] += amount
+        self._mark_changed(user_id)
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+        self._mark_changed(user_id)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,130 @@
+import threading
+from datetime import date, datetime, timedelta
+
+
+def week_start(day: date) -> date:
+    """Понедельник недели, к которой относится день."""
+    return day - timedelta(days=day.weekday())
+
+
+class WriteBuffer:
+    """Буфер отложенной записи: копит изменения XP и отметки прогресса и схлопывает их.
+
+    Изменения XP одного пользователя суммируются, повторные отметки модулей и
+    кейсов дедуплицируются. Каждое начисление XP также попадает в журнал
+    xp_events и в недельную сумму пользователя (weekly_xp). Доступ защищён блокировкой, так как буфер пополняется
+    из event loop, а сбрасывается и читается из потока БД.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._xp_deltas: dict[int, int] = {}
+        self._seen: dict[tuple[int, int], date] = {}
+        self._solved: dict[tuple[int, str], date] = {}
+        self._events: list[tuple[int, int, str | None, datetime]] = []
+        self._weekly: dict[tuple[date, int], int] = {}
+        self.stats = {'buffered': 0, 'flushed_rows': 0, 'transactions': 0}
+
+    def __len__(self):
+        return len(self._xp_deltas) + len(self._seen) + len(self._solved) + len(self._events)
+
+    def add_xp(self, user_id: int, amount: int, source: str = None) -> int:
+        now = datetime.now()
+        weekly_key = (week_start(now.date()), user_id)
+        with self._lock:
+            self._xp_deltas[user_id] = self._xp_deltas.get(user_id, 0) + amount
+            self._events.append((user_id, amount, source, now))
+            self._weekly[weekly_key] = self._weekly.get(weekly_key, 0) + amount
+            self.stats['buffered'] += 1
+            return len(self)
+
+    def add_seen(self, user_id: int, module_id: int, seen_date: date) -> int:
+        with self._lock:
+            self._seen[(user_id, module_id)] = seen_date
+            self.stats['buffered'] += 1
+            return len(self)
+
+    def add_solved(self, user_id: int, case_id: str, solved_date: date) -> int:
+        with self._lock:
+            # INSERT OR IGNORE: первая отметка выигрывает
+            self._solved.setdefault((user_id, case_id), solved_date)
+            self.stats['buffered'] += 1
+            return len(self)
+
+    def pending_xp(self, user_id: int) -> int:
+        with self._lock:
+            return self._xp_deltas.get(user_id, 0)
+
+    def take_xp(self, user_id: int) -> int:
+        """Забирает из буфера накопленное изменение XP пользователя (для записи в своей транзакции)."""
+        with self._lock:
+            return self._xp_deltas.pop(user_id, 0)
+
+    def restore_xp(self, user_id: int, amount: int):
+        """Возвращает в буфер изменение, взятое take_xp, если транзакция не удалась."""
+        if amount:
+            self._restore({user_id: amount}, {}, {}, [], {})
+
+    def pending_seen_modules(self, user_id: int) -> set[int]:
+        with self._lock:
+            return {module_id for (uid, module_id) in self._seen if uid == user_id}
+
+    def pending_solved(self, user_id: int) -> set[str]:
+        with self._lock:
+            return {case_id for (uid, case_id) in self._solved if uid == user_id}
+
+    def flush_to(self, conn) -> int:
+        """Записывает накопленное одной транзакцией. Возвращает число записанных строк.
+
+        Вызывается только из потока БД: чтения с учетом буфера выполняются там же,
+        поэтому не могут увидеть уже снятые, но еще не записанные данные.
+        """
+        with self._lock:
+            xp_deltas, self._xp_deltas = self._xp_deltas, {}
+            seen, self._seen = self._seen, {}
+            solved, self._solved = self._solved, {}
+            events, self._events = self._events, []
+            weekly, self._weekly = self._weekly, {}
+
+        xp_rows = [(delta, uid) for uid, delta in xp_deltas.items() if delta]
+        seen_rows = [(uid, mid, d) for (uid, mid), d in seen.items()]
+        solved_rows = [(uid, cid, d) for (uid, cid), d in solved.items()]
+        weekly_rows = [(week, uid, xp) for (week, uid), xp in weekly.items()]
+        written = len(xp_rows) + len(seen_rows) + len(solved_rows) + len(events)
+        if not written:
+            return 0
+        try:
+            with conn:
+                conn.executemany("UPDATE users SET xp = xp + ? WHERE user_id = ?", xp_rows)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO seen_modules (user_id, module_id, seen_date) VALUES (?, ?, ?)",
+                    seen_rows)
+                conn.executemany(
+                    "INSERT OR IGNORE INTO solved_debunks (user_id, case_id, solved_date) VALUES (?, ?, ?)",
+                    solved_rows)
+                conn.executemany("INSERT INTO xp_events (user_id, amount, source, created_at) VALUES (?, ?, ?, ?)",
+                                 events)
+                conn.executemany("""
+                    INSERT INTO weekly_xp (week_start, user_id, xp) VALUES (?, ?, ?)
+                    ON CONFLICT (week_start, user_id) DO UPDATE SET xp = xp + excluded.xp
+                """, weekly_rows)
+        except Exception:
+            self._restore(xp_deltas, seen, solved, events, weekly)
+            raise
+
+        self.stats['flushed_rows'] += written
+        self.stats['transactions'] += 1
+        return written
+
+    def _restore(self, xp_deltas, seen, solved, events, weekly):
+        """Возвращает в буфер данные неудавшегося сброса, не затирая новые изменения."""
+        with self._lock:
+            for uid, delta in xp_deltas.items():
+                self._xp_deltas[uid] = self._xp_deltas.get(uid, 0) + delta
+            for key, d in seen.items():
+                self._seen.setdefault(key, d)
+            for key, d in solved.items():
+                self._solved.setdefault(key, d)
+            self._events[:0] = events
+            for key, xp in weekly.items():
+                self._weekly[key] = self._weekly.get(key, 0) + xp
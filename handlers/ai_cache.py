@@ -0,0 +1,189 @@
+import re
+import time
+from collections import OrderedDict
+
+from database import db_handler
+from metrics import REGISTRY
+
+# Кэш ответов ИИ на первые вопросы диалога
+ANSWER_CACHE_SIZE = 5000
+ANSWER_CACHE_TTL = 7 * 24 * 3600  # секунды
+SIMILARITY_THRESHOLD = 0.95  # минимальное сходство Жаккара по триграммам
+SHINGLE_SIZE = 3
+# Слова, меняющие смысл вопроса на противоположный (после normalize_question: isn't -> isn t)
+NEGATION_WORDS = frozenset({
+    'не', 'нет', 'ни', 'никогда', 'нельзя', 'без',
+    'not', 'no', 'never', 'without', 'isn', 'aren', 'wasn', 'weren', 'don', 'doesn', 'didn', 'can', 'cannot',
+})
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+_SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_question(text: str) -> str:
+    """Приводит вопрос к каноническому виду: регистр, пунктуация, пробелы, ё."""
+    text = text.lower().replace('ё', 'е')
+    text = _PUNCTUATION_RE.sub(' ', text)
+    return _SPACES_RE.sub(' ', text).strip()
+
+
+def guard_tokens(normalized: str) -> tuple:
+    """Числа и отрицания вопроса: похожие вопросы считаются одним, только если они совпадают.
+
+    «Новость номер 12» и «номер 13», «фото фейк» и «фото не фейк» почти не
+    отличаются триграммами, но ответы на них разные.
+    """
+    words = normalized.split()
+    return (tuple(word for word in words if any(char.isdigit() for char in word)),
+            tuple(sorted(word for word in words if word in NEGATION_WORDS)))
+
+
+def shingles(normalized: str) -> frozenset[str]:
+    """Символьные триграммы нормализованного текста."""
+    padded = f" {normalized} "
+    if len(padded) <= SHINGLE_SIZE:
+        return frozenset([padded])
+    return frozenset(padded[i:i + SHINGLE_SIZE] for i in range(len(padded) - SHINGLE_SIZE + 1))
+
+
+class _Entry:
+    __slots__ = ('answer', 'shingles', 'guard', 'created_at')
+
+    def __init__(self, answer: str, shingles_: frozenset, guard: tuple, created_at: float):
+        self.answer = answer
+        self.shingles = shingles_
+        self.guard = guard
+        self.created_at = created_at
+
+
+class AnswerCache:
+    """Кэш ответов ИИ по нормализованному тексту вопроса для каждого языка.
+
+    Точное совпадение ищется в словаре, похожие вопросы — через инвертированный
+    индекс триграмм (сходство Жаккара не ниже порога при совпадающих числах и
+    отрицаниях, см. guard_tokens). Записи вытесняются по LRU
+    и TTL и хранятся в SQLite, чтобы переживать перезапуск.
+    """
+
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = SIMILARITY_THRESHOLD, persistent: bool = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.persistent = persistent
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self._index: dict[tuple[str, str], set[str]] = {}  # (язык, триграмма) -> вопросы
+        self._loaded = not persistent
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def ensure_loaded(self):
+        """Загружает сохраненные ответы из БД при первом обращении."""
+        if self._loaded:
+            return
+        self._loaded = True
+        deadline = time.time() - self.ttl
+        for lang, question, answer, created_at in await db_handler.load_ai_answers(self.maxsize):
+            if created_at >= deadline:
+                self._insert(lang, question, answer, created_at)
+
+    def _insert(self, lang: str, question: str, answer: str, created_at: float):
+        key = (lang, question)
+        if key in self._entries:
+            self._remove(key)
+        entry = _Entry(answer, shingles(question), guard_tokens(question), created_at)
+        self._entries[key] = entry
+        for shingle in entry.shingles:
+            self._index.setdefault((lang, shingle), set()).add(question)
+
+    def _remove(self, key: tuple[str, str]):
+        entry = self._entries.pop(key)
+        lang, question = key
+        for shingle in entry.shingles:
+            questions = self._index.get((lang, shingle))
+            if questions is not None:
+                questions.discard(question)
+                if not questions:
+                    del self._index[(lang, shingle)]
+
+    def _find_similar(self, lang: str, normalized: str):
+        query = shingles(normalized)
+        guard = guard_tokens(normalized)
+        overlaps: dict[str, int] = {}
+        for shingle in query:
+            for question in self._index.get((lang, shingle), ()):
+                overlaps[question] = overlaps.get(question, 0) + 1
+        best, best_score = None, self.threshold
+        for question, overlap in overlaps.items():
+            entry = self._entries[(lang, question)]
+            score = overlap / (len(query) + len(entry.shingles) - overlap)
+            if score >= best_score and entry.guard == guard:
+                best, best_score = question, score
+        return best
+
+    async def get(self, lang: str, question: str) -> str | None:
+        await self.ensure_loaded()
+        normalized = normalize_question(question)
+        key = (lang, normalized)
+        entry = self._entries.get(key)
+        similar = False
+        if entry is None:
+            match = self._find_similar(lang, normalized)
+            if match is not None:
+                key, entry, similar = (lang, match), self._entries[(lang, match)], True
+        if entry is not None and time.time() - entry.created_at > self.ttl:
+            self._remove(key)
+            if self.persistent:
+                await db_handler.delete_ai_answer(*key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.similar_hits += similar
+        return entry.answer
+
+    async def put(self, lang: str, question: str, answer: str):
+        await self.ensure_loaded()
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        created_at = time.time()
+        self._insert(lang, normalized, answer, created_at)
+        evicted = []
+        while len(self._entries) > self.maxsize:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            evicted.append(oldest)
+        if self.persistent:
+            await db_handler.save_ai_answer(lang, normalized, answer, created_at)
+            for key in evicted:
+                await db_handler.delete_ai_answer(*key)
+
+    async def get_or_ask(self, lang: str, question: str, ask) -> tuple[str, bool]:
+        """Возвращает (ответ, из кэша ли он). ask(question) — корутина обращения к модели."""
+        answer = await self.get(lang, question)
+        if answer is not None:
+            return answer, True
+        answer = await ask(question)
+        await self.put(lang, question, answer)
+        return answer, False
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+answer_cache = AnswerCache()
+REGISTRY.stats_gauge('bot_ai_answer_cache', "Кэш ответов ИИ", answer_cache.stats)
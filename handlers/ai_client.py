@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+
+@dataclass
+class ModelReply:
+    """Ответ модели. При потоковой генерации заполняется по мере получения фрагментов."""
+    text: str = ''
+    prompt_tokens: int | None = None
+
+
+class ModelClient(ABC):
+    """Интерфейс клиента языковой модели.
+
+    history — список сообщений в формате Gemini ({'role': ..., 'parts': [...]}).
+    """
+
+    @abstractmethod
+    async def generate(self, history: list[dict], question: str) -> ModelReply:
+        """Полный ответ модели одним запросом."""
+
+    @abstractmethod
+    def stream(self, history: list[dict], question: str, reply: ModelReply):
+        """Асинхронный генератор текстовых фрагментов; по ходу заполняет reply."""
+
+
+class GeminiClient(ModelClient):
+    """Клиент Gemini. Библиотека и модель инициализируются при первом запросе."""
+
+    def __init__(self, api_key: str, system_prompt: str, model_name: str = 'gemini-1.5-flash'):
+        if not api_key:
+            raise ValueError("Не найден GEMINI_API_KEY в .env файле!")
+        self.api_key = api_key
+        self.system_prompt = system_prompt
+        self.model_name = model_name
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            import google.generativeai as genai
+
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(model_name=self.model_name, system_instruction=self.system_prompt)
+        return self._model
+
+    @staticmethod
+    def _prompt_tokens(response):
+        usage = getattr(response, 'usage_metadata', None)
+        return getattr(usage, 'prompt_token_count', None) or None
+
+    async def generate(self, history: list[dict], question: str) -> ModelReply:
+        chat_session = self._get_model().start_chat(history=history)
+        response = await chat_session.send_message_async(question)
+        return ModelReply(text=response.text, prompt_tokens=self._prompt_tokens(response))
+
+    async def stream(self, history: list[dict], question: str, reply: ModelReply):
+        chat_session = self._get_model().start_chat(history=history)
+        response = await chat_session.send_message_async(question, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Фрагмент без текста (например, только метаданные)
+                continue
+            reply.text += text
+            yield text
+        reply.prompt_tokens = self._prompt_tokens(response)
+
+
+class StubClient(ModelClient):
+    """Детерминированная локальная модель для тестов и нагрузочных прогонов без сети.
+
+    Ответ зависит только от вопроса; latency — общее время генерации в секундах,
+    output_size — длина ответа в символах.
+    """
+
+    def __init__(self, latency: float = 0.5, output_size: int = 500, chunk_size: int = 50):
+        self.latency = latency
+        self.output_size = output_size
+        self.chunk_size = chunk_size
+        self.requests = 0
+
+    def _answer(self, question: str) -> str:
+        digest = hashlib.sha1(question.encode('utf-8')).hexdigest()
+        text = f"[stub {digest[:8]}] {question}\n"
+        filler = "Проверяй источник, дату и автора. "
+        while len(text) < self.output_size:
+            text += filler
+        return text[:self.output_size]
+
+    async def generate(self, history: list[dict], question: str) -> ModelReply:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return ModelReply(text=self._answer(question))
+
+    async def stream(self, history: list[dict], question: str, reply: ModelReply):
+        self.requests += 1
+        answer = self._answer(question)
+        chunks = [answer[i:i + self.chunk_size] for i in range(0, len(answer), self.chunk_size)] or ['']
+        delay = self.latency / len(chunks)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            reply.text += chunk
+            yield chunk
+
+
+def create_client(backend: str, system_prompt: str, api_key: str = None, **options) -> ModelClient:
+    """Создает клиента модели по имени бэкенда ('gemini' или 'stub')."""
+    if backend == 'gemini':
+        return GeminiClient(api_key, system_prompt)
+    if backend == 'stub':
+        return StubClient(**options)
+    raise ValueError(f"Неизвестный AI_BACKEND: {backend}")
@@ -1,10 +1,23 @@
-import google.generativeai as genai
+import logging
+
 from telegram import Update
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes, ConversationHandler, filters
-from config import GEMINI_API_KEY
+from config import GEMINI_API_KEY, AI_STREAMING, AI_BACKEND, AI_STUB_LATENCY, AI_STUB_OUTPUT_SIZE
 from database import db_handler
+from metrics import REGISTRY
+from .ai_cache import answer_cache
+from .ai_client import ModelClient, ModelReply, create_client
+from .ai_scheduler import scheduler
+from .ai_sessions import estimate_tokens, sessions
+from .ai_streaming import StreamingReply, send_long_text
+from .update_processor import slot_released
 from .utils import get_text
 
+logger = logging.getLogger(__name__)
+
+AI_ERRORS = REGISTRY.counter('bot_ai_errors_total', "Ошибки запросов к модели ИИ", ('error',))
+
 # Определяем состояние диалога
 AWAITING_QUESTION, = range(1)
 
@@ -18,22 +31,35 @@ SYSTEM_PROMPT = """Ты — SuriMIL, дружелюбный и умный экс
 4. Предложи воспользоваться инструментами: "Как насчет того, чтобы сделать обратный поиск по картинке из статьи?".
 5. Давай прямой ответ только если пользователь несколько раз попросит об этом прямо ("скажи прямо, да или нет")."""
 
-# Настройка Gemini
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel(
-    model_name='gemini-1.5-flash',
-    system_instruction=SYSTEM_PROMPT)
+_client = None
+
+
+def get_client() -> ModelClient:
+    """Возвращает клиента модели, создавая его при первом обращении."""
+    global _client
+    if _client is None:
+        if AI_BACKEND == 'stub':
+            _client = create_client('stub', SYSTEM_PROMPT, latency=AI_STUB_LATENCY, output_size=AI_STUB_OUTPUT_SIZE)
+        else:
+            _client = create_client(AI_BACKEND, SYSTEM_PROMPT, api_key=GEMINI_API_KEY)
+    return _client
+
+
+def set_client(client: ModelClient):
+    """Подменяет клиента модели (заглушка в тестах и нагрузочных прогонах)."""
+    global _client
+    _client = client
 
 
 async def start_ai_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начинает диалог с ИИ, создавая сессию чата."""
     user_id = update.effective_user.id
-    user = db_handler.get_or_create_user(user_id)
+    user = await db_handler.get_or_create_user(user_id)
     lang = user['language_code']
 
-    # Создаем новую сессию чата с историей и сохраняем ее для пользователя
+    # Создаем новую сессию с ограниченной историей
     # Это позволит ИИ "помнить" предыдущие сообщения в рамках одного диалога
-    context.user_data['ai_chat_session'] = model.start_chat(history=[])
+    sessions.start(user_id)
 
     await update.message.reply_text(get_text('ai_welcome_prompt', lang))
 
@@ -44,25 +70,65 @@ async def start_ai_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обрабатывает вопрос пользователя в рамках текущей сессии чата."""
     user_id = update.effective_user.id
-    user = db_handler.get_or_create_user(user_id)
+    user = await db_handler.get_or_create_user(user_id)
     lang = user['language_code']
     question = update.message.text
 
-    # Получаем текущую сессию чата из user_data
-    chat_session = context.user_data.get('ai_chat_session')
-    if not chat_session:
-        # Если сессия потеряна, начинаем заново
-        return await start_ai_dialog(update, context)
+    # Первый вопрос диалога не зависит от истории, и на типовые вопросы
+    # отвечаем из кэша без обращения к модели
+    first_turn = sessions.get(user_id).is_empty()
+    if first_turn:
+        cached_answer = await answer_cache.get(lang, question)
+        if cached_answer is not None:
+            try:
+                await send_long_text(update.message, cached_answer)
+            except TelegramError as e:
+                # Не удалось доставить ответ из кэша — спрашиваем модель как обычно
+                logger.warning("Не удалось отправить ответ из кэша %s: %s: %s", user_id, type(e).__name__, e)
+            else:
+                sessions.record_turn(user_id, question, cached_answer)
+                return AWAITING_QUESTION
+
+    async def ask_model():
+        # История берется в момент запуска: если вопрос ждал в очереди,
+        # в ней уже есть ответ на предыдущий вопрос пользователя
+        history = sessions.get(user_id).history()
+        prompt_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(question) + sum(
+            estimate_tokens(part) for message in history for part in message['parts'])
+        client = get_client()
+        if streaming_reply is None:
+            reply = await client.generate(history, question)
+            answer = reply.text
+        else:
+            # Ответ показывается по мере генерации: пользователь ждет первый
+            # фрагмент, а не весь ответ
+            await streaming_reply.restart()
+            reply = ModelReply()
+            async for chunk in scheduler.iter_chunks(client.stream(history, question, reply)):
+                await streaming_reply.append(chunk)
+            answer = await streaming_reply.finish()
+        sessions.record_request(reply.prompt_tokens or prompt_tokens)
+        sessions.record_turn(user_id, question, answer)
+        return answer
 
     thinking_message = await update.message.reply_text(get_text('ask_ai_thinking', lang))
+    streaming_reply = StreamingReply(thinking_message) if AI_STREAMING else None
 
     try:
-        # Отправляем сообщение в текущий чат, Gemini сам учтет историю
-        # Мы больше не передаем весь промпт каждый раз
-        response = await chat_session.send_message_async(question)
-        await thinking_message.edit_text(response.text)
+        # Планировщик ограничивает общее число запросов и повторяет запрос при
+        # временных ошибках. Пока ждем модель, слот обработки обновлений отдаем
+        # другим пользователям; следующий вопрос этого пользователя все равно
+        # дождется ответа на текущий
+        async with slot_released():
+            answer = await scheduler.submit(ask_model, stream=streaming_reply is not None)
+        if streaming_reply is None:
+            await send_long_text(thinking_message, answer, edit=True)
+        # В кэш попадает только ответ, который удалось доставить
+        if first_turn:
+            await answer_cache.put(lang, question, answer)
     except Exception as e:
-        print(f"Ошибка Gemini API: {e}")
+        AI_ERRORS.inc(error=type(e).__name__)
+        logger.warning("Ошибка модели ИИ для %s: %s: %s", user_id, type(e).__name__, e)
         await thinking_message.edit_text("Произошла ошибка при обращении к ИИ. Попробуй позже.")
 
 
@@ -72,12 +138,11 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def cancel_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отменяет текущий диалог с ИИ и очищает память."""
-    user = db_handler.get_or_create_user(update.effective_user.id)
+    user = await db_handler.get_or_create_user(update.effective_user.id)
     lang = user['language_code']
 
     # Очищаем данные сессии из памяти
-    if 'ai_chat_session' in context.user_data:
-        del context.user_data['ai_chat_session']
+    sessions.end(update.effective_user.id)
 
     await context.bot.send_message(
         chat_id=update.effective_user.id,
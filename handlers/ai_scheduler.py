@@ -0,0 +1,153 @@
+import asyncio
+import time
+from collections import deque
+
+from metrics import REGISTRY, Histogram
+
+# Ограничения обращений к ИИ
+AI_MAX_CONCURRENCY = 8
+AI_REQUEST_TIMEOUT = 30.0  # секунды на одну попытку
+# Потоковый ответ ограничивается не целиком, а ожиданием каждого фрагмента
+# (первого и следующего за предыдущим): длинный ответ может идти дольше
+AI_STREAM_IDLE_TIMEOUT = 30.0
+AI_MAX_RETRIES = 2
+AI_RETRY_BASE_DELAY = 1.0
+
+# Ошибки API, после которых имеет смысл повторить запрос (квоты, перегрузка, таймауты)
+RETRYABLE_ERROR_NAMES = {
+    'ResourceExhausted', 'ServiceUnavailable', 'DeadlineExceeded', 'InternalServerError', 'TooManyRequests',
+}
+
+
+def is_retryable(error: BaseException) -> bool:
+    return isinstance(error, asyncio.TimeoutError) or type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+class _Job:
+    __slots__ = ('func', 'future', 'stream', 'enqueued_at')
+
+    def __init__(self, func, future, stream: bool):
+        self.func = func
+        self.future = future
+        self.stream = stream
+        self.enqueued_at = time.monotonic()
+
+
+class AIScheduler:
+    """Планировщик запросов к ИИ.
+
+    Не больше max_concurrency запросов одновременно, остальные ждут в общей
+    очереди по порядку поступления. Очереди по пользователям не нужны:
+    обновления одного пользователя обрабатываются строго по очереди
+    (PerUserUpdateProcessor), поэтому у него не бывает больше одного запроса.
+    Каждая попытка ограничена таймаутом (у потоковых запросов — таймаутом
+    ожидания фрагмента, см. iter_chunks), временные ошибки API повторяются с
+    экспоненциальной задержкой.
+    """
+
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY,
+                 timeout: float = AI_REQUEST_TIMEOUT, max_retries: int = AI_MAX_RETRIES,
+                 retry_base_delay: float = AI_RETRY_BASE_DELAY,
+                 idle_timeout: float = AI_STREAM_IDLE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self._queue: deque[_Job] = deque()
+        self._running = 0
+        self._tasks: set[asyncio.Task] = set()
+        self.wait_time = Histogram()
+        self.latency = Histogram()
+        self.retries = 0
+        self.failures = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    async def submit(self, func, stream: bool = False):
+        """Ставит func() (корутину запроса к модели) в очередь и ждет результат.
+
+        stream=True — func читает потоковый ответ через iter_chunks: общий
+        таймаут попытки к ней не применяется.
+        """
+        job = _Job(func, asyncio.get_running_loop().create_future(), stream)
+        self._queue.append(job)
+        self._dispatch()
+        return await job.future
+
+    def _dispatch(self):
+        while self._queue and self._running < self.max_concurrency:
+            job = self._queue.popleft()
+            if job.future.cancelled():
+                # Отправитель больше не ждет ответа
+                continue
+            self._running += 1
+            task = asyncio.create_task(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: _Job):
+        started = time.monotonic()
+        self.wait_time.observe(started - job.enqueued_at)
+        try:
+            result = await self._call_with_retries(job.func, None if job.stream else self.timeout)
+        except Exception as e:
+            self.failures += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.latency.observe(time.monotonic() - started)
+            self._running -= 1
+            self._dispatch()
+
+    async def iter_chunks(self, stream):
+        """Фрагменты потокового ответа. asyncio.TimeoutError, если очередной
+        фрагмент не пришел за idle_timeout секунд."""
+        iterator = aiter(stream)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(iterator), timeout=self.idle_timeout)
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        finally:
+            aclose = getattr(iterator, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+
+    async def _call_with_retries(self, func, timeout: float | None):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await asyncio.wait_for(func(), timeout=timeout)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.retry_base_delay * 2 ** attempt)
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth,
+            'running': self.running,
+            'retries': self.retries,
+            'failures': self.failures,
+            'wait_time': self.wait_time.snapshot(),
+            'latency': self.latency.snapshot(),
+        }
+
+
+scheduler = AIScheduler()
+
+REGISTRY.histogram('bot_ai_wait_seconds', "Ожидание запроса к ИИ в очереди планировщика").attach(scheduler.wait_time)
+REGISTRY.histogram('bot_ai_latency_seconds', "Время запроса к модели ИИ с повторами").attach(scheduler.latency)
+REGISTRY.stats_gauge('bot_ai_scheduler', "Состояние планировщика запросов к ИИ", scheduler.stats)
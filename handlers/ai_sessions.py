@@ -0,0 +1,170 @@
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+# Ограничения истории диалога с ИИ (в оценочных токенах)
+MAX_HISTORY_TOKENS = 3000
+SUMMARY_MAX_TOKENS = 400
+SESSION_TTL = 30 * 60  # секунды простоя, после которых сессия удаляется
+GLOBAL_TOKEN_BUDGET = 2_000_000  # суммарно по всем пользователям
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов без обращения к API (~4 символа на токен)."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class AISession:
+    """История одного диалога: скользящее окно реплик и сводка вытесненных."""
+
+    __slots__ = ('turns', 'summary', 'tokens', 'last_used')
+
+    def __init__(self):
+        self.turns: list[tuple[str, str, int]] = []  # (вопрос, ответ, токены)
+        self.summary = ''
+        self.tokens = 0
+        self.last_used = time.monotonic()
+
+    def history(self) -> list[dict]:
+        """История в формате Gemini (role/parts)."""
+        history = []
+        if self.summary:
+            history.append({'role': 'user', 'parts': [f"Краткое содержание начала нашего диалога:\n{self.summary}"]})
+            history.append({'role': 'model', 'parts': ["Понял, продолжаем."]})
+        for question, answer, _ in self.turns:
+            history.append({'role': 'user', 'parts': [question]})
+            history.append({'role': 'model', 'parts': [answer]})
+        return history
+
+    def _fold_into_summary(self, question: str, answer: str):
+        """Переносит вытесненную реплику в сводку (локально, без вызова модели)."""
+        line = f"- Вопрос: {question[:200]} Ответ: {answer[:200]}"
+        summary = f"{self.summary}\n{line}" if self.summary else line
+        max_chars = SUMMARY_MAX_TOKENS * CHARS_PER_TOKEN
+        if len(summary) > max_chars:
+            # Оставляем самые свежие строки сводки
+            summary = summary[-max_chars:].split('\n', 1)[-1]
+        self.summary = summary
+
+    def add_turn(self, question: str, answer: str):
+        turn_tokens = estimate_tokens(question) + estimate_tokens(answer)
+        self.turns.append((question, answer, turn_tokens))
+        self.tokens += turn_tokens
+        while self.tokens > MAX_HISTORY_TOKENS and len(self.turns) > 1:
+            old_question, old_answer, old_tokens = self.turns.pop(0)
+            self.tokens -= old_tokens
+            self._fold_into_summary(old_question, old_answer)
+
+    def is_empty(self) -> bool:
+        return not self.turns and not self.summary
+
+    def size(self) -> int:
+        return self.tokens + estimate_tokens(self.summary)
+
+
+class AISessionManager:
+    """Сессии диалогов с ИИ по user_id с TTL и общим бюджетом памяти.
+
+    Заменяет хранение объекта ChatSession в user_data: история ограничена по
+    токенам, простаивающие сессии удаляются, а при превышении общего бюджета
+    вытесняются давно не использованные.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, token_budget: int = GLOBAL_TOKEN_BUDGET):
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self._sessions: OrderedDict[int, AISession] = OrderedDict()
+        self._total_tokens = 0
+        self.evicted_idle = 0
+        self.evicted_budget = 0
+        self.requests = 0
+        self.prompt_tokens_total = 0
+        self.last_prompt_tokens = 0
+
+    def __contains__(self, user_id: int):
+        return user_id in self._sessions
+
+    def start(self, user_id: int) -> AISession:
+        """Начинает новую сессию (старая история отбрасывается)."""
+        self.end(user_id)
+        session = AISession()
+        self._sessions[user_id] = session
+        # Пустая сессия тоже имеет размер (оценка пустой сводки), а end() и
+        # вытеснение его вычитают — учитываем его и здесь
+        self._total_tokens += session.size()
+        return session
+
+    def get(self, user_id: int) -> AISession:
+        """Возвращает сессию пользователя, создавая новую, если ее нет или она устарела."""
+        session = self._sessions.get(user_id)
+        if session is None or time.monotonic() - session.last_used > self.ttl:
+            return self.start(user_id)
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def end(self, user_id: int):
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self._total_tokens -= session.size()
+
+    def record_request(self, prompt_tokens: int):
+        self.requests += 1
+        self.prompt_tokens_total += prompt_tokens
+        self.last_prompt_tokens = prompt_tokens
+
+    def record_turn(self, user_id: int, question: str, answer: str):
+        session = self._sessions.get(user_id) or self.start(user_id)
+        size_before = session.size()
+        session.add_turn(question, answer)
+        session.last_used = time.monotonic()
+        self._sessions.move_to_end(user_id)
+        self._total_tokens += session.size() - size_before
+        self._enforce_budget()
+
+    def total_tokens(self) -> int:
+        return self._total_tokens
+
+    def _enforce_budget(self):
+        while self._total_tokens > self.token_budget and len(self._sessions) > 1:
+            _, session = self._sessions.popitem(last=False)
+            self._total_tokens -= session.size()
+            self.evicted_budget += 1
+
+    def evict_idle(self) -> int:
+        """Удаляет сессии, простаивающие дольше TTL. Возвращает число удаленных."""
+        deadline = time.monotonic() - self.ttl
+        # Сессии упорядочены по последнему использованию: старые в начале
+        evicted = 0
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_used > deadline:
+                break
+            self.end(user_id)
+            evicted += 1
+        self.evicted_idle += evicted
+        return evicted
+
+    def stats(self) -> dict:
+        sizes = [session.size() for session in self._sessions.values()]
+        return {
+            'sessions': len(sizes),
+            'history_tokens_total': self._total_tokens,
+            'history_tokens_max': max(sizes, default=0),
+            'requests': self.requests,
+            'prompt_tokens_avg': self.prompt_tokens_total / self.requests if self.requests else 0.0,
+            'prompt_tokens_last': self.last_prompt_tokens,
+            'evicted_idle': self.evicted_idle,
+            'evicted_budget': self.evicted_budget,
+        }
+
+
+sessions = AISessionManager()
+REGISTRY.stats_gauge('bot_ai_sessions', "Сессии диалога с ИИ", sessions.stats)
+
+
+async def evict_job(context):
+    """Периодическая задача job_queue: удаляет простаивающие сессии."""
+    sessions.evict_idle()
@@ -0,0 +1,120 @@
+import time
+
+from telegram.error import BadRequest
+
+# Telegram ограничивает длину сообщения 4096 кодовыми единицами UTF-16
+# (эмодзи и другие символы вне BMP считаются за две), берем с запасом
+MAX_MESSAGE_LENGTH = 4000
+# Не чаще одного редактирования сообщения в EDIT_INTERVAL секунд
+EDIT_INTERVAL = 1.5
+
+
+def utf16_length(text: str) -> int:
+    """Длина текста так, как ее считает Telegram: в кодовых единицах UTF-16."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def utf16_prefix(text: str, limit: int) -> str:
+    """Наибольшее начало текста не длиннее limit кодовых единиц UTF-16."""
+    # Половина суррогатной пары на границе отбрасывается при декодировании
+    return text.encode('utf-16-le')[:2 * limit].decode('utf-16-le', 'ignore')
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> tuple[str, str]:
+    """Делит текст на часть не длиннее limit (UTF-16) и остаток, по возможности по границе строки или слова."""
+    if utf16_length(text) <= limit:
+        return text, ''
+    end = len(utf16_prefix(text, limit))
+    cut = text.rfind('\n', 0, end)
+    if cut < end // 2:
+        cut = text.rfind(' ', 0, end)
+    if cut < end // 2:
+        cut = end
+    return text[:cut], text[cut:].lstrip()
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """Делит текст на части, каждая из которых помещается в одно сообщение."""
+    parts = []
+    while text:
+        head, text = split_text(text, limit)
+        parts.append(head)
+    return parts or ['…']
+
+
+async def send_long_text(message, text: str, edit: bool = False, max_length: int = MAX_MESSAGE_LENGTH):
+    """Отправляет текст любой длины ответом на message.
+
+    При edit=True первая часть заменяет текст message (сообщение «думаю...»),
+    остальные части уходят новыми сообщениями, как при потоковом ответе.
+    """
+    parts = split_message(text, max_length)
+    if edit:
+        await message.edit_text(parts[0])
+    else:
+        message = await message.reply_text(parts[0])
+    for part in parts[1:]:
+        message = await message.reply_text(part)
+
+
+class StreamingReply:
+    """Постепенно показывает ответ модели, редактируя сообщение «думаю...».
+
+    Правки идут не чаще EDIT_INTERVAL, первая — сразу после первого фрагмента.
+    Когда текст не помещается в одно сообщение, текущее сообщение фиксируется,
+    а продолжение отправляется новыми сообщениями.
+    """
+
+    def __init__(self, first_message, edit_interval: float = EDIT_INTERVAL,
+                 max_length: int = MAX_MESSAGE_LENGTH):
+        self.first_message = first_message
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+        self.edits = 0
+        self._reset()
+
+    def _reset(self):
+        self._message = self.first_message
+        self._extra_messages = []
+        self._text = ''  # текст текущего (последнего) сообщения
+        self._shown = None  # что сейчас отображается в текущем сообщении
+        self._last_edit = 0.0
+        self.full_text = ''
+
+    async def restart(self):
+        """Начинает ответ заново (перед повторной попыткой запроса), удаляя лишние сообщения."""
+        for message in self._extra_messages:
+            try:
+                await message.delete()
+            except BadRequest:
+                pass
+        self._reset()
+
+    async def _show(self, text: str):
+        if not text or text == self._shown:
+            return
+        try:
+            await self._message.edit_text(text)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+        self._shown = text
+        self._last_edit = time.monotonic()
+        self.edits += 1
+
+    async def append(self, chunk: str):
+        self.full_text += chunk
+        self._text += chunk
+        while utf16_length(self._text) > self.max_length:
+            head, self._text = split_text(self._text, self.max_length)
+            await self._show(head)
+            self._shown = utf16_prefix(self._text, self.max_length) or '…'
+            self._message = await self._message.reply_text(self._shown)
+            self._extra_messages.append(self._message)
+        if time.monotonic() - self._last_edit >= self.edit_interval:
+            await self._show(self._text)
+
+    async def finish(self) -> str:
+        """Показывает окончательный текст и возвращает ответ целиком."""
+        await self._show(self._text)
+        return self.full_text
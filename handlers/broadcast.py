@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError, TimedOut
+
+import sharding
+from database import db_handler
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 в секунду в один чат
+BROADCAST_RATE = 30
+BROADCAST_CONCURRENCY = 20
+BROADCAST_PAGE_SIZE = 500
+PER_CHAT_INTERVAL = 1.0
+MAX_SEND_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+# Аренда рассылки шарда; продлевается после каждой страницы
+BROADCAST_LEASE_TTL = 600.0
+
+BROADCAST_MESSAGES = REGISTRY.counter('bot_broadcast_messages_total', "Итог отправки сообщений рассылки", ('result',))
+BROADCAST_RETRIES = REGISTRY.counter('bot_broadcast_retries_total', "Повторы отправки в рассылке", ('reason',))
+# Прогресс идущих рассылок: broadcast_id -> словарь прогресса
+_running: dict[str, dict] = {}
+# Рассылки, уже запущенные в этом процессе (ежедневная задача и досылка не должны идти вместе)
+_claimed: set[str] = set()
+
+
+def _collect_progress() -> dict:
+    return {(broadcast_id, stat): progress[stat]
+            for broadcast_id, progress in _running.items()
+            for stat in ('sent', 'failed', 'blocked', 'last_user_id')}
+
+
+REGISTRY.gauge('bot_broadcast_progress', "Прогресс идущих рассылок", _collect_progress, ('broadcast_id', 'stat'))
+
+
+class TokenBucket:
+    """Асинхронный token bucket: не больше rate отправок в секунду с запасом capacity."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов (например, после RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class _Broadcast:
+    """Одна рассылка: отправка страницами с ограничением скорости и сохранением прогресса."""
+
+    def __init__(self, bot, progress: dict, build_message, on_sent, concurrency: int, rate: float,
+                 shard: tuple[int, int] = None, lease: str = None):
+        self.bot = bot
+        self.shard = shard
+        self.lease = lease
+        self.progress = progress
+        self.build_message = build_message
+        self.on_sent = on_sent
+        self.bucket = TokenBucket(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self._chat_next_send: dict[int, float] = {}
+
+    async def _wait_for_chat(self, chat_id: int):
+        delay = self._chat_next_send.get(chat_id, 0) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self.bucket.acquire()
+        self._chat_next_send[chat_id] = time.monotonic() + PER_CHAT_INTERVAL
+
+    def _count(self, result: str):
+        self.progress[result] += 1
+        BROADCAST_MESSAGES.inc(result=result)
+
+    async def _deliver(self, user_id: int, lang: str) -> str:
+        """Отправляет сообщение с повторами. Возвращает итог: sent, blocked или failed."""
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await self._wait_for_chat(user_id)
+            try:
+                await self.bot.send_message(chat_id=user_id, **self.build_message(lang))
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                logger.warning("Flood control, пауза рассылки на %.1f c", delay)
+                self.bucket.pause(delay)
+                BROADCAST_RETRIES.inc(reason='flood')
+                continue
+            except Forbidden:
+                # Пользователь заблокировал бота: больше ему не пишем
+                await db_handler.set_user_active(user_id, False)
+                return 'blocked'
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    await db_handler.set_user_active(user_id, False)
+                    return 'blocked'
+                logger.warning("Не удалось отправить сообщение пользователю %s: %s", user_id, e)
+                return 'failed'
+            except (TimedOut, NetworkError) as e:
+                delay = RETRY_BASE_DELAY * 2 ** attempt
+                logger.debug("Сетевая ошибка для %s (%s), повтор через %.1f c", user_id, e, delay)
+                BROADCAST_RETRIES.inc(reason='network')
+                await asyncio.sleep(delay)
+                continue
+            except TelegramError as e:
+                logger.warning("Не удалось отправить сообщение пользователю %s: %s: %s", user_id, type(e).__name__, e)
+                return 'failed'
+            return 'sent'
+        logger.warning("Сообщение пользователю %s не отправлено после %s попыток", user_id, MAX_SEND_ATTEMPTS)
+        return 'failed'
+
+    async def send_one(self, user_id: int, lang: str):
+        """Отправляет одному получателю. Ошибка одного получателя не прерывает страницу."""
+        async with self.semaphore:
+            try:
+                result = await self._deliver(user_id, lang)
+            except Exception:
+                logger.exception("Ошибка рассылки пользователю %s", user_id)
+                result = 'failed'
+            self._count(result)
+            try:
+                # Отметка сразу после отправки: после перезапуска пользователь не получит сообщение повторно
+                await db_handler.save_broadcast_recipient(self.progress, user_id)
+            except Exception:
+                logger.exception("Не удалось сохранить отметку рассылки для %s", user_id)
+            if result == 'sent' and self.on_sent:
+                try:
+                    await self.on_sent(user_id, lang)
+                except Exception:
+                    logger.exception("Ошибка on_sent рассылки для %s", user_id)
+
+    async def run(self, page_size: int) -> bool:
+        """Отправляет все страницы. False — аренду рассылки перехватил другой процесс."""
+        broadcast_id = self.progress['broadcast_id']
+        while True:
+            after = self.progress['last_user_id']
+            page = await db_handler.get_active_users_page(after, page_size, self.shard)
+            if not page:
+                return True
+            # Кому на этой странице уже отправили до перезапуска
+            done = await db_handler.get_broadcast_recipients(broadcast_id, after, page[-1][0])
+            await asyncio.gather(*(self.send_one(user_id, lang) for user_id, lang in page if user_id not in done))
+            # Контрольная точка после страницы; отметки получателей до нее удаляются
+            self.progress['last_user_id'] = page[-1][0]
+            await db_handler.save_broadcast(self.progress)
+            if self.lease and not await db_handler.acquire_lease(self.lease, sharding.owner_id(), BROADCAST_LEASE_TTL):
+                return False
+
+
+def shard_broadcast_id(broadcast_id: str, shard: tuple[int, int] | None) -> str:
+    """Идентификатор прогресса рассылки шарда: у каждого шарда своя строка в broadcasts."""
+    if shard is None:
+        return broadcast_id
+    index, count = shard
+    return f"{broadcast_id}:shard{index}of{count}"
+
+
+async def run_broadcast(bot, broadcast_id: str, build_message, on_sent=None,
+                        concurrency: int = BROADCAST_CONCURRENCY, rate: float = BROADCAST_RATE,
+                        page_size: int = BROADCAST_PAGE_SIZE, shard: tuple[int, int] = None) -> dict | None:
+    """Рассылает сообщение всем активным пользователям.
+
+    build_message(lang) возвращает аргументы для bot.send_message (кроме chat_id),
+    on_sent(user_id, lang) вызывается после успешной отправки. Повторный вызов с
+    тем же broadcast_id продолжает прерванную рассылку или ничего не делает,
+    если она уже завершена. Возвращает итоговый прогресс со скоростью и временем.
+
+    shard=(index, count) рассылает только пользователям шарда: у каждого шарда свой
+    прогресс и своя доля лимита Telegram, а аренда не дает двум процессам одного
+    шарда рассылать одновременно. Если аренду держит другой процесс или эта же
+    рассылка уже идет в этом процессе, возвращает None.
+    """
+    lease = None
+    if shard is not None:
+        broadcast_id = shard_broadcast_id(broadcast_id, shard)
+        rate /= shard[1]
+        lease = f"broadcast:{broadcast_id}"
+        if not await db_handler.acquire_lease(lease, sharding.owner_id(), BROADCAST_LEASE_TTL):
+            logger.info("Рассылку %s выполняет другой процесс", broadcast_id)
+            return None
+    if broadcast_id in _claimed:
+        logger.info("Рассылка %s уже идет", broadcast_id)
+        return None
+    _claimed.add(broadcast_id)
+    try:
+        return await _run_broadcast(bot, broadcast_id, build_message, on_sent, concurrency, rate, page_size,
+                                    shard, lease)
+    finally:
+        _claimed.discard(broadcast_id)
+        if lease:
+            await db_handler.release_lease(lease, sharding.owner_id())
+
+
+async def _run_broadcast(bot, broadcast_id: str, build_message, on_sent, concurrency: int, rate: float,
+                         page_size: int, shard: tuple[int, int] | None, lease: str | None) -> dict:
+    progress = await db_handler.get_broadcast(broadcast_id)
+    if progress and progress['status'] == 'done':
+        logger.info("Рассылка %s уже завершена, пропускаем", broadcast_id)
+        return progress
+    if progress:
+        logger.info("Продолжаем рассылку %s с user_id > %s", broadcast_id, progress['last_user_id'])
+    else:
+        progress = {
+            'broadcast_id': broadcast_id, 'status': 'running', 'last_user_id': 0,
+            'sent': 0, 'failed': 0, 'blocked': 0,
+            'started_at': datetime.now().isoformat(timespec='seconds'), 'finished_at': None,
+        }
+        await db_handler.save_broadcast(progress)
+
+    sent_before = progress['sent']
+    start = time.monotonic()
+    _running[broadcast_id] = progress
+    try:
+        completed = await _Broadcast(bot, progress, build_message, on_sent, concurrency, rate,
+                                     shard, lease).run(page_size)
+    finally:
+        _running.pop(broadcast_id, None)
+    elapsed = time.monotonic() - start
+    if not completed:
+        logger.warning("Аренда рассылки %s потеряна, продолжит другой процесс", broadcast_id)
+        return progress
+
+    progress['status'] = 'done'
+    progress['finished_at'] = datetime.now().isoformat(timespec='seconds')
+    await db_handler.save_broadcast(progress)
+
+    sent_now = progress['sent'] - sent_before
+    progress['elapsed'] = elapsed
+    progress['throughput'] = sent_now / elapsed if elapsed else 0.0
+    logger.info(
+        "Рассылка %s завершена за %.1f c: отправлено %s (%.1f сообщ./с), ошибок %s, заблокировали бота %s",
+        broadcast_id, elapsed, progress['sent'], progress['throughput'], progress['failed'], progress['blocked'],
+    )
+    return progress
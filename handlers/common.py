@@ -6,7 +6,9 @@ from .utils import get_text
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
-    db_handler.get_or_create_user(user.id, user.username)
+    await db_handler.get_or_create_user(user.id, user.username)
+    # /start после блокировки бота снова включает пользователя в рассылки
+    await db_handler.set_user_active(user.id, True)
     keyboard = [
         [InlineKeyboardButton("Русский 🇷🇺", callback_data='set_lang_ru')],
         [InlineKeyboardButton("English 🇬🇧", callback_data='set_lang_en')],
@@ -22,7 +24,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     query = update.callback_query
     await query.answer()
     lang_code = query.data.split('_')[-1]
-    db_handler.set_user_language(query.from_user.id, lang_code)
+    await db_handler.set_user_language(query.from_user.id, lang_code)
 
     await query.edit_message_text(text=get_text('lang_chosen_prefix', lang_code))
     await show_main_menu(update.effective_chat.id, lang_code, context)
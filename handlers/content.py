@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import time
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CONTENT_DIR = os.path.join(BASE_DIR, 'content')
+STICKERS_PATH = os.path.join(BASE_DIR, 'assets', 'stickers.json')
+DEFAULT_LANG = 'en'
+
+_CONTENT_FILE_RE = re.compile(r'^(modules|quizzes|debunks)_([a-z]{2,3})\.json$')
+
+
+class ContentError(ValueError):
+    """Ошибка в файлах контента."""
+
+
+def _load_json(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _require(condition: bool, message: str):
+    if not condition:
+        raise ContentError(message)
+
+
+def _require_list(value, where: str):
+    _require(isinstance(value, list), f"{where}: ожидается список")
+
+
+def _require_strings(item: dict, keys, where: str):
+    for key in keys:
+        _require(key in item, f"{where}: нет поля '{key}'")
+        _require(isinstance(item[key], str), f"{where}: '{key}' должен быть строкой")
+
+
+def _validate_module(module, where: str):
+    _require(isinstance(module, dict), f"{where}: модуль должен быть объектом")
+    _require('id' in module, f"{where}: нет поля 'id'")
+    _require(isinstance(module['id'], int), f"{where}: 'id' должен быть числом")
+    _require_strings(module, ('title', 'text'), where)
+
+
+def _validate_question(question, where: str):
+    _require(isinstance(question, dict), f"{where}: вопрос должен быть объектом")
+    for key in ('module_id', 'question', 'options', 'correct'):
+        _require(key in question, f"{where}: нет поля '{key}'")
+    _require(isinstance(question['module_id'], int), f"{where}: 'module_id' должен быть числом")
+    _require(isinstance(question['question'], str), f"{where}: 'question' должен быть строкой")
+    options = question['options']
+    _require(isinstance(options, list) and options, f"{where}: 'options' должен быть непустым списком")
+    _require(all(isinstance(option, str) for option in options), f"{where}: варианты должны быть строками")
+    _require(isinstance(question['correct'], int) and 0 <= question['correct'] < len(options),
+             f"{where}: 'correct' вне диапазона вариантов")
+
+
+def _validate_case(case, where: str):
+    _require(isinstance(case, dict), f"{where}: кейс должен быть объектом")
+    _require_strings(case, ('id', 'initial_message', 'final_message'), where)
+    _require('steps' in case, f"{where}: нет поля 'steps'")
+    _require(isinstance(case['steps'], list) and case['steps'], f"{where}: 'steps' должен быть непустым списком")
+    _require(isinstance(case.get('xp_reward', 0), int), f"{where}: 'xp_reward' должен быть числом")
+    for i, step in enumerate(case['steps']):
+        _require(isinstance(step, dict), f"{where}, шаг {i}: шаг должен быть объектом")
+        _require_strings(step, ('question', 'correct_option', 'feedback_correct', 'hint_incorrect'), f"{where}, шаг {i}")
+        _require('options' in step, f"{where}, шаг {i}: нет поля 'options'")
+        _require(isinstance(step['options'], dict) and step['options']
+                 and all(isinstance(text, str) for text in step['options'].values()),
+                 f"{where}, шаг {i}: 'options' должен быть непустым объектом со строками")
+        _require(step['correct_option'] in step['options'],
+                 f"{where}, шаг {i}: 'correct_option' отсутствует среди вариантов")
+
+
+def _validate_sticker(sticker, where: str):
+    _require(isinstance(sticker, dict), f"{where}: стикер должен быть объектом")
+    _require_strings(sticker, ('id', 'file_path'), where)
+    for key in ('name', 'price'):
+        _require(key in sticker, f"{where}: нет поля '{key}'")
+    _require(isinstance(sticker['name'], dict) and all(isinstance(name, str) for name in sticker['name'].values()),
+             f"{where}: 'name' должен быть объектом со строками")
+    _require(DEFAULT_LANG in sticker['name'], f"{where}: нет названия на '{DEFAULT_LANG}'")
+    _require(isinstance(sticker['price'], int) and sticker['price'] >= 0, f"{where}: некорректная цена")
+
+
+class ContentRepository:
+    """Весь контент бота, загруженный один раз и проиндексированный.
+
+    Индексы: модули по дню недели, вопросы по module_id, кейсы по id, стикеры
+    по id (для каждого языка). Объект после загрузки не меняется, поэтому его
+    можно целиком подменить при перезагрузке контента.
+    """
+
+    def __init__(self, content_dir: str = CONTENT_DIR, stickers_path: str = STICKERS_PATH):
+        self.modules: dict[str, list[dict]] = {}
+        self.questions_by_module: dict[str, dict[int, list[dict]]] = {}
+        self.cases_by_id: dict[str, dict[str, dict]] = {}
+        self.case_ids: dict[str, frozenset[str]] = {}
+        self.stickers: list[dict] = []
+        self.stickers_by_id: dict[str, dict] = {}
+        self.loaded_at = time.time()
+
+        raw: dict[str, dict[str, list]] = {'modules': {}, 'quizzes': {}, 'debunks': {}}
+        for filename in sorted(os.listdir(content_dir)):
+            match = _CONTENT_FILE_RE.match(filename)
+            if match:
+                kind, lang = match.groups()
+                raw[kind][lang] = _load_json(os.path.join(content_dir, filename))
+
+        for lang, modules in raw['modules'].items():
+            _require(isinstance(modules, list) and len(modules) == 7,
+                     f"modules_{lang}.json: нужно ровно 7 модулей, по одному на день недели")
+            for i, module in enumerate(modules):
+                _validate_module(module, f"modules_{lang}.json[{i}]")
+            self.modules[lang] = modules
+
+        for lang, questions in raw['quizzes'].items():
+            _require_list(questions, f"quizzes_{lang}.json")
+            by_module: dict[int, list[dict]] = {}
+            for i, question in enumerate(questions):
+                _validate_question(question, f"quizzes_{lang}.json[{i}]")
+                by_module.setdefault(question['module_id'], []).append(question)
+            self.questions_by_module[lang] = by_module
+
+        for lang, cases in raw['debunks'].items():
+            _require_list(cases, f"debunks_{lang}.json")
+            by_id: dict[str, dict] = {}
+            for i, case in enumerate(cases):
+                _validate_case(case, f"debunks_{lang}.json[{i}]")
+                _require(case['id'] not in by_id, f"debunks_{lang}.json: повторяющийся id '{case['id']}'")
+                by_id[case['id']] = case
+            self.cases_by_id[lang] = by_id
+            self.case_ids[lang] = frozenset(by_id)
+
+        for kind in raw:
+            _require(DEFAULT_LANG in raw[kind], f"нет файла {kind}_{DEFAULT_LANG}.json")
+
+        stickers = _load_json(stickers_path)
+        _require_list(stickers, "stickers.json")
+        for i, sticker in enumerate(stickers):
+            _validate_sticker(sticker, f"stickers.json[{i}]")
+            _require(sticker['id'] not in self.stickers_by_id, f"stickers.json: повторяющийся id '{sticker['id']}'")
+            self.stickers_by_id[sticker['id']] = sticker
+        self.stickers = stickers
+
+    @staticmethod
+    def _for_lang(mapping: dict, lang: str):
+        return mapping.get(lang) or mapping[DEFAULT_LANG]
+
+    @property
+    def languages(self) -> list[str]:
+        return sorted(self.modules)
+
+    def module_for_weekday(self, lang: str, weekday: int) -> dict:
+        """Модуль дня по номеру дня недели (0=Пн, 6=Вс)."""
+        return self._for_lang(self.modules, lang)[weekday]
+
+    def question_refs_for_modules(self, lang: str, module_ids) -> list[list[int]]:
+        """Ссылки [module_id, индекс] на вопросы по указанным модулям.
+
+        В user_data хранятся ссылки, а не копии вопросов.
+        """
+        by_module = self._for_lang(self.questions_by_module, lang)
+        refs = []
+        for module_id in module_ids:
+            refs.extend([module_id, i] for i in range(len(by_module.get(module_id, ()))))
+        return refs
+
+    def question(self, lang: str, ref) -> dict | None:
+        module_id, index = ref
+        questions = self._for_lang(self.questions_by_module, lang).get(module_id, ())
+        return questions[index] if index < len(questions) else None
+
+    def case(self, lang: str, case_id: str):
+        return self._for_lang(self.cases_by_id, lang).get(case_id)
+
+    def unsolved_case_ids(self, lang: str, solved_case_ids) -> list[str]:
+        return sorted(self._for_lang(self.case_ids, lang).difference(solved_case_ids))
+
+    def sticker(self, sticker_id: str):
+        return self.stickers_by_id.get(sticker_id)
+
+
+_repository = None
+
+
+def get_repository() -> ContentRepository:
+    """Возвращает текущий репозиторий контента, загружая его при первом обращении."""
+    global _repository
+    if _repository is None:
+        _repository = ContentRepository()
+    return _repository
+
+
+def set_repository(repository: ContentRepository):
+    """Атомарно подменяет текущий репозиторий (используется при горячей перезагрузке)."""
+    global _repository
+    _repository = repository
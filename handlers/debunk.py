@@ -1,40 +1,68 @@
-import json
 import random
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 
 from database import db_handler
+from .content import get_repository
+from .media_cache import media_cache
 from .utils import get_text
 
-# Загружаем дела для разбора
-with open('content/debunks_ru.json', 'r', encoding='utf-8') as f:
-    debunks_ru = json.load(f)
-with open('content/debunks_en.json', 'r', encoding='utf-8') as f:
-    debunks_en = json.load(f)
-
 # Состояния диалога
 AWAITING_ANSWER, = range(1)
 DEBUNK_XP_REWARD = 25
 
 # --- Helper Functions ---
 
-def get_random_case(lang: str, user_id: int):
+async def get_random_case(lang: str, user_id: int):
     """Выбирает случайный нерешенный кейс для пользователя."""
-    all_cases = debunks_ru if lang == 'ru' else debunks_en
-    solved_case_ids = db_handler.get_solved_debunk_ids(user_id)
+    repository = get_repository()
+    solved_case_ids = set(await db_handler.get_solved_debunk_ids(user_id))
+
+    unsolved_ids = repository.unsolved_case_ids(lang, solved_case_ids)
+
+    return repository.case(lang, random.choice(unsolved_ids)) if unsolved_ids else None
+
+
+def get_current_case(user_data: dict):
+    """Возвращает текущий кейс по сохраненному id (в user_data хранится только id и язык)."""
+    case_id = user_data.get('debunk_case_id')
+    if case_id is None:
+        return None
+    return get_repository().case(user_data.get('debunk_lang', 'en'), case_id)
+
+
+def get_current_step(user_data: dict):
+    """Возвращает текущий шаг кейса или None, если кейс или шаг удалены при перезагрузке контента."""
+    case = get_current_case(user_data)
+    step_index = user_data.get('debunk_step', 0)
+    if case is None or not 0 <= step_index < len(case['steps']):
+        return None
+    return case['steps'][step_index]
 
-    unsolved_cases = [
-        case for case in all_cases if case['id'] not in solved_case_ids
-    ]
 
-    return random.choice(unsolved_cases) if unsolved_cases else None
+def clear_debunk_state(user_data: dict):
+    for key in ('debunk_case_id', 'debunk_lang', 'debunk_step'):
+        user_data.pop(key, None)
 
 
-async def send_step_question(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет вопрос текущего шага с кнопками, включая кнопку 'Отмена'."""
-    case = context.user_data['debunk_case']
-    step_index = context.user_data['debunk_step']
-    step_data = case['steps'][step_index]
+async def end_changed_case(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Кейс изменился во время расследования: сообщает об этом и завершает диалог."""
+    clear_debunk_state(context.user_data)
+    lang = (await db_handler.get_or_create_user(chat_id))['language_code']
+    await context.bot.send_message(chat_id=chat_id, text=get_text('debunk_content_changed', lang))
+    return ConversationHandler.END
+
+
+async def send_step_question(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Отправляет вопрос текущего шага с кнопками, включая кнопку 'Отмена'.
+
+    Если шаг удален при перезагрузке контента, сообщает об этом, очищает
+    данные расследования и возвращает False — вызывающий завершает диалог.
+    """
+    step_data = get_current_step(context.user_data)
+    if step_data is None:
+        await end_changed_case(chat_id, context)
+        return False
 
     keyboard = [
         [InlineKeyboardButton(text, callback_data=f"debunk_{key}")]
@@ -50,25 +78,27 @@ async def send_step_question(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup,
         parse_mode='Markdown'
     )
+    return True
 
 
 async def end_debunk_session(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
     """Завершает сессию, начисляет XP, отмечает кейс как решенный."""
-    case = context.user_data['debunk_case']
+    case = get_current_case(context.user_data)
+    if case is None:
+        return await end_changed_case(chat_id, context)
     user_id = chat_id
-    lang = db_handler.get_or_create_user(user_id)['language_code']
+    lang = (await db_handler.get_or_create_user(user_id))['language_code']
 
     xp_to_award = case.get('xp_reward', DEBUNK_XP_REWARD)
-    db_handler.change_xp(user_id, xp_to_award)
+    await db_handler.change_xp(user_id, xp_to_award, 'debunk')
 
     #  Отмечаем кейс как решенный
-    db_handler.mark_debunk_as_solved(user_id, case['id'])
+    await db_handler.mark_debunk_as_solved(user_id, case['id'])
 
     await context.bot.send_message(chat_id=user_id, text=case['final_message'], parse_mode='Markdown')
     await context.bot.send_message(chat_id=user_id, text=get_text('debunk_xp_award', lang, xp=xp_to_award))
 
-    context.user_data.pop('debunk_case', None)
-    context.user_data.pop('debunk_step', None)
+    clear_debunk_state(context.user_data)
     return ConversationHandler.END
 
 # --- Main Conversation Handlers ---
@@ -76,26 +106,28 @@ async def end_debunk_session(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
 async def start_debunk(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начинает механику разбора фейка."""
     user_id = update.effective_user.id
-    lang = db_handler.get_or_create_user(user_id)['language_code']
+    lang = (await db_handler.get_or_create_user(user_id))['language_code']
 
-    case = get_random_case(lang, user_id)
+    case = await get_random_case(lang, user_id)
     if not case:
         await update.message.reply_text(get_text('debunk_no_cases', lang))
         return ConversationHandler.END
 
-    context.user_data['debunk_case'] = case
+    context.user_data['debunk_case_id'] = case['id']
+    context.user_data['debunk_lang'] = lang
     context.user_data['debunk_step'] = 0
 
     if case.get('initial_photo'):
-        await update.message.reply_photo(
-            photo=case['initial_photo'],
+        await media_cache.send('photo', case['initial_photo'], lambda photo: update.message.reply_photo(
+            photo=photo,
             caption=case['initial_message'],
             parse_mode='Markdown'
-        )
+        ))
     else:
         await update.message.reply_text(case['initial_message'], parse_mode='Markdown')
 
-    await send_step_question(update.effective_chat.id, context)
+    if not await send_step_question(update.effective_chat.id, context):
+        return ConversationHandler.END
     return AWAITING_ANSWER
 
 
@@ -104,14 +136,20 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     query = update.callback_query
     await query.answer()
 
-    case = context.user_data['debunk_case']
-    step_index = context.user_data['debunk_step']
-    step_data = case['steps'][step_index]
+    case = get_current_case(context.user_data)
+    step_data = get_current_step(context.user_data)
     selected_option = query.data.removeprefix('debunk_')
 
     # Сначала удаляем предыдущее сообщение с вопросом, чтобы не было дублей
     await query.delete_message()
 
+    if 'debunk_case_id' not in context.user_data:
+        # Состояние расследования потеряно
+        return ConversationHandler.END
+    if step_data is None or selected_option not in step_data['options']:
+        # Кейс, шаг или варианты ответа изменились при перезагрузке контента
+        return await end_changed_case(query.message.chat_id, context)
+
     if selected_option == step_data['correct_option']:
         # --- ПОЛЬЗОВАТЕЛЬ ОТВЕТИЛ ПРАВИЛЬНО ---
         await context.bot.send_message(
@@ -123,7 +161,8 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
         if context.user_data['debunk_step'] < len(case['steps']):
             # Есть еще шаги, отправляем следующий
-            await send_step_question(query.message.chat_id, context)
+            if not await send_step_question(query.message.chat_id, context):
+                return ConversationHandler.END
             return AWAITING_ANSWER
         else:
             # Шаги закончились, завершаем сессию
@@ -136,7 +175,8 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             parse_mode='Markdown'
         )
         # Отправляем тот же вопрос еще раз
-        await send_step_question(query.message.chat_id, context)
+        if not await send_step_question(query.message.chat_id, context):
+            return ConversationHandler.END
         return AWAITING_ANSWER
 
 
@@ -144,15 +184,14 @@ async def cancel_debunk(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     """Отменяет расследование (реагирует и на команду /cancel, и на кнопку)."""
     query = update.callback_query
     user_id = update.effective_user.id
-    lang = db_handler.get_or_create_user(user_id)['language_code']
+    lang = (await db_handler.get_or_create_user(user_id))['language_code']
 
     if query:
         # Если это нажатие кнопки, удаляем сообщение с вопросом
         await query.delete_message()
 
     # Очищаем данные
-    context.user_data.pop('debunk_case', None)
-    context.user_data.pop('debunk_step', None)
+    clear_debunk_state(context.user_data)
 
     await context.bot.send_message(chat_id=user_id, text=get_text('debunk_cancelled', lang))
     return ConversationHandler.END
\ No newline at end of file
@@ -0,0 +1,122 @@
+import asyncio
+import glob
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import ADMIN_IDS
+from . import menu, render_cache, utils
+from .content import BASE_DIR, CONTENT_DIR, STICKERS_PATH, ContentRepository, get_repository, set_repository
+from .utils import LOCALES_DIR, load_translations, replace_translations
+
+logger = logging.getLogger(__name__)
+
+# Сведения о текущей версии контента для команды /content_version
+content_version = {'version': 1, 'hash': None, 'loaded_at': None, 'load_seconds': None}
+_last_snapshot: dict[str, tuple[int, int]] = {}
+
+
+def _watched_files() -> list[str]:
+    files = glob.glob(os.path.join(CONTENT_DIR, '*.json'))
+    files += glob.glob(os.path.join(LOCALES_DIR, '*.json'))
+    files.append(STICKERS_PATH)
+    return sorted(files)
+
+
+def _snapshot() -> dict[str, tuple[int, int]]:
+    """mtime и размер каждого отслеживаемого файла."""
+    snapshot = {}
+    for path in _watched_files():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def _snapshot_hash(snapshot: dict) -> str:
+    digest = hashlib.sha1()
+    for path, (mtime, size) in sorted(snapshot.items()):
+        digest.update(f"{os.path.relpath(path, BASE_DIR)}:{mtime}:{size};".encode())
+    return digest.hexdigest()[:10]
+
+
+def _load_all():
+    """Загружает и проверяет весь контент и переводы. Выполняется вне event loop."""
+    start = time.perf_counter()
+    repository = ContentRepository()
+    translations = load_translations()
+    return repository, translations, time.perf_counter() - start
+
+
+def _apply(repository, translations, load_seconds, snapshot):
+    # Между подменами нет await, поэтому обработчики видят либо старую, либо новую версию
+    set_repository(repository)
+    replace_translations(translations)
+    menu.rebuild_index(translations)
+    render_cache.warm_up(repository)
+    _last_snapshot.clear()
+    _last_snapshot.update(snapshot)
+    content_version.update(
+        hash=_snapshot_hash(snapshot),
+        loaded_at=datetime.now().isoformat(timespec='seconds'),
+        load_seconds=load_seconds,
+    )
+
+
+def init_content_version():
+    """Запоминает состояние файлов, загруженных при старте."""
+    start = time.perf_counter()
+    repository = get_repository()
+    _apply(repository, load_translations(), time.perf_counter() - start, _snapshot())
+
+
+async def reload_if_changed() -> bool:
+    """Перезагружает контент, если файлы изменились. Возвращает True при успешной подмене."""
+    snapshot = await asyncio.to_thread(_snapshot)
+    if snapshot == _last_snapshot:
+        return False
+    try:
+        repository, translations, load_seconds = await asyncio.to_thread(_load_all)
+    except Exception as e:
+        # Битый файл: продолжаем работать на предыдущей версии и не пытаемся
+        # повторно, пока файлы снова не изменятся. Ошибки проверки контента —
+        # ContentError/ValueError; трассировка нужна только для неожиданных
+        logger.error("Контент не перезагружен, остается версия %s: %s: %s",
+                     content_version['version'], type(e).__name__, e,
+                     exc_info=not isinstance(e, (OSError, ValueError)))
+        _last_snapshot.clear()
+        _last_snapshot.update(snapshot)
+        return False
+    content_version['version'] += 1
+    _apply(repository, translations, load_seconds, snapshot)
+    logger.info("Контент перезагружен: версия %s (%s) за %.3f c",
+                content_version['version'], content_version['hash'], load_seconds)
+    return True
+
+
+async def watch_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача job_queue: проверяет изменения файлов контента."""
+    await reload_if_changed()
+
+
+async def content_version_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Служебная команда: показывает версию и время загрузки контента."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    repository = get_repository()
+    await update.message.reply_text(
+        f"Версия контента: {content_version['version']} ({content_version['hash']})\n"
+        f"Загружена: {content_version['loaded_at']} за {content_version['load_seconds'] * 1000:.1f} мс\n"
+        f"Языки: {', '.join(repository.languages)}\n"
+        f"Вопросов: {sum(len(q) for by_module in repository.questions_by_module.values() for q in by_module.values())}, "
+        f"кейсов: {sum(len(c) for c in repository.cases_by_id.values())}, "
+        f"стикеров: {len(repository.stickers)}\n"
+        f"Запросов переводов: {utils.catalog.lookups}, без перевода: {len(utils.catalog.missing)}"
+    )
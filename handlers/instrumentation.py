@@ -0,0 +1,69 @@
+import functools
+import time
+
+from telegram.ext import Application, BaseHandler, ConversationHandler
+
+from metrics import FAST_BUCKETS, REGISTRY
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    'bot_handler_seconds', "Время работы обработчиков обновлений", ('handler',), FAST_BUCKETS)
+HANDLER_ERRORS = REGISTRY.counter('bot_handler_errors_total', "Исключения в обработчиках", ('handler', 'error'))
+CONVERSATION_TRANSITIONS = REGISTRY.counter(
+    'bot_conversation_transitions_total', "Переходы состояний диалогов", ('conversation', 'handler', 'state'))
+
+
+def handler_name(callback) -> str:
+    """Короткое имя обработчика для меток: модуль.функция (quiz.handle_answer)."""
+    module = getattr(callback, '__module__', '') or ''
+    return f"{module.rsplit('.', 1)[-1]}.{getattr(callback, '__qualname__', repr(callback))}"
+
+
+def _state_label(state) -> str:
+    if state is None:
+        return 'unchanged'  # PTB оставляет диалог в текущем состоянии
+    if state == ConversationHandler.END:
+        return 'end'
+    return str(state)
+
+
+def instrument_handler(callback, conversation: str = None):
+    """Оборачивает callback обработчика: время, число вызовов, ошибки и переходы диалога."""
+    if getattr(callback, '__instrumented__', False):
+        return callback
+    name = handler_name(callback)
+    timing = HANDLER_SECONDS.labels(handler=name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            result = await callback(update, context)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            timing.observe(time.perf_counter() - started)
+        if conversation is not None:
+            CONVERSATION_TRANSITIONS.inc(conversation=conversation, handler=name, state=_state_label(result))
+        return result
+
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def _instrument(handler: BaseHandler, conversation: str = None):
+    if isinstance(handler, ConversationHandler):
+        nested = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            nested += state_handlers
+        for child in nested:
+            _instrument(child, handler.name or 'conversation')
+    else:
+        handler.callback = instrument_handler(handler.callback, conversation)
+
+
+def instrument_application(application: Application):
+    """Оборачивает все зарегистрированные обработчики, включая вложенные в ConversationHandler."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument(handler)
@@ -0,0 +1,194 @@
+import bisect
+import json
+import logging
+import time
+from array import array
+from datetime import date
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import sharding
+from database import db_handler
+from database.write_buffer import week_start
+from .utils import get_text
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_SIZE = 10
+# Как часто пересчитывать снимок рангов (секунды)
+RANK_REFRESH_INTERVAL = 300
+# Сколько строк читать за одно обращение к потоку БД при построении снимка
+RANK_PAGE_SIZE = 10000
+# Аренда построения снимка в режиме нескольких процессов: держатель продлевает ее при каждом пересчете
+RANK_LEASE_TTL = 3 * RANK_REFRESH_INTERVAL
+
+
+class RankSnapshot:
+    """Снимок рейтинга: отсортированные значения XP, топ и недельные суммы.
+
+    Место пользователя ищется бинарным поиском по снимку (O(log n)), поэтому
+    команда не считает строки таблицы users. Свой XP берется актуальный, а
+    чужие — на момент снимка.
+    """
+
+    def __init__(self, xp_values, top, week: date, weekly_xp: dict[int, int], weekly_top,
+                 built_at: float = None):
+        self.xp_values = array('q', xp_values)  # по возрастанию
+        self.top = top
+        self.week = week
+        self.weekly_xp = weekly_xp
+        self.weekly_values = array('q', sorted(weekly_xp.values()))
+        self.weekly_top = weekly_top
+        self.built_at = time.time() if built_at is None else built_at
+
+    def dump(self) -> tuple:
+        """Поля для db_handler.save_rank_snapshot."""
+        return (self.week.isoformat(), self.built_at, self.xp_values.tobytes(),
+                array('q', self.weekly_xp.keys()).tobytes(), array('q', self.weekly_xp.values()).tobytes(),
+                json.dumps(self.top, ensure_ascii=False), json.dumps(self.weekly_top, ensure_ascii=False))
+
+    @classmethod
+    def load(cls, row: tuple) -> 'RankSnapshot':
+        """Снимок из строки db_handler.load_rank_snapshot."""
+        week, built_at, xp_values, weekly_users, weekly_values, top, weekly_top = row
+        values, users, weekly = array('q'), array('q'), array('q')
+        values.frombytes(xp_values)
+        users.frombytes(weekly_users)
+        weekly.frombytes(weekly_values)
+        return cls(values, [tuple(item) for item in json.loads(top)], date.fromisoformat(week),
+                   dict(zip(users, weekly)), [tuple(item) for item in json.loads(weekly_top)], built_at)
+
+    @staticmethod
+    def _rank(values: array, xp: int) -> int:
+        # Место = число значений строго больше + 1
+        return len(values) - bisect.bisect_right(values, xp) + 1
+
+    def rank(self, xp: int) -> int:
+        return self._rank(self.xp_values, xp)
+
+    def weekly_rank(self, xp: int) -> int:
+        return self._rank(self.weekly_values, xp)
+
+    @property
+    def total(self) -> int:
+        return len(self.xp_values)
+
+
+_snapshot: RankSnapshot | None = None
+
+
+async def _load_xp_values() -> array:
+    """XP всех пользователей по возрастанию.
+
+    Читается порциями по RANK_PAGE_SIZE (keyset по индексу), чтобы между
+    порциями поток БД успевал выполнять запросы обработчиков.
+    """
+    values = array('q')
+    after = None
+    while True:
+        page = await db_handler.get_xp_page(after, RANK_PAGE_SIZE)
+        values.extend(xp for xp, _ in page)
+        if len(page) < RANK_PAGE_SIZE:
+            break
+        after = page[-1]
+    values.reverse()
+    return values
+
+
+async def _load_weekly_xp(week: date) -> dict[int, int]:
+    weekly_xp = {}
+    after = 0
+    while True:
+        page = await db_handler.get_weekly_xp_page(week, after, RANK_PAGE_SIZE)
+        weekly_xp.update(page)
+        if len(page) < RANK_PAGE_SIZE:
+            break
+        after = page[-1][0]
+    return weekly_xp
+
+
+async def _build(week: date) -> RankSnapshot:
+    started = time.perf_counter()
+    await db_handler.flush()
+    snapshot = RankSnapshot(
+        await _load_xp_values(),
+        await db_handler.get_top_users(LEADERBOARD_SIZE),
+        week,
+        await _load_weekly_xp(week),
+        await db_handler.get_weekly_top(week, LEADERBOARD_SIZE),
+    )
+    logger.info("Снимок рейтинга обновлен: %d пользователей за %.3f c",
+                snapshot.total, time.perf_counter() - started)
+    return snapshot
+
+
+async def refresh() -> RankSnapshot:
+    """Пересчитывает снимок рейтинга (буфер XP предварительно сбрасывается).
+
+    В режиме нескольких процессов снимок строит только держатель аренды и
+    публикует его в БД, остальные воркеры загружают готовый. Если
+    опубликованного снимка текущей недели еще нет, воркер строит свой.
+    """
+    global _snapshot
+    week = week_start(date.today())
+    if sharding.current_shard() is None:
+        _snapshot = await _build(week)
+        return _snapshot
+    if not await db_handler.acquire_lease('rank_snapshot', sharding.owner_id(), RANK_LEASE_TTL):
+        current = _snapshot is not None and _snapshot.week == week
+        row = await db_handler.load_rank_snapshot(_snapshot.built_at if current else 0.0)
+        if row is not None and date.fromisoformat(row[0]) == week:
+            _snapshot = RankSnapshot.load(row)
+            return _snapshot
+        if current:
+            return _snapshot
+        _snapshot = await _build(week)
+        return _snapshot
+    _snapshot = await _build(week)
+    await db_handler.save_rank_snapshot(*_snapshot.dump())
+    return _snapshot
+
+
+async def get_snapshot() -> RankSnapshot:
+    if _snapshot is None or _snapshot.week != week_start(date.today()):
+        return await refresh()
+    return _snapshot
+
+
+async def refresh_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача job_queue: обновляет снимок рейтинга."""
+    await refresh()
+
+
+def _display_name(user_id: int, username: str | None, lang: str) -> str:
+    if username:
+        return f"@{username}"
+    return get_text('leaderboard_player', lang, suffix=str(user_id)[-4:])
+
+
+def _format_top(rows, lang: str) -> list[str]:
+    if not rows:
+        return [get_text('leaderboard_empty', lang)]
+    return [get_text('leaderboard_line', lang, place=place, name=_display_name(user_id, username, lang), xp=xp)
+            for place, (user_id, username, xp) in enumerate(rows, start=1)]
+
+
+async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает топ по XP за все время и за неделю, а также место пользователя."""
+    user_id = update.effective_user.id
+    user = await db_handler.get_or_create_user(user_id)
+    lang = user['language_code']
+    snapshot = await get_snapshot()
+
+    lines = [get_text('leaderboard_title', lang)]
+    lines += _format_top(snapshot.top, lang)
+    lines.append(get_text('leaderboard_my_rank', lang, rank=snapshot.rank(user['xp']),
+                          total=max(snapshot.total, 1), xp=user['xp']))
+    lines.append('')
+    lines.append(get_text('leaderboard_weekly_title', lang))
+    lines += _format_top(snapshot.weekly_top, lang)
+    weekly_xp = snapshot.weekly_xp.get(user_id, 0)
+    if weekly_xp > 0:
+        lines.append(get_text('leaderboard_my_weekly', lang, rank=snapshot.weekly_rank(weekly_xp), xp=weekly_xp))
+    await update.message.reply_text('\n'.join(lines))
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import logging
+import os
+
+from telegram.error import BadRequest
+
+from database import db_handler
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Фрагменты текста BadRequest, означающие, что сохраненный file_id больше не годится.
+# Остальные ошибки (чат не найден, бот заблокирован...) к file_id отношения не имеют
+FILE_ID_ERRORS = (
+    'wrong file identifier',
+    'wrong remote file identifier',
+    'wrong file_id',
+    'file reference expired',
+    'file_reference_expired',
+    "can't use file of type",
+)
+
+
+def is_file_id_error(error: BadRequest) -> bool:
+    message = str(error).lower()
+    return any(fragment in message for fragment in FILE_ID_ERRORS)
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _message_file_id(message, kind: str):
+    if kind == 'sticker' and message.sticker:
+        return message.sticker.file_id
+    if kind == 'photo' and message.photo:
+        # Берем самый большой вариант фото
+        return message.photo[-1].file_id
+    return None
+
+
+class MediaCache:
+    """Кэш file_id Telegram для стикеров и фото.
+
+    Каждый файл загружается в Telegram один раз, полученный file_id хранится в
+    SQLite по ключу (путь, хэш содержимого) и дальше отправляется вместо файла.
+    Изменение файла меняет хэш, поэтому новая версия загрузится заново. Для
+    ссылок (http/https) ключом служит сам адрес. Если Telegram отверг именно
+    file_id (см. FILE_ID_ERRORS), запись удаляется и файл загружается снова;
+    остальные ошибки пробрасываются без изменения кэша.
+    """
+
+    def __init__(self, persistent: bool = True):
+        self.persistent = persistent
+        self._file_ids: dict[tuple[str, str], str] = {}
+        self._hashes: dict[str, tuple[float, int, str]] = {}  # путь -> (mtime, размер, хэш)
+        self._loaded = not persistent
+        self.hits = 0
+        self.uploads = 0
+        self.invalidated = 0
+
+    async def ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        for source, content_hash, file_id in await db_handler.load_media_file_ids():
+            self._file_ids[(source, content_hash)] = file_id
+
+    async def _content_hash(self, source: str) -> str:
+        """Хэш содержимого локального файла; пересчитывается только при изменении mtime или размера."""
+        if source.startswith(('http://', 'https://')):
+            return ''
+        stat = os.stat(source)  # FileNotFoundError для отсутствующего файла
+        cached = self._hashes.get(source)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        content_hash = await asyncio.to_thread(_file_hash, source)
+        self._hashes[source] = (stat.st_mtime, stat.st_size, content_hash)
+        return content_hash
+
+    async def send(self, kind: str, source: str, send):
+        """Отправляет стикер или фото ('sticker' / 'photo') из файла или по ссылке.
+
+        send(media) — корутина отправки, получающая file_id, открытый файл или ссылку.
+        """
+        await self.ensure_loaded()
+        content_hash = await self._content_hash(source)
+        key = (source, content_hash)
+
+        file_id = self._file_ids.get(key)
+        if file_id is not None:
+            try:
+                message = await send(file_id)
+                self.hits += 1
+                return message
+            except BadRequest as e:
+                if not is_file_id_error(e):
+                    raise
+                logger.warning("Telegram отклонил file_id для %s (%s), загружаем заново", source, e)
+                self.invalidated += 1
+                self._file_ids.pop(key, None)
+                if self.persistent:
+                    await db_handler.delete_media_file_id(source, content_hash)
+
+        if content_hash:
+            with open(source, 'rb') as f:
+                message = await send(f)
+        else:
+            message = await send(source)
+        self.uploads += 1
+
+        file_id = _message_file_id(message, kind)
+        if file_id:
+            self._file_ids[key] = file_id
+            if self.persistent:
+                await db_handler.save_media_file_id(source, content_hash, kind, file_id)
+        return message
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._file_ids),
+            'hits': self.hits,
+            'uploads': self.uploads,
+            'invalidated': self.invalidated,
+        }
+
+
+media_cache = MediaCache()
+REGISTRY.stats_gauge('bot_media_cache', "Кэш file_id медиафайлов Telegram", media_cache.stats)
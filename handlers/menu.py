@@ -0,0 +1,54 @@
+from telegram.ext import filters
+
+from .utils import translations
+
+# Ключи переводов кнопок главного меню
+MENU_ACTIONS = ('main_menu_module', 'main_menu_quiz', 'main_menu_store', 'main_menu_ask', 'main_menu_debunk')
+
+# Текст кнопки на любом языке -> ключ действия
+_menu_index: dict[str, str] = {}
+
+
+def build_menu_index(all_translations: dict) -> dict[str, str]:
+    """Обратный индекс текста кнопок меню по всем загруженным языкам."""
+    index = {}
+    for lang_translations in all_translations.values():
+        for action in MENU_ACTIONS:
+            text = lang_translations.get(action)
+            if text:
+                index[text] = action
+    return index
+
+
+def rebuild_index(all_translations: dict = None):
+    """Пересобирает индекс (при старте и после горячей перезагрузки переводов)."""
+    index = build_menu_index(translations if all_translations is None else all_translations)
+    _menu_index.clear()
+    _menu_index.update(index)
+
+
+def menu_action(text: str | None) -> str | None:
+    """Действие, которому соответствует текст кнопки, или None."""
+    return _menu_index.get(text) if text else None
+
+
+class MenuButton(filters.MessageFilter):
+    """Фильтр нажатия кнопки главного меню: один поиск в словаре вместо цепочки regex.
+
+    Без action срабатывает на любую кнопку меню.
+    """
+
+    __slots__ = ('action',)
+
+    def __init__(self, action: str = None):
+        super().__init__(name=f"MenuButton({action or '*'})")
+        self.action = action
+
+    def filter(self, message) -> bool:
+        action = menu_action(message.text)
+        if self.action is None:
+            return action is not None
+        return action == self.action
+
+
+rebuild_index()
@@ -1,48 +1,61 @@
-import json
-from datetime import datetime
+from datetime import datetime, time, timezone
 from telegram import Update
 from telegram.ext import ContextTypes, JobQueue
+import sharding
 from database import db_handler
-from .utils import get_text
+from . import render_cache
+from .content import get_repository
+from .broadcast import run_broadcast, shard_broadcast_id
 
-# Загружаем модули
-with open('content/modules_ru.json', 'r', encoding='utf-8') as f:
-    modules_ru = json.load(f)
-with open('content/modules_en.json', 'r', encoding='utf-8') as f:
-    modules_en = json.load(f)
+# Время ежедневной рассылки (UTC). 9:00 МСК = 6:00 UTC.
+BROADCAST_TIME = time(hour=7, minute=0, tzinfo=timezone.utc)
+# Как часто проверять, не осталась ли сегодняшняя рассылка недосланной (после перезапуска)
+BROADCAST_RESUME_INTERVAL = 15 * 60
 
 
 def get_today_module(lang: str):
-    """Выбирает модуль дня по номеру дня недели (0=Пн, 6=Вс)"""
-    day_of_week = datetime.now().weekday()
-    modules = modules_ru if lang == 'ru' else modules_en
-    return modules[day_of_week]
+    """Выбирает модуль дня по номеру дня недели (0=Пн, 6=Вс) по UTC, как и рассылка"""
+    day_of_week = datetime.now(timezone.utc).weekday()
+    return get_repository().module_for_weekday(lang, day_of_week)
+
+
+def today_broadcast_id() -> str:
+    return f"module-{datetime.now(timezone.utc).date().isoformat()}"
 
 
 async def send_module_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = db_handler.get_or_create_user(user_id)
+    user = await db_handler.get_or_create_user(user_id)
     lang = user['language_code']
 
     module = get_today_module(lang)
-    intro_text = get_text('module_intro', lang)
 
-    await update.message.reply_html(f"{intro_text}<b>{module['title']}</b>\n\n{module['text']}")
-    db_handler.mark_module_as_seen(user_id, module['id'])
+    await update.message.reply_html(render_cache.module_message(module, lang))
+    await db_handler.mark_module_as_seen(user_id, module['id'])
 
 
 async def broadcast_module(context: ContextTypes.DEFAULT_TYPE):
     """Рассылает ежедневный модуль всем пользователям"""
-    users = db_handler.get_all_users()
-    for user_id, lang in users:
-        try:
-            module = get_today_module(lang)
-            intro_text = get_text('module_intro', lang)
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"{intro_text}<b>{module['title']}</b>\n\n{module['text']}",
-                parse_mode='HTML'
-            )
-            db_handler.mark_module_as_seen(user_id, module['id'])
-        except Exception as e:
-            print(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
\ No newline at end of file
+    def build_message(lang: str) -> dict:
+        return {'text': render_cache.module_message(get_today_module(lang), lang), 'parse_mode': 'HTML'}
+
+    async def on_sent(user_id: int, lang: str):
+        await db_handler.mark_module_as_seen(user_id, get_today_module(lang)['id'])
+
+    # В режиме нескольких воркеров каждый рассылает только пользователям своего шарда
+    await run_broadcast(context.bot, today_broadcast_id(), build_message, on_sent,
+                        shard=sharding.current_shard())
+
+
+async def resume_broadcast_job(context: ContextTypes.DEFAULT_TYPE):
+    """Досылает сегодняшний модуль, если рассылка прервалась (например, перезапуском).
+
+    Продолжается только рассылка, которая уже началась и не завершилась (строка
+    со статусом running): новую рассылку запускает лишь задача run_daily.
+    run_broadcast продолжает ее с места остановки.
+    """
+    broadcast_id = shard_broadcast_id(today_broadcast_id(), sharding.current_shard())
+    progress = await db_handler.get_broadcast(broadcast_id)
+    if progress is None or progress['status'] != 'running':
+        return
+    await broadcast_module(context)
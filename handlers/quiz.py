@@ -1,16 +1,10 @@
-import json
 import random
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from database import db_handler
+from .content import get_repository
 from .utils import get_text
 
-# Загружаем квизы
-with open('content/quizzes_ru.json', 'r', encoding='utf-8') as f:
-    quizzes_ru = json.load(f)
-with open('content/quizzes_en.json', 'r', encoding='utf-8') as f:
-    quizzes_en = json.load(f)
-
 # Состояния для диалога
 ANSWERING, = range(1)
 XP_PER_CORRECT_ANSWER = 10
@@ -19,20 +13,18 @@ XP_PER_CORRECT_ANSWER = 10
 async def quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начинает квиз."""
     user_id = update.effective_user.id
-    user = db_handler.get_or_create_user(user_id)
+    user = await db_handler.get_or_create_user(user_id)
     lang = user['language_code']
 
     # Получаем ID модулей, которые пользователь видел за последнюю неделю
-    seen_module_ids = db_handler.get_seen_modules_for_quiz(user_id)
+    seen_module_ids = await db_handler.get_seen_modules_for_quiz(user_id)
 
     if not seen_module_ids:
         await update.message.reply_text(get_text('quiz_no_modules', lang))
         return ConversationHandler.END
 
-    all_questions = quizzes_ru if lang == 'ru' else quizzes_en
-
-    # Отбираем вопросы по виденным модулям
-    user_questions = [q for q in all_questions if q['module_id'] in seen_module_ids]
+    # Отбираем вопросы по виденным модулям через индекс по module_id
+    user_questions = get_repository().question_refs_for_modules(lang, seen_module_ids)
 
     if not user_questions:
         await update.message.reply_text(get_text('quiz_no_modules', lang))
@@ -40,27 +32,44 @@ async def quiz_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
     random.shuffle(user_questions)
 
-    # Сохраняем данные квиза для пользователя
+    # Сохраняем данные квиза для пользователя: только ссылки на вопросы, а не их копии
     context.user_data['quiz_questions'] = user_questions
+    context.user_data['quiz_lang'] = lang
     context.user_data['current_q_index'] = 0
     context.user_data['score'] = 0
 
     await update.message.reply_text(get_text('quiz_intro', lang))
-    await send_question(update.effective_chat.id, context)
+    if not await send_question(update.effective_chat.id, context):
+        return ConversationHandler.END
 
     return ANSWERING
 
 
-async def send_question(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет текущий вопрос."""
+def get_current_question(user_data: dict) -> dict | None:
+    """Возвращает текущий вопрос квиза по сохраненной ссылке."""
+    ref = user_data['quiz_questions'][user_data['current_q_index']]
+    return get_repository().question(user_data.get('quiz_lang', 'en'), ref)
+
+
+async def send_question(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Отправляет текущий вопрос.
+
+    Если вопрос удален при перезагрузке контента, сообщает об этом, очищает
+    данные квиза и возвращает False — вызывающий завершает диалог.
+    """
     user_data = context.user_data
     q_index = user_data['current_q_index']
     questions = user_data['quiz_questions']
-    question_data = questions[q_index]
+    question_data = get_current_question(user_data)
 
-    user = db_handler.get_or_create_user(chat_id)
+    user = await db_handler.get_or_create_user(chat_id)
     lang = user['language_code']
 
+    if question_data is None:
+        user_data.clear()
+        await context.bot.send_message(chat_id=chat_id, text=get_text('quiz_content_changed', lang))
+        return False
+
     title = get_text('quiz_question_title', lang, current=q_index + 1, total=len(questions))
 
     keyboard = []
@@ -73,6 +82,7 @@ async def send_question(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
     )
+    return True
 
 
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -81,12 +91,15 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     await query.answer()
 
     user_data = context.user_data
-    q_index = user_data['current_q_index']
+    question_data = get_current_question(user_data) if 'quiz_questions' in user_data else None
+    if question_data is None:
+        # Состояние квиза потеряно или вопрос удален при перезагрузке контента
+        user_data.clear()
+        return ConversationHandler.END
     questions = user_data['quiz_questions']
-    question_data = questions[q_index]
 
     user_id = query.from_user.id
-    user = db_handler.get_or_create_user(user_id)
+    user = await db_handler.get_or_create_user(user_id)
     lang = user['language_code']
 
     selected_option_index = int(query.data.split('_')[1])
@@ -109,7 +122,8 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     user_data['current_q_index'] += 1
 
     if user_data['current_q_index'] < len(questions):
-        await send_question(query.message.chat_id, context)
+        if not await send_question(query.message.chat_id, context):
+            return ConversationHandler.END
         return ANSWERING
     else:
         # Квиз окончен
@@ -117,7 +131,7 @@ async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         total = len(questions)
         xp_earned = score * XP_PER_CORRECT_ANSWER
 
-        db_handler.change_xp(user_id, xp_earned)
+        await db_handler.change_xp(user_id, xp_earned, 'quiz')
 
         results_title = get_text('quiz_results_title', lang)
         results_score = get_text('quiz_results_score', lang, score=score, total=total)
@@ -0,0 +1,53 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .utils import get_text, translations
+
+# Готовые сообщения модулей по (язык, id модуля) и клавиатуры магазина по языку.
+# Заполняются при старте (warm_up) и при перезагрузке контента, на горячем пути
+# остается только поиск в словаре.
+_module_messages: dict[tuple[str, int], str] = {}
+_store_keyboards: dict[str, InlineKeyboardMarkup] = {}
+
+
+def render_module_message(module: dict, lang: str) -> str:
+    intro_text = get_text('module_intro', lang)
+    return f"{intro_text}<b>{module['title']}</b>\n\n{module['text']}"
+
+
+def render_store_keyboard(stickers: list, lang: str) -> InlineKeyboardMarkup:
+    keyboard = []
+    for sticker in stickers:
+        # Получаем имя стикера на нужном языке
+        sticker_name_in_lang = sticker['name'].get(lang, sticker['name']['en'])
+        button_text = get_text('store_item', lang, name=sticker_name_in_lang, price=sticker['price'])
+        keyboard.append([
+            InlineKeyboardButton(button_text, callback_data=f"buy_sticker_{sticker['id']}")
+        ])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def module_message(module: dict, lang: str) -> str:
+    """Возвращает готовый HTML модуля дня, рендеря его при первом обращении."""
+    key = (lang, module['id'])
+    text = _module_messages.get(key)
+    if text is None:
+        text = _module_messages[key] = render_module_message(module, lang)
+    return text
+
+
+def store_keyboard(stickers: list, lang: str) -> InlineKeyboardMarkup:
+    """Возвращает готовую клавиатуру магазина для языка."""
+    markup = _store_keyboards.get(lang)
+    if markup is None:
+        markup = _store_keyboards[lang] = render_store_keyboard(stickers, lang)
+    return markup
+
+
+def warm_up(repository):
+    """Сбрасывает кэш и заранее рендерит все модули и клавиатуры для всех языков."""
+    _module_messages.clear()
+    _store_keyboards.clear()
+    for lang in translations:
+        for weekday in range(7):
+            module_message(repository.module_for_weekday(lang, weekday), lang)
+        store_keyboard(repository.stickers, lang)
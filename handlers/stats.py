@@ -0,0 +1,41 @@
+import logging
+from datetime import date, timedelta
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import ADMIN_IDS
+from database import db_handler
+
+logger = logging.getLogger(__name__)
+
+# Как часто сворачивать журнал XP в дневные сводки (секунды)
+ROLLUP_INTERVAL = 60
+STATS_DAYS = 7
+
+
+async def rollup_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача job_queue: сбрасывает буфер и сворачивает новые события XP."""
+    await db_handler.flush()
+    processed = await db_handler.rollup_xp_events()
+    if processed:
+        logger.info("Свернуто событий XP: %d", processed)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Служебная команда: XP и активность по дням и источникам. Читает только сводки."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    rows = await db_handler.get_daily_stats(date.today() - timedelta(days=STATS_DAYS - 1))
+    if not rows:
+        await update.message.reply_text("Статистики пока нет.")
+        return
+
+    lines = [f"XP за {STATS_DAYS} дн. (источник: событий / XP / пользователей)"]
+    current_day = None
+    for day, source, events, xp, users in rows:
+        if day != current_day:
+            current_day = day
+            lines.append(f"\n{day}")
+        lines.append(f"  {source or 'other'}: {events} / {xp:+d} / {users}")
+    await update.message.reply_text('\n'.join(lines))
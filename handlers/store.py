@@ -1,82 +1,82 @@
-import json
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import logging
+
+from telegram import Update
 from telegram.ext import ContextTypes
 from database import db_handler
+from . import render_cache
+from .content import get_repository
+from .media_cache import media_cache
 from .utils import get_text
 
-# Загружаем стикеры
-with open('assets/stickers.json', 'r', encoding='utf-8') as f:
-    stickers_data = json.load(f)
+logger = logging.getLogger(__name__)
 
 
 async def store_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user = db_handler.get_or_create_user(user_id)
+    user = await db_handler.get_or_create_user(user_id)
     lang = user['language_code']
     xp = user['xp']
 
+    # Меняется только строка с балансом, клавиатура берется из кэша
     intro_text = get_text('store_intro', lang, xp=xp)
+    reply_markup = render_cache.store_keyboard(get_repository().stickers, lang)
+    await update.message.reply_text(intro_text, reply_markup=reply_markup)
 
-    keyboard = []
-    for sticker in stickers_data:
-        # Получаем имя стикера на нужном языке
-        sticker_name_in_lang = sticker['name'].get(lang, sticker['name']['en'])
-        button_text = get_text('store_item', lang, name=sticker_name_in_lang, price=sticker['price'])
-        keyboard.append([
-            InlineKeyboardButton(button_text, callback_data=f"buy_sticker_{sticker['id']}")
-        ])
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(intro_text, reply_markup=reply_markup)
+def purchase_key(query) -> str:
+    """Ключ идемпотентности покупки: одно сообщение магазина — одна покупка каждого стикера.
+
+    Повторные нажатия на ту же кнопку (в том числе обработанные параллельно)
+    дают тот же ключ, поэтому XP спишется только один раз. После возврата
+    (refund_purchase) ключ освобождается и стикер можно купить снова.
+    """
+    message = query.message
+    if message is None:
+        return f"query:{query.id}"
+    return f"{message.chat.id}:{message.message_id}:{query.data}"
 
 
 async def handle_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
 
-
-    # --- НАЧАЛО ОТЛАДКИ ---
-    print("\n--- Попытка покупки стикера ---")
-    print(f"Получены данные с кнопки: {query.data}")
-
     user_id = query.from_user.id
-    user = db_handler.get_or_create_user(user_id)
+    user = await db_handler.get_or_create_user(user_id)
     lang = user['language_code']
 
     sticker_id = query.data.removeprefix('buy_sticker_')
-    print(f"Извлечен ID стикера: '{sticker_id}'")
-
-    # Находим стикер в наших данных
-    sticker_to_buy = next((s for s in stickers_data if s['id'] == sticker_id), None)
-
-    # Очень важная проверка
-    print(f"Результат поиска стикера в данных: {sticker_to_buy}")
-
+    sticker_to_buy = get_repository().sticker(sticker_id)
     if not sticker_to_buy:
-        # Если стикер не найден, мы увидим это сообщение в консоли
-        print("!!! ОШИБКА: Стикер с таким ID не найден в stickers.json. Функция завершается.")
+        logger.warning("Стикер с ID '%s' не найден в stickers.json", sticker_id)
+        await query.answer()
         return
 
-    print("Стикер найден. Проверяем баланс XP.")
-    # --- КОНЕЦ ОТЛАДКИ ---
-
-    user_xp = user['xp']
     price = sticker_to_buy['price']
+    key = purchase_key(query)
+    result = await db_handler.purchase(user_id, sticker_id, price, key)
+
+    if result['status'] == 'duplicate':
+        # Повторное нажатие: покупка уже оформлена, XP повторно не списываются
+        await query.answer(text=get_text('store_buy_duplicate', lang, xp=result['xp']))
+        return
 
-    if user_xp >= price:
-        db_handler.change_xp(user_id, -price)
-        new_xp = user_xp - price
-        sticker_path = sticker_to_buy['file_path']
-        try:
-            with open(sticker_path, 'rb') as sticker_file:
-                await context.bot.send_sticker(chat_id=user_id, sticker=sticker_file)
-            success_text = get_text('store_buy_success', lang, new_xp=new_xp)
-            await query.edit_message_text(success_text)
-        except FileNotFoundError:
-            print(f"!!! ФАТАЛЬНАЯ ОШИБКА: Файл стикера не найден по пути: {sticker_path}")
-            await context.bot.send_message(chat_id=user_id,
-                                           text="Ой, кажется, этот стикер временно недоступен. Попробуйте позже.")
-            db_handler.change_xp(user_id, price)
-    else:
-        needed_xp = price - user_xp
+    if result['status'] == 'insufficient':
+        needed_xp = price - result['xp']
         fail_text = get_text('store_buy_fail', lang, needed=needed_xp)
-        await context.bot.answer_callback_query(callback_query_id=query.id, text=fail_text, show_alert=True)
\ No newline at end of file
+        await context.bot.answer_callback_query(callback_query_id=query.id, text=fail_text, show_alert=True)
+        return
+
+    # Покупка оформлена: убираем индикатор загрузки на кнопке до отправки стикера
+    await query.answer()
+    sticker_path = sticker_to_buy['file_path']
+    try:
+        # Файл загружается в Telegram один раз, дальше отправляется по file_id
+        await media_cache.send('sticker', sticker_path,
+                               lambda sticker: context.bot.send_sticker(chat_id=user_id, sticker=sticker))
+    except FileNotFoundError:
+        logger.error("Файл стикера не найден по пути: %s", sticker_path)
+        await db_handler.refund_purchase(key)
+        await context.bot.send_message(chat_id=user_id,
+                                       text="Ой, кажется, этот стикер временно недоступен. Попробуйте позже.")
+        return
+    success_text = get_text('store_buy_success', lang, new_xp=result['xp'])
+    await query.edit_message_text(success_text)
@@ -0,0 +1,221 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import time
+
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений обрабатывается одновременно (разных пользователей)
+UPDATE_CONCURRENCY = 16
+# Сколько обновлений может одновременно ждать в очередях, прежде чем прием притормозит
+UPDATE_MAX_PENDING = 1000
+# Сколько обновлений одного пользователя может ждать (вместе с обрабатываемым);
+# лишние отбрасываются, чтобы один пользователь не занял общий лимит max_pending
+UPDATE_MAX_PENDING_PER_KEY = 5
+
+
+class _Slot:
+    """Слот обработки, занятый текущим обновлением."""
+    __slots__ = ('processor', 'held')
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.held = False
+
+
+# Слот обновления, которое обрабатывается в текущей задаче
+_current_slot: contextvars.ContextVar[_Slot | None] = contextvars.ContextVar('update_slot', default=None)
+
+
+@contextlib.asynccontextmanager
+async def slot_released():
+    """Отпускает слот обработки обновления на время долгого ожидания (например, ответа модели ИИ).
+
+    Пока обработчик ждет, слот достается обновлениям других пользователей.
+    Порядок обновлений самого пользователя сохраняется: следующее его обновление
+    по-прежнему ждет завершения текущего. Вне PerUserUpdateProcessor ничего не делает.
+    """
+    slot = _current_slot.get()
+    if slot is None or not slot.held:
+        yield
+        return
+    processor = slot.processor
+    processor._release_slot(slot)
+    processor._suspended += 1
+    try:
+        yield
+    finally:
+        processor._suspended -= 1
+        await processor._acquire_slot(slot)
+
+
+def update_key(update):
+    """Ключ, по которому обновления упорядочиваются: пользователь, иначе чат.
+
+    Для обновлений без пользователя и чата (например, ошибок) возвращает None —
+    их порядок не важен.
+    """
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return 'user', user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return 'chat', chat.id
+    return None
+
+
+def raw_update_key(data: dict):
+    """update_key для обновления в виде JSON от Bot API, без разбора в объекты PTB.
+
+    Нужен диспетчеру шардов, который только пересылает обновления дальше.
+    """
+    for field, payload in data.items():
+        if field == 'update_id' or not isinstance(payload, dict):
+            continue
+        user = payload.get('from') or payload.get('user')
+        if user is not None:
+            return 'user', user['id']
+        chat = payload.get('chat')
+        if chat is not None:
+            return 'chat', chat['id']
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных пользователей параллельно, а одного — строго по очереди.
+
+    Обновления одного пользователя выполняются в порядке поступления, поэтому
+    состояние квиза и разбора в user_data не портится. Одновременно работает не
+    больше concurrency обработчиков; пользователь, ждущий своей очереди, слот не
+    занимает, как и обработчик внутри slot_released(). Семафор PTB (max_pending)
+    ограничивает общее число принятых обновлений, а max_pending_per_key — долю
+    одного пользователя в нем: сверх нее обновления отбрасываются, и один раз за
+    такую серию вызывается on_overflow(update) (например, ответ «подожди»).
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING,
+                 max_pending_per_key: int = UPDATE_MAX_PENDING_PER_KEY, on_overflow=None):
+        if concurrency < 1:
+            raise ValueError("concurrency должно быть положительным")
+        if max_pending_per_key < 1:
+            raise ValueError("max_pending_per_key должно быть положительным")
+        super().__init__(max(max_pending, concurrency, 2))
+        self.concurrency = concurrency
+        self.max_pending_per_key = max_pending_per_key
+        self.on_overflow = on_overflow
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tails: dict[tuple, asyncio.Future] = {}  # ключ -> завершение последнего обновления
+        self._pending_per_key: dict[tuple, int] = {}
+        self._overflowed: set[tuple] = set()  # ключи, которым уже ответили на переполнение
+        self.dropped = 0
+        self._waiting = 0
+        self._running = 0
+        self._suspended = 0  # обработчики, отпустившие слот (slot_released)
+        self.wait_time = Histogram()
+        self.processing_time = Histogram()
+        self.processed = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        enqueued_at = time.monotonic()
+        key = update_key(update)
+        if key is not None:
+            pending = self._pending_per_key.get(key, 0)
+            if pending >= self.max_pending_per_key:
+                await self._drop(key, update, coroutine)
+                return
+            self._pending_per_key[key] = pending + 1
+        previous = self._tails.get(key) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._tails[key] = done
+        self._waiting += 1
+        waiting = True
+        slot = _Slot(self)
+        try:
+            if previous is not None and not previous.done():
+                # shield: отмена этого обновления не должна отменять ожидание предыдущего
+                await asyncio.shield(previous)
+            await self._acquire_slot(slot)
+            self._waiting -= 1
+            waiting = False
+            started = time.monotonic()
+            self.wait_time.observe(started - enqueued_at)
+            token = _current_slot.set(slot)
+            try:
+                await coroutine
+            finally:
+                _current_slot.reset(token)
+                self.processing_time.observe(time.monotonic() - started)
+                self.processed += 1
+        finally:
+            if slot.held:
+                self._release_slot(slot)
+            if waiting:
+                self._waiting -= 1
+                coroutine.close()  # обработчик так и не запустился
+            if previous is not None and not previous.done():
+                # Отменили раньше, чем дошла очередь: следующий ждет завершения предыдущего
+                previous.add_done_callback(lambda _: self._release(key, done))
+            else:
+                self._release(key, done)
+            if key is not None:
+                self._finish_pending(key)
+
+    async def _drop(self, key, update, coroutine):
+        coroutine.close()
+        self.dropped += 1
+        if key in self._overflowed or self.on_overflow is None:
+            return
+        self._overflowed.add(key)
+        try:
+            await self.on_overflow(update)
+        except Exception:
+            logger.exception("Ошибка on_overflow для %s", key)
+
+    def _finish_pending(self, key):
+        pending = self._pending_per_key[key] - 1
+        if pending:
+            self._pending_per_key[key] = pending
+        else:
+            del self._pending_per_key[key]
+            self._overflowed.discard(key)
+
+    async def _acquire_slot(self, slot: _Slot):
+        # При отмене во время ожидания слот не захватывается и held остается False
+        await self._slots.acquire()
+        slot.held = True
+        self._running += 1
+
+    def _release_slot(self, slot: _Slot):
+        slot.held = False
+        self._running -= 1
+        self._slots.release()
+
+    def _release(self, key, done: asyncio.Future):
+        done.set_result(None)
+        if key is not None and self._tails.get(key) is done:
+            del self._tails[key]
+
+    def stats(self) -> dict:
+        return {
+            'concurrency': self.concurrency,
+            'running': self._running,
+            'waiting': self._waiting,
+            'suspended': self._suspended,
+            'active_keys': len(self._tails),
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'wait_time': self.wait_time.snapshot(),
+            'processing_time': self.processing_time.snapshot(),
+        }
@@ -1,16 +1,140 @@
+import glob
 import json
+import logging
 import os
+from string import Formatter
 
-# Загружаем переводы один раз при старте
-translations = {}
-for lang in ['ru', 'en']:
-    path = os.path.join('locales', f'{lang}.json')
-    if os.path.exists(path):
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'locales'))
+# Базовый язык: эталон набора ключей и последнее звено любой цепочки
+DEFAULT_LANG = 'en'
+# Цепочки запасных языков: чего нет в языке, берется из следующих по порядку
+LOCALE_FALLBACKS = {
+    'uk': ('ru',),
+    'be': ('ru',),
+    'kk': ('ru',),
+}
+
+
+def _template_fields(path: str, key: str, template: str) -> frozenset:
+    try:
+        return frozenset(name for _, name, _, _ in Formatter().parse(template) if name is not None)
+    except ValueError as e:
+        raise ValueError(f"{path}: некорректный шаблон '{key}': {e}") from e
+
+
+def load_translations(locales_dir: str = LOCALES_DIR) -> dict:
+    """Читает все файлы locales/*.json и проверяет их. При ошибке бросает ValueError."""
+    loaded = {}
+    for path in sorted(glob.glob(os.path.join(locales_dir, '*.json'))):
+        lang = os.path.splitext(os.path.basename(path))[0]
         with open(path, 'r', encoding='utf-8') as f:
-            translations[lang] = json.load(f)
+            data = json.load(f)
+        if not isinstance(data, dict) or not all(isinstance(v, str) for v in data.values()):
+            raise ValueError(f"{path}: ожидается объект со строковыми значениями")
+        for key, template in data.items():
+            _template_fields(path, key, template)
+        loaded[lang] = data
+    if DEFAULT_LANG not in loaded:
+        raise ValueError(f"Не найден файл переводов {DEFAULT_LANG}.json")
+    validate_parity(loaded)
+    return loaded
+
+
+def validate_parity(all_translations: dict):
+    """Сверяет языки с базовым: подстановки должны совпадать, недостающие ключи — в лог.
+
+    Лишняя подстановка упала бы KeyError при форматировании, поэтому это ошибка.
+    Недостающий ключ закрывается цепочкой запасных языков, поэтому только предупреждение.
+    """
+    base = all_translations[DEFAULT_LANG]
+    for lang, lang_translations in all_translations.items():
+        if lang == DEFAULT_LANG:
+            continue
+        missing = sorted(set(base) - set(lang_translations))
+        extra = sorted(set(lang_translations) - set(base))
+        if missing:
+            logger.warning("В переводе %s нет ключей (будут взяты из запасных языков): %s", lang, ', '.join(missing))
+        if extra:
+            logger.warning("В переводе %s есть ключи, которых нет в %s: %s", lang, DEFAULT_LANG, ', '.join(extra))
+        for key in set(base) & set(lang_translations):
+            fields = _template_fields(lang, key, lang_translations[key])
+            base_fields = _template_fields(DEFAULT_LANG, key, base[key])
+            if fields != base_fields:
+                raise ValueError(f"{lang}.json: подстановки в '{key}' ({', '.join(sorted(fields))}) "
+                                 f"не совпадают с {DEFAULT_LANG}.json ({', '.join(sorted(base_fields))})")
+
+
+class LocaleCatalog:
+    """Скомпилированные переводы.
+
+    Для каждого языка заранее собирается полный словарь с учетом цепочки
+    запасных языков, поэтому поиск — одно обращение к словарю. Строки без
+    подстановок возвращаются как есть, без вызова format.
+    """
+
+    def __init__(self, all_translations: dict, fallbacks: dict = None):
+        self.fallbacks = LOCALE_FALLBACKS if fallbacks is None else fallbacks
+        self.languages = tuple(all_translations)
+        self._entries: dict[str, dict[str, tuple[str, bool]]] = {}
+        for lang in set(all_translations) | set(self.fallbacks):
+            entries = {}
+            # От последнего звена цепочки к первому: более точный язык перекрывает
+            for source in reversed(self.chain(lang)):
+                for key, template in all_translations.get(source, {}).items():
+                    # Шаблон без подстановок и экранированных скобок — готовая строка
+                    entries[key] = (template, '{' in template or '}' in template)
+            self._entries[lang] = entries
+        self.lookups: dict[str, int] = {}
+        self.missing: dict[tuple[str, str], int] = {}
+
+    def chain(self, lang: str) -> tuple[str, ...]:
+        """Цепочка языков для lang, например uk -> ru -> en."""
+        chain = [lang]
+        for fallback in self.fallbacks.get(lang, ()):
+            if fallback not in chain:
+                chain.append(fallback)
+        if DEFAULT_LANG not in chain:
+            chain.append(DEFAULT_LANG)
+        return tuple(chain)
+
+    def text(self, key: str, lang: str, kwargs: dict) -> str:
+        entries = self._entries.get(lang)
+        if entries is None:
+            lang = DEFAULT_LANG
+            entries = self._entries[lang]
+        self.lookups[lang] = self.lookups.get(lang, 0) + 1
+        entry = entries.get(key)
+        if entry is None:
+            if (lang, key) not in self.missing:
+                logger.warning("Нет перевода '%s' для языка %s", key, lang)
+            self.missing[(lang, key)] = self.missing.get((lang, key), 0) + 1
+            return f"_{key}_"
+        template, needs_format = entry
+        return template.format(**kwargs) if needs_format else template
+
+    def stats(self) -> dict:
+        return {
+            'languages': self.languages,
+            'lookups': dict(self.lookups),
+            'missing': {f"{lang}:{key}": count for (lang, key), count in self.missing.items()},
+        }
+
+
+# Загружаем переводы один раз при старте
+translations = load_translations()
+catalog = LocaleCatalog(translations)
+
+
+def replace_translations(new_translations: dict):
+    """Подменяет переводы целиком (без await между очисткой и заполнением)."""
+    global catalog
+    translations.clear()
+    translations.update(new_translations)
+    catalog = LocaleCatalog(new_translations)
 
 
 def get_text(key: str, lang: str, **kwargs) -> str:
     """Получает текст по ключу для нужного языка и форматирует его."""
-    text_template = translations.get(lang, translations['en']).get(key, f"_{key}_")
-    return text_template.format(**kwargs)
+    return catalog.text(key, lang, kwargs)
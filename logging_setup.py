@@ -0,0 +1,39 @@
+"""Настройка логирования: текстовый формат или структурированный JSON."""
+import json
+import logging
+from datetime import datetime, timezone
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Стандартные атрибуты LogRecord; все остальные пришли через extra= и попадают в JSON
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись лога — одна строка JSON с полями time, level, logger, message и extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure(log_format: str = 'text', level: str = 'INFO'):
+    handler = logging.StreamHandler()
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    elif log_format == 'text':
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        raise ValueError(f"Неизвестный LOG_FORMAT: {log_format}")
+    logging.basicConfig(level=level, handlers=[handler])
+    # httpx пишет INFO на каждый запрос к Bot API — это стоимость на каждое обновление
+    logging.getLogger('httpx').setLevel(logging.WARNING)
@@ -0,0 +1,266 @@
+"""Метрики бота в формате Prometheus и HTTP-эндпоинт /metrics.
+
+Метрики — обычные объекты в памяти процесса: счетчики, гистограммы и
+датчики, значения которых читаются только при запросе /metrics. Запись
+метрики на горячем пути — пара обращений к словарю, без логов и ввода-вывода.
+"""
+import asyncio
+import bisect
+import logging
+import math
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин для быстрых операций: обработчики, запросы к БД (секунды)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float('inf'))
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными границами корзин (секунды)."""
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': dict(zip(self.buckets, self.counts)),
+        }
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class _Family(ABC):
+    """Семейство метрик с одинаковым именем и набором меток.
+
+    Подкласс задает kind и строки значений (_samples); заголовок и формат
+    вывода общие.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict) -> tuple:
+        try:
+            return tuple(labels[name] for name in self.labelnames)
+        except KeyError as e:
+            raise ValueError(f"Метрика {self.name}: не задана метка {e}") from None
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> list[str]:
+        """Строки значений метрики в текстовом формате Prometheus."""
+
+
+class Counter(_Family):
+    """Монотонный счетчик с метками."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+                for key, value in sorted(self.values.items())]
+
+
+class HistogramFamily(_Family):
+    """Гистограммы с метками. labels() возвращает Histogram, который можно запомнить заранее."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=Histogram.BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self.children: dict[tuple, Histogram] = {}
+
+    def labels(self, **labels) -> Histogram:
+        key = self._key(labels)
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = Histogram(self.buckets)
+        return child
+
+    def observe(self, value: float, **labels):
+        self.labels(**labels).observe(value)
+
+    def attach(self, histogram: Histogram, **labels):
+        """Публикует уже существующую гистограмму (например, планировщика ИИ)."""
+        self.children[self._key(labels)] = histogram
+
+    def total_count(self) -> int:
+        return sum(child.count for child in self.children.values())
+
+    def _samples(self) -> list[str]:
+        lines = []
+        for key, child in sorted(self.children.items()):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(child.buckets, child.counts):
+                cumulative += count
+                bucket_labels = _format_labels({**labels, 'le': _format_value(bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {child.count}")
+        return lines
+
+
+class Gauge(_Family):
+    """Датчик, значение которого вычисляется при чтении.
+
+    collect() возвращает число или словарь {кортеж значений меток: число}.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, collect, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+
+    def _samples(self) -> list[str]:
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+                for key, value in sorted(values.items()) if value is not None]
+
+
+class Registry:
+    def __init__(self):
+        self._families: dict[str, _Family] = {}
+
+    def _register(self, family: _Family) -> _Family:
+        existing = self._families.get(family.name)
+        if existing is not None:
+            # Повторная регистрация (например, второй Application в том же процессе)
+            if type(existing) is not type(family) or existing.labelnames != family.labelnames:
+                raise ValueError(f"Метрика {family.name} уже зарегистрирована с другим типом или метками")
+            if isinstance(family, Gauge):
+                existing.collect = family.collect
+            return existing
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=Histogram.BUCKETS) -> HistogramFamily:
+        return self._register(HistogramFamily(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, collect, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, help_text, collect, labelnames))
+
+    def stats_gauge(self, name: str, help_text: str, stats):
+        """Публикует числовые поля словаря stats() как датчик с меткой stat."""
+        def collect():
+            return {(key,): value for key, value in stats().items()
+                    if isinstance(value, (int, float)) and not isinstance(value, bool)}
+        return self.gauge(name, help_text, collect, ('stat',))
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families.values():
+            try:
+                lines += family.render()
+            except Exception:
+                logger.exception("Не удалось собрать метрику %s", family.name)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки не нужны, но их надо дочитать до пустой строки
+        while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+            pass
+        parts = request_line.decode('latin-1').split()
+        path = parts[1].split('?', 1)[0] if len(parts) > 1 else ''
+        if len(parts) > 1 and parts[0] == 'GET' and path == '/metrics':
+            status, content_type, body = '200 OK', 'text/plain; version=0.0.4; charset=utf-8', REGISTRY.render()
+        else:
+            status, content_type, body = '404 Not Found', 'text/plain; charset=utf-8', 'not found\n'
+        payload = body.encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1') + payload
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Запускает HTTP-сервер с эндпоинтом GET /metrics в текущем event loop."""
+    server = await asyncio.start_server(_handle_http, host, port)
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return server
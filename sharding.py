@@ -0,0 +1,64 @@
+"""Шардирование пользователей между процессами-воркерами.
+
+Пользователь всегда обрабатывается одним воркером: user_id % count. Поэтому
+user_data, состояния диалогов, кэш профилей и буфер записи XP остаются
+локальными для процесса. Общие задачи (свертка журнала, очистка БД) выполняет
+только процесс, взявший аренду в таблице leases.
+"""
+import functools
+import logging
+import os
+import socket
+
+from database import db_handler
+
+logger = logging.getLogger(__name__)
+
+# Шард текущего процесса: (index, count) или None, если процесс один
+_shard: tuple[int, int] | None = None
+
+
+def set_shard(index: int, count: int):
+    global _shard
+    if not 0 <= index < count:
+        raise ValueError(f"Некорректный шард {index} из {count}")
+    _shard = (index, count)
+
+
+def current_shard() -> tuple[int, int] | None:
+    return _shard
+
+
+def shard_of(key_id: int, count: int) -> int:
+    """Номер шарда для user_id (или chat_id обновлений без пользователя)."""
+    return key_id % count
+
+
+def owns(user_id: int, shard: tuple[int, int] | None = None) -> bool:
+    """Принадлежит ли пользователь шарду (по умолчанию — шарду текущего процесса)."""
+    shard = shard or _shard
+    return shard is None or shard_of(user_id, shard[1]) == shard[0]
+
+
+def owner_id() -> str:
+    """Идентификатор владельца аренды: хост и PID процесса."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def singleton_job(name: str, callback, ttl: float):
+    """Оборачивает задачу job_queue так, чтобы среди шардов ее выполнял один процесс.
+
+    Аренда не отпускается после запуска: процесс, который ее держит, продлевает
+    ее при каждом запуске и остается исполнителем, пока жив. ttl должен быть
+    больше интервала задачи (берем с запасом, 3 интервала): иначе аренда истекает
+    между запусками и задачу выполняет тот, кто успел первым. Если исполнитель
+    умер, задачу подхватит другой процесс не позже чем через ttl. В режиме
+    одного процесса задача выполняется как есть.
+    """
+    @functools.wraps(callback)
+    async def wrapper(context):
+        if _shard is not None and not await db_handler.acquire_lease(f"job:{name}", owner_id(), ttl):
+            return
+        await callback(context)
+
+    return wrapper